@@ -0,0 +1,165 @@
+import math
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+import numpy as np
+import pandas as pd
+from HelperTA import HelperTA
+import ledger
+
+# Simulation process pools, kept across runs so a sweep pays the spawn start-up once
+_PROCESS_POOLS = {}
+_PROCESS_POOLS_LOCK = threading.Lock()
+
+
+class Backtest:
+    """Offline replay of marketCycle threshold rules through the paper-trading ledger.
+
+    A ticker is bought when its `column` crosses above `buy_level` (leaving the
+    oversold zone) and its whole position is sold when it crosses below
+    `sell_level` (leaving the overbought zone), filled at the bar's Close. Each
+    ticker trades its own sleeve of `cash / len(frames)`, so tickers are
+    independent and simulated in parallel on a process pool (`workers=0`
+    simulates in-process).
+
+    Crossings, the equity curve and the statistics are computed with array
+    operations over all bars; only the fills go through `ledger.apply_buy` and
+    `ledger.apply_sell`, the rules of live trades, so cash, avg_cost and
+    realized gains match what `/trade/buy` and `/trade/sell` would record.
+    Nothing is read from or written to Firestore.
+    """
+
+    def __init__(self, cash=100000, buy_level=20, sell_level=80, column='marketCycle', size=1.0, workers=None, market_cycle_params=None):
+        self.cash = cash
+        self.buy_level = buy_level
+        self.sell_level = sell_level
+        self.column = column
+        # Fraction of the sleeve's cash spent by a buy signal, in whole shares
+        self.size = size
+        self.workers = workers if workers is not None else os.cpu_count() or 1
+        # Computes `column` for frames lacking it, e.g. DataCaching(...).market_cycle_params
+        self.market_cycle_params = market_cycle_params
+
+    @staticmethod
+    def load(data_caching, tickers, timeframe='mc', start=None, end=None):
+        """Reads the stored series of `tickers` between `start` and `end`, the whole history by default."""
+        frames = {}
+        for ticker in tickers:
+            data = data_caching.get_data(ticker, timeframe, start=start if start is not None else pd.Timestamp(0), end=end)
+            if data is not None:
+                frames[ticker] = data
+        return frames
+
+    def run(self, frames):
+        """Backtests {ticker: frame} and returns {'equity', 'trades', 'summary'}.
+
+        `equity` has the value of each ticker's sleeve and their total
+        (`equity`) on the union of the bars, `trades` one row per fill with
+        the ledger's trade record plus `cash` after the fill and, for sells,
+        `profit` and `gains`.
+        """
+        if not frames:
+            raise ValueError('No data to backtest')
+        sleeve = self.cash / len(frames)
+        tickers = list(frames)
+        if self.workers and len(tickers) > 1:
+            results = self._map(self._simulate, tickers, [frames[ticker] for ticker in tickers], [sleeve] * len(tickers))
+        else:
+            results = [self._simulate(ticker, frames[ticker], sleeve) for ticker in tickers]
+
+        equity = pd.concat({ticker: curve for ticker, (curve, _) in zip(tickers, results)}, axis=1).sort_index()
+        # A sleeve is all cash before its first bar and keeps its last value after its last one
+        equity = equity.ffill().fillna(sleeve)
+        equity['equity'] = equity[tickers].sum(axis=1)
+        trades = [fill for _, fills in results for fill in fills]
+        trades = pd.DataFrame(trades, columns=['create_date', 'project', 'type', 'ticker', 'qty', 'price', 'cash', 'profit', 'gains'])
+        trades = trades.sort_values('create_date', kind='stable').reset_index(drop=True)
+        return {'equity': equity, 'trades': trades, 'summary': self._summary(equity['equity'], trades)}
+
+    def _executor(self):
+        with _PROCESS_POOLS_LOCK:
+            if self.workers not in _PROCESS_POOLS:
+                # spawn, like DataCaching's compute pool: the parent may hold gRPC channels
+                _PROCESS_POOLS[self.workers] = ProcessPoolExecutor(self.workers, mp_context=multiprocessing.get_context('spawn'))
+            return _PROCESS_POOLS[self.workers]
+
+    def _map(self, fn, *iterables):
+        """Results of `fn` over `iterables` on the shared pool; a broken pool is replaced and the tasks run again once."""
+        executor = self._executor()
+        try:
+            return list(executor.map(fn, *iterables))
+        except BrokenProcessPool:
+            # A worker died, e.g. killed out of memory: the pool refuses any new task
+            with _PROCESS_POOLS_LOCK:
+                if _PROCESS_POOLS.get(self.workers) is executor:
+                    del _PROCESS_POOLS[self.workers]
+            executor.shutdown(wait=False)
+            return list(self._executor().map(fn, *iterables))
+
+    def _simulate(self, ticker, frame, cash):
+        """Returns (sleeve value per bar, fills) for one ticker."""
+        frame = self._with_column(frame)
+        close = frame['Close'].to_numpy(dtype=float)
+        cycle = frame[self.column].to_numpy(dtype=float)
+        previous = np.concatenate([[np.nan], cycle[:-1]])
+        # NaN compares False, so bars of the indicator warm-up never signal
+        buys = (previous < self.buy_level) & (cycle >= self.buy_level) & np.isfinite(close)
+        sells = (previous > self.sell_level) & (cycle <= self.sell_level) & np.isfinite(close)
+
+        project_name = f"backtest-{ticker}"
+        starting_cash = cash
+        position = None
+        fills = []
+        fill_bars = []
+        holdings = []
+        for bar in np.flatnonzero(buys | sells):
+            price = float(close[bar])
+            now = frame.index[bar].to_pydatetime()
+            if buys[bar]:
+                qty = math.floor(cash * self.size / price)
+                if qty <= 0:
+                    continue
+                cash, position = ledger.apply_buy(cash, position, project_name, ticker, qty, price, now)
+                fills.append({**ledger.trade_record(project_name, 'buy', ticker, qty, price, now), 'cash': cash})
+            elif position is not None:
+                qty = position['qty']
+                cash, position, profit, gains = ledger.apply_sell(cash, position, qty, price, now)
+                fills.append({**ledger.trade_record(project_name, 'sell', ticker, qty, price, now), 'cash': cash, 'profit': profit, 'gains': gains})
+            else:
+                continue
+            fill_bars.append(bar)
+            holdings.append((cash, position['qty'] if position is not None else 0))
+
+        # Cash and shares are step functions changing at the fills, valued at each bar's Close
+        # Row 0 holds the sleeve before any fill
+        steps = np.asarray([(starting_cash, 0)] + holdings, dtype=float)
+        after = np.searchsorted(np.asarray(fill_bars, dtype=int), np.arange(len(frame)), side='right')
+        value = steps[after, 0] + steps[after, 1] * pd.Series(close).ffill().fillna(0).to_numpy()
+        return pd.Series(value, index=frame.index), fills
+
+    def _with_column(self, frame):
+        if self.column in frame.columns:
+            return frame
+        if self.market_cycle_params is None:
+            raise ValueError(f'Missing "{self.column}" column and no market_cycle_params to compute it')
+        frame = frame.dropna(subset=['Close']).copy()
+        price = frame['Close']
+        frame[self.column] = HelperTA().MarketCycle(price, price, price, **self.market_cycle_params)
+        return frame
+
+    def _summary(self, equity, trades):
+        values = equity.to_numpy(dtype=float)
+        peaks = np.maximum.accumulate(values)
+        sells = trades[trades['type'] == 'sell']
+        return {
+            'cash': self.cash,
+            'final_equity': float(values[-1]),
+            'return_percent': (values[-1] / self.cash - 1) * 100 if self.cash else 0,
+            'max_drawdown_percent': float(((peaks - values) / peaks).max() * 100) if len(values) else 0,
+            'trades': len(trades),
+            'realized_profit': float(sells['profit'].sum()),
+            'win_rate': float((sells['profit'] > 0).mean()) if len(sells) else None,
+            'bars': len(values)
+        }
@@ -0,0 +1,55 @@
+import numpy as np
+import pandas as pd
+
+
+class BarCodec:
+    """Columnar encoding of OHLCV frames for `paper_data` documents.
+
+    Format 2 stores the index as packed int64 UTC nanoseconds and every column
+    as one packed little-endian float64/int64 blob, so a document is decoded
+    straight into NumPy arrays. Documents written before the `format` field
+    existed hold a list of per-bar dicts and are still decoded.
+    """
+
+    FORMAT_VERSION = 2
+    # Fields holding the bars themselves, the rest of a document is metadata
+    FIELDS = ['format', 'index_name', 'length', 'index', 'columns', 'dtypes', 'values', 'data']
+
+    def encode(self, data):
+        index = data.index
+        if getattr(index, 'tz', None) is not None:
+            index = index.tz_convert('UTC').tz_localize(None)
+        columns = [str(col) for col in data.columns]
+        dtypes = []
+        values = []
+        for col in data.columns:
+            array = data[col].to_numpy()
+            dtype = '<i8' if np.issubdtype(array.dtype, np.integer) else '<f8'
+            dtypes.append(dtype)
+            values.append(np.ascontiguousarray(array, dtype=dtype).tobytes())
+        return {
+            'format': self.FORMAT_VERSION,
+            'index_name': data.index.name or 'Datetime',
+            'length': len(data),
+            'index': np.asarray(index.values, dtype='datetime64[ns]').astype('<i8').tobytes(),
+            'columns': columns,
+            'dtypes': dtypes,
+            'values': values
+        }
+
+    def decode(self, doc):
+        if doc.get('format') != self.FORMAT_VERSION:
+            return self._decode_records(doc)
+        index = pd.DatetimeIndex(np.frombuffer(doc['index'], dtype='<i8').astype('datetime64[ns]'), name=doc['index_name'])
+        columns = {
+            col: np.frombuffer(blob, dtype=dtype)
+            for col, dtype, blob in zip(doc['columns'], doc['dtypes'], doc['values'])
+        }
+        return pd.DataFrame(columns, index=index, columns=doc['columns'])
+
+    def _decode_records(self, doc):
+        # Legacy documents: 'data' is a list of {Datetime, Open, ..., marketCycle} dicts
+        df = pd.DataFrame(doc['data'])
+        datetime_col = 'Datetime' if 'Datetime' in df.columns else 'Date'
+        df[datetime_col] = pd.to_datetime(df[datetime_col], unit='s')
+        return df.set_index(datetime_col)
@@ -0,0 +1,108 @@
+import json
+import logging
+import os
+import threading
+import numpy as np
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+
+class BarStore:
+    """Local read-through/write-through store of stored series, keyed by `(ticker, timeframe)`.
+
+    Each entry holds the document metadata (`latest_timestamp`, `mc_state`, ...)
+    and the decoded frame. When `directory` is set, entries are also persisted
+    as one folder of `.npy` files per series and loaded back memory-mapped, so
+    a restarted process warms up from local disk. Callers decide freshness by
+    comparing `latest_timestamp` with Firestore and calling `invalidate`.
+    """
+
+    def __init__(self, directory=None):
+        self.directory = directory
+        self._entries = {}
+        self._lock = threading.Lock()
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    def get(self, key):
+        """Returns `(meta, frame)` for a series, or None when it is not stored locally."""
+        with self._lock:
+            entry = self._entries.get(key)
+        if entry is None and self.directory:
+            entry = self._load(key)
+            if entry is not None:
+                with self._lock:
+                    entry = self._entries.setdefault(key, entry)
+        if entry is None:
+            return None
+        meta, frame = entry
+        # Shallow copy so callers can re-index without touching the stored frame
+        return dict(meta), frame.copy(deep=False)
+
+    def put(self, key, meta, frame):
+        entry = (dict(meta), frame.copy())
+        with self._lock:
+            self._entries[key] = entry
+        if self.directory:
+            self._persist(key, *entry)
+
+    def invalidate(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+        if self.directory:
+            path = os.path.join(self._path(key), 'meta.json')
+            if os.path.exists(path):
+                os.remove(path)
+
+    def latest_timestamp(self, key):
+        entry = self.get(key)
+        return entry[0].get('latest_timestamp') if entry is not None else None
+
+    def _path(self, key):
+        return os.path.join(self.directory, f"{key[0]}_{key[1]}")
+
+    def _persist(self, key, meta, frame):
+        path = self._path(key)
+        os.makedirs(path, exist_ok=True)
+        index = frame.index
+        if getattr(index, 'tz', None) is not None:
+            index = index.tz_convert('UTC').tz_localize(None)
+        self._save_array(path, 'index.npy', np.asarray(index.values, dtype='datetime64[ns]').astype('<i8'))
+        for i, col in enumerate(frame.columns):
+            self._save_array(path, f"{i}.npy", frame[col].to_numpy())
+        layout = {
+            'meta': meta,
+            'index_name': frame.index.name,
+            'columns': [str(col) for col in frame.columns],
+            'length': len(frame)
+        }
+        # meta.json is written last, a series without it is ignored
+        tmp = os.path.join(path, 'meta.json.tmp')
+        with open(tmp, 'w') as f:
+            json.dump(layout, f)
+        os.replace(tmp, os.path.join(path, 'meta.json'))
+
+    def _save_array(self, path, name, array):
+        tmp = os.path.join(path, name + '.tmp.npy')
+        np.save(tmp, array)
+        os.replace(tmp, os.path.join(path, name))
+
+    def _load(self, key):
+        path = self._path(key)
+        try:
+            with open(os.path.join(path, 'meta.json')) as f:
+                layout = json.load(f)
+            index = np.load(os.path.join(path, 'index.npy'), mmap_mode='r')
+            columns = {
+                col: np.load(os.path.join(path, f"{i}.npy"), mmap_mode='r')
+                for i, col in enumerate(layout['columns'])
+            }
+        except (OSError, ValueError) as e:
+            if not isinstance(e, FileNotFoundError):
+                logger.error("Error loading local bars for %s: %s", key, e)
+            return None
+        if len(index) != layout['length'] or any(len(values) != layout['length'] for values in columns.values()):
+            return None
+        frame = pd.DataFrame(columns, index=pd.DatetimeIndex(index.astype('datetime64[ns]'), name=layout['index_name']), columns=layout['columns'])
+        return layout['meta'], frame
@@ -1,195 +1,570 @@
-import yfinance as yf
-from datetime import datetime, timedelta
+import logging
+import math
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
+from datetime import datetime, timedelta, timezone
 import pandas as pd
+import numpy as np
 from google.api_core.exceptions import RetryError, ServiceUnavailable
-from HelperTA import HelperTA
+from HelperTA import HelperTA, IncrementalMarketCycle
 from DataChart import DataChart
+from BarCodec import BarCodec
+from BarStore import BarStore
+from TimeframeAligner import TimeframeAligner
+from firestore_bulk import FirestoreBulkWriter, get_all
+from market_data import YFinanceProvider
+import metrics
 import matplotlib.pyplot as plt
 
+logger = logging.getLogger(__name__)
+
+# Compute process pools, shared by every DataCaching instance of the process
+_PROCESS_POOLS = {}
+_PROCESS_POOLS_LOCK = threading.Lock()
+
 
 class DataCaching:
-    def __init__(self, db, table='paper_data'):
-        print("Initializing DataCaching...")
+    def __init__(self, db, table='paper_data', bar_store=None, publisher=None, provider=None):
+        logger.debug("Initializing DataCaching...")
         self.db = db
         self.table = table
+        self.bar_store = bar_store if bar_store is not None else BarStore()
+        # Where bars come from, see market_data
+        self.provider = provider if provider is not None else YFinanceProvider()
+        # Streams the last bar of every saved series to subscribers, see PricePublisher
+        self.publisher = publisher
+        # Series checked against Firestore's latest_timestamp during this instance's lifetime
+        self._validated = set()
         self.tickers = []
+        # max_lookback: how far back Yahoo serves bars of that interval, in seconds
         self.timeframes = {
-            '1min': {'interval': '1m', 'period': 'max'},
-            '1h': {'interval': '1h', 'period': '3mo'},
-            '1D': {'interval': '1d', 'period': 'max'}
+            '1min': {'interval': '1m', 'period': 'max', 'seconds': 60, 'max_lookback': 7 * 86400},
+            '1h': {'interval': '1h', 'period': '3mo', 'seconds': 3600, 'max_lookback': 730 * 86400},
+            '1D': {'interval': '1d', 'period': 'max', 'seconds': 86400, 'max_lookback': None}
         }
+        # Bars returned by get_data and kept in the bar store, stored history is not capped
         self.max_datapoints = 250
+        # Series are stored as a head document and one segment document per time bucket,
+        # given as a pandas period frequency; other timeframes are bucketed by year
+        self.segment_freq = {'1min': 'D', '1h': 'M', '1D': 'Y', '5D': 'Y', 'mc': 'D'}
         self.helper_ta = HelperTA()
+        self.writer = FirestoreBulkWriter(db)
+        self.codec = BarCodec()
+        self.aligner = TimeframeAligner()
+        self.market_cycle_params = {
+            'donchianPeriod': 14,
+            'donchianSmoothing': 3,
+            'rsiPeriod': 14,
+            'rsiSmoothing': 3,
+            'srsiPeriod': 20,
+            'srsiSmoothing': 3,
+            'srsiK': 5,
+            'srsiD': 5,
+            'rsiWeight': 0.5,
+            'srsiWeight': 1.0,
+            'dcoWeight': 1.0
+        }
+        # Bars replayed to seed the incremental MarketCycle state, enough for the EWMs to converge
+        self.state_seed_bars = 1000
+        # Concurrency of the refresh pipeline stages, compute_workers=0 computes in-process
+        self.pipeline = {
+            'download_workers': 3,
+            'compute_workers': os.cpu_count() or 1,
+            'persist_workers': 4,
+            'chunk_size': 50,
+            'queue_size': 8
+        }
 
     def setTickers(self, tickers=[]):
-        print(f"Setting tickers: {tickers}")
+        logger.debug("Setting tickers: %s", tickers)
         self.tickers = tickers
 
     def init(self):
-        print("Initializing data...")
-        for timeframe, params in self.timeframes.items():
-            self._initialize_timeframe_data(timeframe, params)
-
-        self._generate_combined_market_cycle_data()
+        logger.info("Initializing data...")
+        self.refresh(initialize=True)
 
     def update_data(self):
-        print("Updating data...")
-        for timeframe, params in self.timeframes.items():
-            self._update_timeframe_data(timeframe, params)
+        logger.info("Updating data...")
+        self.refresh()
+
+    def refresh(self, timeframes=None, initialize=False):
+        """Initializes or updates only `timeframes` (all by default).
+
+        The refresh runs as a staged pipeline: timeframes are downloaded on a
+        thread pool, MarketCycle math runs per chunk of tickers on a process
+        pool and documents are written on another thread pool, so downloads,
+        computation and Firestore writes overlap. At most `queue_size` chunks
+        are between the download and persistence stages at any time. The
+        combined market-cycle frame is indexed by 1min bars, so it is only
+        regenerated when the 1min timeframe is part of the refresh.
+        """
+        timeframes = list(self.timeframes) if timeframes is None else timeframes
+        logger.info("Refreshing %s timeframes...", timeframes)
+        in_flight = threading.BoundedSemaphore(self.pipeline['queue_size'])
+        compute = self._compute_executor()
+        with ThreadPoolExecutor(self.pipeline['download_workers']) as downloads, ThreadPoolExecutor(self.pipeline['persist_workers']) as persists:
+            futures = [downloads.submit(self._download_timeframe, timeframe, initialize) for timeframe in timeframes]
+            for future in as_completed(futures):
+                timeframe, data = future.result()
+                tickers = list(data)
+                for i in range(0, len(tickers), self.pipeline['chunk_size']):
+                    chunk = {ticker: data[ticker] for ticker in tickers[i:i + self.pipeline['chunk_size']]}
+                    in_flight.acquire()
+                    try:
+                        computed = compute.submit(self._timed_compute, timeframe, initialize, chunk)
+                    except BrokenProcessPool:
+                        # A worker died, e.g. killed out of memory: the pool refuses any new task
+                        logger.warning("Compute pool is broken, recreating it")
+                        compute = self._replace_compute_executor(compute)
+                        computed = compute.submit(self._timed_compute, timeframe, initialize, chunk)
+                    computed.add_done_callback(lambda computed, timeframe=timeframe: self._queue_persist(persists, timeframe, computed, in_flight))
+            # Every chunk holds a slot until it is persisted, owning all slots means the pipeline is drained
+            for _ in range(self.pipeline['queue_size']):
+                in_flight.acquire()
+        if compute is not _PROCESS_POOLS.get(self.pipeline['compute_workers']):
+            compute.shutdown()
+
+        if '1min' in timeframes:
+            self._generate_combined_market_cycle_data()
+            self._flush_writes()
+
+    def _compute_executor(self):
+        workers = self.pipeline['compute_workers']
+        if not workers:
+            return ThreadPoolExecutor(1)
+        with _PROCESS_POOLS_LOCK:
+            if workers not in _PROCESS_POOLS:
+                # spawn: forking a process that already opened gRPC channels is unsafe
+                _PROCESS_POOLS[workers] = ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context('spawn'))
+            return _PROCESS_POOLS[workers]
 
-        self._generate_combined_market_cycle_data()
+    def _replace_compute_executor(self, broken):
+        """Evicts the broken shared pool `broken` and returns a new one."""
+        with _PROCESS_POOLS_LOCK:
+            workers = self.pipeline['compute_workers']
+            # Another refresh may have replaced it already
+            if _PROCESS_POOLS.get(workers) is broken:
+                del _PROCESS_POOLS[workers]
+        broken.shutdown(wait=False)
+        return self._compute_executor()
 
-    def _initialize_timeframe_data(self, timeframe, params):
-        print(f"Downloading data for {self.tickers} on {timeframe} timeframe...")
+    def _queue_persist(self, persists, timeframe, computed, in_flight):
+        """Done-callback of a compute future: hands the chunk over to the persistence stage."""
         try:
-            data = yf.download(tickers=self.tickers, interval=params['interval'], period=params['period'], group_by='ticker')
-            print(f"Downloaded data for {self.tickers} on {timeframe} timeframe.")
-            for ticker in self.tickers:
-                if ticker in data:
-                    ticker_data = data[ticker]
-                    if len(ticker_data) >= 220:
-                        try:
-                            ticker_data = self._calculate_market_cycle(ticker_data)
-                            if timeframe == '1D':
-                                self._generate_and_save_5d_data(ticker, ticker_data)
-                            ticker_data = self._trim_data(ticker_data)
-                            self._save_to_firestore(ticker, timeframe, ticker_data)
-                        except (RetryError, ServiceUnavailable) as e:
-                            print(f"Error saving data to Firestore for {ticker} on {timeframe} timeframe: {e}")
-                            print("Please check your internet connection and Google Cloud credentials.")
-                    else:
-                        print(f"Not enough data for {ticker} on {timeframe} timeframe")
-                else:
-                    print(f"No data found for {ticker} on {timeframe} timeframe")
+            persists.submit(self._persist_chunk, timeframe, computed, in_flight)
         except Exception as e:
-            print(f"Error downloading data for {self.tickers} on {timeframe} timeframe: {e}")
+            # e.g. the persist pool was shut down by a failing refresh, the chunk's slot is not released otherwise
+            metrics.stage_errors.inc(stage='persist', timeframe=timeframe)
+            logger.error("Error queueing data for Firestore on %s timeframe: %s", timeframe, e)
+            in_flight.release()
 
-    def _update_timeframe_data(self, timeframe, params):
-        print(f"Updating data for {self.tickers} on {timeframe} timeframe...")
+    def __getstate__(self):
+        # Only the computation settings travel to the compute processes
+        state = self.__dict__.copy()
+        for name in ['db', 'bar_store', 'writer', 'publisher', 'provider', '_validated']:
+            state[name] = None
+        return state
+
+    def _download_timeframe(self, timeframe, initialize):
+        """Download stage: returns (timeframe, {ticker: (new bars, stored series or None)})."""
+        params = self.timeframes[timeframe]
+        logger.info("Downloading data for %d tickers on %s timeframe...", len(self.tickers), timeframe)
         try:
-            data = yf.download(tickers=self.tickers, interval=params['interval'], period='1d', group_by='ticker')
-            print(f"Downloaded latest data for {self.tickers} on {timeframe} timeframe.")
-            for ticker in self.tickers:
-                if ticker in data:
-                    new_data = data[ticker]
-                    if not new_data.empty:
-                        try:
-                            existing_data = self.get_data(ticker, timeframe, trim=False)
-                            if existing_data is not None:
-                                # Ensure both new_data and existing_data have the same timezone awareness
-                                if new_data.index.tz is not None:
-                                    existing_data.index = existing_data.index.tz_localize(new_data.index.tz)
-                                else:
-                                    new_data.index = new_data.index.tz_localize(None)
-
-                                combined_data = pd.concat([existing_data, new_data]).drop_duplicates().sort_index()
-                                combined_data = self._calculate_market_cycle(combined_data)
-                                if timeframe == '1D':
-                                    self._generate_and_save_5d_data(ticker, combined_data)
-                                combined_data = self._trim_data(combined_data)
-                                self._save_to_firestore(ticker, timeframe, combined_data)
-                            else:
-                                print(f"No existing data found for {ticker} on {timeframe} timeframe, initializing.")
-                                new_data = self._calculate_market_cycle(new_data)
-                                self._save_to_firestore(ticker, timeframe, new_data)
-                        except (RetryError, ServiceUnavailable) as e:
-                            print(f"Error updating data to Firestore for {ticker} on {timeframe} timeframe: {e}")
-                            print("Please check your internet connection and Google Cloud credentials.")
+            with metrics.stage_seconds.time(stage='download', timeframe=timeframe):
+                data, series = self._download_stage(timeframe, params, initialize)
+            metrics.stage_items.inc(len(data), stage='download', timeframe=timeframe)
+            logger.info("Downloaded data for %d tickers on %s timeframe.", len(data), timeframe)
+        except Exception as e:
+            metrics.stage_errors.inc(stage='download', timeframe=timeframe)
+            logger.error("Error downloading data for %s on %s timeframe: %s", self.tickers, timeframe, e)
+            return timeframe, {}
+
+        for ticker in self.tickers:
+            if ticker not in data:
+                logger.warning("No data found for %s on %s timeframe", ticker, timeframe)
+        return timeframe, {
+            ticker: (data[ticker], series[(ticker, timeframe)], series.get((ticker, '5D')))
+            for ticker in self.tickers if ticker in data
+        }
+
+    def _download_stage(self, timeframe, params, initialize):
+        # 5D bars are derived from the 1D ones, their stored series travel along
+        timeframes = [timeframe, '5D'] if timeframe == '1D' else [timeframe]
+        keys = [(ticker, series_timeframe) for ticker in self.tickers for series_timeframe in timeframes]
+        if initialize:
+            return self._download(self.tickers, params['interval'], period=params['period']), {key: None for key in keys}
+        series = self._load_series(keys)
+        # Without a usable incremental state the series are recomputed, which needs
+        # the whole stored history: the bar store window alone has no warm-up
+        for ticker in self.tickers:
+            if series[(ticker, timeframe)] is None or all(self._has_state(series[(ticker, t)]) for t in timeframes):
+                continue
+            for key in [(ticker, t) for t in timeframes if series[(ticker, t)] is not None]:
+                series[key] = (series[key][0], self.get_data(*key, start=pd.Timestamp(0)))
+        return self._download_updates(timeframe, params, series), series
+
+    def _timed_compute(self, timeframe, initialize, chunk):
+        """Runs the compute stage in the worker and returns (seconds, saves), the metrics live in the parent."""
+        started = time.perf_counter()
+        saves = self._compute_timeframe(timeframe, initialize, chunk)
+        return time.perf_counter() - started, saves
+
+    def _compute_timeframe(self, timeframe, initialize, chunk):
+        """Compute stage: returns the (ticker, timeframe, data, state) documents to save for a chunk of tickers."""
+        saves = []
+        if initialize:
+            ready = [ticker for ticker, (data, _, _) in chunk.items() if len(data) >= 220]
+            computed = self._calculate_market_cycle_panel({ticker: chunk[ticker][0] for ticker in ready}, ready)
+            for ticker in chunk:
+                if ticker not in computed:
+                    logger.warning("Not enough data for %s on %s timeframe", ticker, timeframe)
+                    continue
+                ticker_data = computed[ticker]
+                state = self._market_cycle_state(ticker_data)
+                if timeframe == '1D':
+                    saves.extend(self._generate_5d_data(ticker, ticker_data))
+                saves.append((ticker, timeframe, ticker_data, state))
+            return saves
+
+        for ticker, (new_data, stored, stored_5d) in chunk.items():
+            if new_data.empty:
+                logger.debug("No new data found for %s on %s timeframe", ticker, timeframe)
+                continue
+            try:
+                if stored is not None:
+                    meta, existing_data = stored
+                    existing_data = self._localize(existing_data, new_data.index)
+                    if self._has_state(stored):
+                        combined_data, state = self._extend_market_cycle(existing_data, new_data, meta['mc_state'])
+                        # Bars before the latest stored one are unchanged
+                        changed_data = combined_data[combined_data.index >= existing_data.index[-1]]
                     else:
-                        print(f"No new data found for {ticker} on {timeframe} timeframe")
+                        # The whole history, see _download_stage: new bars replace stored ones from their first timestamp on
+                        combined_data = pd.concat([existing_data[existing_data.index < new_data.index[0]], new_data])
+                        combined_data = self._calculate_market_cycle(combined_data)
+                        state = self._market_cycle_state(combined_data)
+                        changed_data = self._changed_rows(existing_data, combined_data)
+                    if timeframe == '1D':
+                        saves.extend(self._generate_5d_data(ticker, combined_data, stored_5d))
+                    if changed_data is not None:
+                        saves.append((ticker, timeframe, changed_data, state))
                 else:
-                    print(f"No data found for {ticker} on {timeframe} timeframe")
+                    logger.info("No existing data found for %s on %s timeframe, initializing.", ticker, timeframe)
+                    new_data = self._calculate_market_cycle(new_data)
+                    saves.append((ticker, timeframe, new_data, self._market_cycle_state(new_data)))
+            except Exception as e:
+                logger.error("Error updating data for %s on %s timeframe: %s", ticker, timeframe, e)
+        return saves
+
+    def _persist_chunk(self, timeframe, computed, in_flight):
+        """Persistence stage: writes the documents of a computed chunk in batches."""
+        try:
+            seconds, saves = computed.result()
+            metrics.stage_seconds.observe(seconds, stage='compute', timeframe=timeframe)
+            metrics.stage_items.inc(len(saves), stage='compute', timeframe=timeframe)
+            writer = FirestoreBulkWriter(self.db)
+            # One bulk read for the stored series the saves are compared with
+            self._load_series([(ticker, save_timeframe) for ticker, save_timeframe, _, _ in saves])
+            for ticker, save_timeframe, data, state in saves:
+                self._save_to_firestore(ticker, save_timeframe, data, state=state, writer=writer)
+            writer.flush()
+        except (RetryError, ServiceUnavailable) as e:
+            metrics.stage_errors.inc(stage='persist', timeframe=timeframe)
+            logger.error("Error saving data to Firestore on %s timeframe, check the connection and Google Cloud credentials: %s", timeframe, e)
         except Exception as e:
-            print(f"Error updating data for {self.tickers} on {timeframe} timeframe: {e}")
+            metrics.stage_errors.inc(stage='compute', timeframe=timeframe)
+            logger.error("Error computing data on %s timeframe: %s", timeframe, e)
+        finally:
+            in_flight.release()
+
+    def _download_updates(self, timeframe, params, series):
+        """Downloads only the bars after each stored series' latest timestamp.
+
+        Tickers whose gaps are of the same order of magnitude share one download
+        starting at the oldest latest timestamp of the group; the latest stored
+        bar is fetched again so the still-open candle gets revised. Tickers with
+        no stored series get the last day of bars.
+        """
+        now = self.provider.now()
+        groups = {}
+        for ticker in self.tickers:
+            stored = series[(ticker, timeframe)]
+            if stored is None:
+                groups.setdefault(None, []).append(ticker)
+                continue
+            gap_bars = max((now - stored[0]['latest_timestamp']) / params['seconds'], 1)
+            groups.setdefault(int(math.log2(gap_bars)), []).append(ticker)
+
+        data = {}
+        for bucket, tickers in groups.items():
+            if bucket is None:
+                kwargs = {'period': '1d'}
+            else:
+                start = min(series[(ticker, timeframe)][0]['latest_timestamp'] for ticker in tickers)
+                if params['max_lookback']:
+                    start = max(start, now - params['max_lookback'])
+                kwargs = {'start': datetime.fromtimestamp(start, tz=timezone.utc)}
+            logger.debug("Downloading %s bars for %s (%s)", timeframe, tickers, kwargs)
+            data.update(self._download(tickers, params['interval'], **kwargs))
+        return data
+
+    def _download(self, tickers, interval, **kwargs):
+        """Runs one provider download and returns {ticker: frame} for the tickers it returned."""
+        return self.provider.download(tickers, interval, **kwargs)
 
     def _generate_combined_market_cycle_data(self):
+        # The series the pipeline just saved are served from the bar store, not re-read from Firestore
+        series = self._load_series([(ticker, timeframe) for ticker in self.tickers for timeframe in ['1min', '1h', '1D', '5D', 'mc']])
         for ticker in self.tickers:
             try:
-                print(f"Generating combined market cycle data for {ticker}...")
-                df_1min = self.get_data(ticker, '1min')
-                df_1h = self.get_data(ticker, '1h')
-                df_1d = self.get_data(ticker, '1D')
-                df_5d = self.get_data(ticker, '5D')
-
+                logger.debug("Generating combined market cycle data for %s...", ticker)
+                df_1min = self._to_data(series[(ticker, '1min')])
                 if df_1min is not None:
-                    combined_df = df_1min.copy()
-                    combined_df['marketCycle_1m'] = df_1min['marketCycle']
-
-                    if df_1h is not None:
-                        df_1h = df_1h[~df_1h.index.duplicated(keep='last')]
-                        combined_df['marketCycle_1h'] = df_1h['marketCycle'].reindex(combined_df.index, method='nearest')
-                    if df_1d is not None:
-                        df_1d = df_1d[~df_1d.index.duplicated(keep='last')]
-                        combined_df['marketCycle_1d'] = df_1d['marketCycle'].reindex(combined_df.index, method='nearest')
-                    if df_5d is not None:
-                        df_5d = df_5d[~df_5d.index.duplicated(keep='last')]
-                        combined_df['marketCycle_5d'] = df_5d['marketCycle'].reindex(combined_df.index, method='nearest')
-
+                    sources = {timeframe: self._to_data(series[(ticker, timeframe)]) for timeframe in ['1h', '1D', '5D']}
+                    combined_df = self.aligner.extend(self._to_data(series[(ticker, 'mc')]), df_1min, sources)
                     self._save_to_firestore(ticker, 'mc', combined_df)
 
             except Exception as e:
-                print(f"Error generating combined market cycle data for {ticker}: {e}")
+                logger.error("Error generating combined market cycle data for %s: %s", ticker, e)
 
-    def _generate_and_save_5d_data(self, ticker, df_1d_untrimmed):
+    def _generate_5d_data(self, ticker, df_1d, stored=None):
+        """Returns the 5D document to save for a ticker, derived from its 1D bars.
+
+        With a stored 5D series and its incremental state, only the 5D bars from
+        the latest stored one on are rebuilt, so `df_1d` only has to cover them.
+        Otherwise `df_1d` must be the whole 1D history and 5D is recomputed from
+        it, saving just the bars from the first one that changed.
+        """
         try:
-            print(f"Generating 5D data for {ticker} from 1D data...")
-            df_5d = self._resample_to_5d(df_1d_untrimmed)
-            df_5d = self._calculate_market_cycle(df_5d)
-            self._save_to_firestore(ticker, '5D', df_5d)
+            logger.debug("Generating 5D data for %s from 1D data...", ticker)
+            existing = self._localize(stored[1], df_1d.index) if stored is not None else None
+            if self._has_state(stored):
+                df_5d = self._resample_to_5d(df_1d[df_1d.index >= existing.index[-1]])
+                df_5d, state = self._extend_market_cycle(existing, df_5d, stored[0]['mc_state'])
+                return [(ticker, '5D', df_5d[df_5d.index >= existing.index[-1]], state)]
+            df_5d = self._calculate_market_cycle(self._resample_to_5d(df_1d))
+            state = self._market_cycle_state(df_5d)
+            if existing is not None:
+                df_5d = self._changed_rows(existing, df_5d)
+            return [(ticker, '5D', df_5d, state)] if df_5d is not None else []
         except Exception as e:
-            print(f"Error generating 5D data for {ticker}: {e}")
+            logger.error("Error generating 5D data for %s: %s", ticker, e)
+            return []
 
     def _calculate_market_cycle(self, _data):
         data = _data.copy()
         data = data.dropna(subset=[col for col in data.columns if col != 'marketCycle'])
-        donchianPrice = data['Close']
-        rsiPrice = data['Close']
-        srsiPrice = data['Close']
-        donchianPeriod = 14
-        donchianSmoothing = 3
-        rsiPeriod = 14
-        rsiSmoothing = 3
-        srsiPeriod = 20
-        srsiSmoothing = 3
-        srsiK = 5
-        srsiD = 5
-        rsiWeight = 0.5
-        srsiWeight = 1.0
-        dcoWeight = 1.0
-
-        market_cycle = self.helper_ta.MarketCycle(donchianPrice, rsiPrice, srsiPrice, donchianPeriod, donchianSmoothing, rsiPeriod, rsiSmoothing, srsiPeriod, srsiSmoothing, srsiK, srsiD, rsiWeight, srsiWeight, dcoWeight)
+        price = data['Close']
+        market_cycle = self.helper_ta.MarketCycle(price, price, price, **self.market_cycle_params)
         data = data.copy()
         data['marketCycle'] = market_cycle  # Use a copy of the data to avoid SettingWithCopyWarning
         return data
 
-    def _save_to_firestore(self, ticker, timeframe, data, trim=True):
-        print(f"Saving data for {ticker} on {timeframe} timeframe to Firestore...")
-        doc_ref = self.db.collection(self.table).document(f"{ticker}_{timeframe}")
+    def _calculate_market_cycle_panel(self, data, tickers):
+        """Same as `_calculate_market_cycle` for every ticker of a `group_by='ticker'` download at once."""
+        if not tickers:
+            return {}
+        frames = {ticker: data[ticker].drop(columns='marketCycle', errors='ignore') for ticker in tickers}
+        # Histories differ in length: every ticker is laid on the union of the bars,
+        # the bars a ticker lacks are invalid and skipped like dropped NaN rows
+        close = pd.concat({ticker: frame['Close'] for ticker, frame in frames.items()}, axis=1)
+        valid = pd.concat({ticker: frame.notna().all(axis=1) for ticker, frame in frames.items()}, axis=1)
+        valid = valid.reindex(close.index).fillna(False).astype(bool)
+        market_cycle = self.helper_ta.MarketCyclePanel(close, close, close, valid=valid.to_numpy(), **self.market_cycle_params)
+        market_cycle = pd.DataFrame(market_cycle, index=close.index, columns=close.columns)
+
+        computed = {}
+        for ticker, frame in frames.items():
+            ticker_data = frame[frame.notna().all(axis=1)].copy()
+            ticker_data['marketCycle'] = market_cycle[ticker].reindex(ticker_data.index).to_numpy()
+            computed[ticker] = ticker_data
+        return computed
+
+    def _has_state(self, stored):
+        """Whether a stored series has an incremental MarketCycle state matching its latest bar."""
+        if stored is None:
+            return False
+        state = stored[0].get('mc_state')
+        return state is not None and state.get('timestamp') == stored[0]['latest_timestamp']
+
+    def _localize(self, data, index):
+        """Stored timestamps are naive UTC, returns `data` in the timezone of `index`."""
+        data = data.set_axis(data.index.tz_localize('UTC'), axis=0)
+        if index.tz is not None:
+            return data.set_axis(data.index.tz_convert(index.tz), axis=0)
+        return data.set_axis(data.index.tz_localize(None), axis=0)
+
+    def _changed_rows(self, stored_data, data):
+        """Rows of a recomputed series from the first one differing from the stored series, None if none does."""
+        changed = self._first_change(stored_data, data)
+        if changed is None:
+            return None
+        rows = data[data.index >= changed]
+        # Only stored bars past the end of `data` changed: its last bar carries their removal
+        return rows if len(rows) else data.iloc[-1:]
+
+    def _market_cycle_state(self, data):
+        """Seeds the incremental MarketCycle state from a series whose last bar is the latest stored one."""
+        mc = IncrementalMarketCycle(**self.market_cycle_params)
+        mc.run(data['Close'].iloc[-self.state_seed_bars:])
+        state = mc.to_dict()
+        state['timestamp'] = data.index[-1].timestamp()
+        return state
+
+    def _extend_market_cycle(self, existing_data, new_data, state):
+        """Appends the bars of `new_data` to `existing_data`, computing only their MarketCycle values.
 
-        data_reset = data.reset_index()
-        datetime_col = 'Datetime' if 'Datetime' in data_reset.columns else 'Date'
-        print(f"Datetime column name: {datetime_col}")
+        The bar sharing the latest stored timestamp is the still-open candle: it is
+        revised in place. Older bars are already stored and are ignored.
+        """
+        mc = IncrementalMarketCycle.from_dict(state)
+        new_data = new_data.dropna(subset=[col for col in new_data.columns if col != 'marketCycle'])
+        latest = existing_data.index[-1]
+        new_data = new_data[new_data.index >= latest].copy()
+        market_cycle = []
+        for timestamp, close in new_data['Close'].items():
+            if timestamp == latest:
+                market_cycle.append(mc.revise(close))
+            else:
+                market_cycle.append(mc.update(close))
+        new_data['marketCycle'] = market_cycle
 
-        data_list = data_reset.to_dict('records')
+        if not new_data.empty and new_data.index[0] == latest:
+            existing_data = existing_data.iloc[:-1]
+        combined_data = pd.concat([existing_data, new_data])
+        state = mc.to_dict()
+        state['timestamp'] = combined_data.index[-1].timestamp()
+        return combined_data, state
 
-        if trim and len(data_list) > self.max_datapoints:
-            print(f"Trimming data from {len(data_list)} to {self.max_datapoints} datapoints")
-            data_list = data_list[-self.max_datapoints:]
+    def _save_to_firestore(self, ticker, timeframe, data, state=None, writer=None):
+        """Saves `data` over the stored bars from its first timestamp on, earlier bars are kept.
 
-        doc_data = {
+        Only the segments from the first bar differing from the stored series
+        are rewritten, on a tick usually just the open one, along with the head
+        document holding `latest_timestamp`, `mc_state` and the segment list.
+        """
+        if data.empty:
+            return
+        logger.debug("Saving data for %s on %s timeframe to Firestore...", ticker, timeframe)
+        key = (ticker, timeframe)
+        writer = writer or self.writer
+        # Keep the frame as Firestore will return it: naive UTC timestamps
+        if data.index.tz is not None:
+            data = data.set_axis(data.index.tz_convert('UTC').tz_localize(None), axis=0)
+        stored = self._load_series([key])[key]
+        meta, cached = stored if stored is not None else ({}, None)
+        segmented = meta.get('layout') == 'segments'
+        segments = dict(meta.get('segments') or {}) if segmented else {}
+
+        # Series stored in a single document are rewritten as segments in full
+        changed = self._first_change(cached if segmented else None, data)
+        if changed is None:
+            logger.debug("No changes for %s on %s timeframe", ticker, timeframe)
+            return
+        first = data.index[0]
+        first_bucket = self._buckets(data.index[:1], timeframe)[0]
+        dirty_bucket = self._buckets(pd.DatetimeIndex([changed]), timeframe)[0]
+
+        # The bars of the first bucket before `data` are kept, from the cache or from their segment
+        if cached is not None and len(cached) and cached.index[0] <= first:
+            history = cached[cached.index < first]
+        elif first_bucket in segments:
+            doc = self._segment_ref(ticker, timeframe, first_bucket).get().to_dict()
+            history = self.codec.decode(doc) if doc is not None else None
+            history = history[history.index < first] if history is not None else None
+        else:
+            history = None
+        if history is not None and list(history.columns) != list(data.columns):
+            history = history.reindex(columns=data.columns)
+        bars = pd.concat([history, data]) if history is not None and len(history) else data
+        buckets = self._buckets(bars.index, timeframe)
+
+        written = []
+        with metrics.stage_seconds.time(stage='serialize', timeframe=timeframe):
+            for bucket in pd.unique(buckets[buckets >= dirty_bucket]):
+                part = bars[buckets == bucket]
+                writer.set(self._segment_ref(ticker, timeframe, bucket), {
+                    'ticker': ticker,
+                    'timeframe': timeframe,
+                    'bucket': bucket,
+                    **self.codec.encode(part)
+                })
+                segments[bucket] = len(part)
+                written.append(bucket)
+        metrics.stage_items.inc(len(written), stage='serialize', timeframe=timeframe)
+        # Stored segments past the new bars no longer hold any
+        for bucket in [bucket for bucket in segments if bucket >= dirty_bucket and bucket not in written]:
+            writer.delete(self._segment_ref(ticker, timeframe, bucket))
+            del segments[bucket]
+
+        head = {
             'ticker': ticker,
             'timeframe': timeframe,
-            'latest_timestamp': data_list[-1][datetime_col].timestamp(),
-            'data': [{k: (v.timestamp() if k == datetime_col else v) for k, v in item.items()} for item in data_list]
+            'latest_timestamp': data.index[-1].timestamp(),
+            'layout': 'segments',
+            'segments': segments
         }
+        if state is not None:
+            head['mc_state'] = state
+        logger.debug("Queueing %d segments from %s...", len(written), dirty_bucket)
+        writer.set(self._document_ref(ticker, timeframe), head)
+
+        # The bar store keeps the whole buckets holding the latest max_datapoints bars
+        if len(bars) > self.max_datapoints:
+            bars = bars[buckets >= buckets[-self.max_datapoints]]
+        self.bar_store.put(key, head, bars)
+        self._validated.add(key)
+        if self.publisher is not None:
+            # Subscribers only see bars Firestore holds
+            writer.on_commit(lambda: self.publisher.publish_bars(ticker, timeframe, data))
+
+    def _first_change(self, cached, data):
+        """Timestamp of the first bar where `data` differs from the cached series, None if it does not."""
+        first = data.index[0]
+        if cached is None or not len(cached) or cached.index[0] > first or list(cached.columns) != list(data.columns):
+            return first
+        old = cached[cached.index >= first]
+        n = min(len(old), len(data))
+        same = old.index[:n] == data.index[:n]
+        for col in data.columns:
+            a = old[col].to_numpy()[:n]
+            b = data[col].to_numpy()[:n]
+            equal = a == b
+            if np.issubdtype(a.dtype, np.floating) or np.issubdtype(b.dtype, np.floating):
+                equal |= np.isnan(a.astype(float)) & np.isnan(b.astype(float))
+            same &= equal
+        mismatch = np.flatnonzero(~same)
+        if len(mismatch):
+            return data.index[mismatch[0]]
+        if len(data) > n:
+            return data.index[n]
+        # Stored bars past the end of `data` are dropped
+        return old.index[n] if len(old) > n else None
+
+    def _buckets(self, index, timeframe):
+        """Segment id of every timestamp of a naive UTC index, e.g. '2024-06-28' for daily buckets."""
+        return np.asarray(index.to_period(self.segment_freq.get(timeframe, 'Y')).astype(str))
 
-        print(f"Saving document with {len(doc_data['data'])} datapoints...")
-        doc_ref.set(doc_data)
-        print(f"Saved data for {ticker} on {timeframe} timeframe")
+    def _flush_writes(self):
+        """Commits the queued document writes in as few batches as Firestore allows."""
+        try:
+            self.writer.flush()
+        except (RetryError, ServiceUnavailable) as e:
+            logger.error("Error committing data to Firestore, check the connection and Google Cloud credentials: %s", e)
 
     def _resample_to_5d(self, data):
-        # Resample to 5-day intervals (Monday to Friday)
-        data_5d = data.resample('5D').agg({
+        # 5-day bins counted in calendar days from the Unix epoch, so a bin keeps its bounds
+        # whatever the first bar given; resample('5D') anchors them on the first bar
+        index = data.index
+        days = (index.tz_localize(None) if index.tz is not None else index).normalize()
+        starts = days - pd.to_timedelta((days - pd.Timestamp(0)).days % 5, unit='D')
+        if index.tz is not None:
+            starts = starts.tz_localize(index.tz)
+        data_5d = data.groupby(starts).agg({
             'Open': 'first',
             'High': 'max',
             'Low': 'min',
@@ -197,27 +572,125 @@ class DataCaching:
             'Adj Close': 'last',
             'Volume': 'sum'
         }).dropna()
+        data_5d.index.name = index.name
         return data_5d
 
-    def _trim_data(self, data):
-        if len(data) > self.max_datapoints:
-            print(f"Trimming data from {len(data)} to {self.max_datapoints} datapoints")
-            data = data.iloc[-self.max_datapoints:]
-        return data
+    def get_data(self, ticker, timeframe, trim=True, start=None, end=None):
+        """Latest bars of a series: the last max_datapoints, or all the cached ones with trim=False.
 
-    def get_data(self, ticker, timeframe, trim=True):
-        doc_ref = self.db.collection(self.table).document(f"{ticker}_{timeframe}")
-        doc = doc_ref.get()
-        if doc.exists:
-            data = doc.to_dict()['data']
-            df = pd.DataFrame(data)
-            datetime_col = 'Datetime' if 'Datetime' in df.columns else 'Date'
-            df[datetime_col] = pd.to_datetime(df[datetime_col], unit='s')
-            if trim and len(df) > self.max_datapoints:
-                df = df.iloc[-self.max_datapoints:]
-            return df.set_index(datetime_col)
+        With `start` and/or `end`, returns the stored bars in that range
+        instead, read from just the segments covering it.
+        """
+        key = (ticker, timeframe)
+        if start is not None or end is not None:
+            return self._get_range(key, start, end)
+        return self._to_data(self._load_series([key])[key], trim)
+
+    def _get_range(self, key, start, end):
+        stored = self._load_series([key])[key]
+        if stored is None:
+            return None
+        meta, cached = stored
+        start, end = [self._utc(bound) for bound in (start, end)]
+        if meta.get('layout') == 'segments':
+            freq = self.segment_freq.get(key[1], 'Y')
+            low = str(start.to_period(freq)) if start is not None else ''
+            high = str(end.to_period(freq)) if end is not None else '~'
+            wanted = sorted(bucket for bucket in meta['segments'] if low <= bucket <= high)
+            # Segments held by the bar store are not read again
+            cached_from = self._buckets(cached.index[:1], key[1])[0] if len(cached) else '~'
+            refs = [self._segment_ref(*key, bucket) for bucket in wanted if bucket < cached_from]
+            documents = get_all(self.db, refs)
+            frames = [self.codec.decode(documents[ref.path]) for ref in refs if documents[ref.path] is not None]
+            frames.append(cached[cached.index >= start] if start is not None else cached)
+            data = pd.concat(frames) if len(frames) > 1 else frames[0]
         else:
+            data = cached
+        if start is not None:
+            data = data[data.index >= start]
+        if end is not None:
+            data = data[data.index <= end]
+        return data
+
+    def _utc(self, timestamp):
+        if timestamp is None:
+            return None
+        timestamp = pd.Timestamp(timestamp)
+        return timestamp.tz_convert('UTC').tz_localize(None) if timestamp.tzinfo is not None else timestamp
+
+    def _to_data(self, stored, trim=True):
+        if stored is None:
             return None
+        df = stored[1]
+        if trim and len(df) > self.max_datapoints:
+            df = df.iloc[-self.max_datapoints:]
+        return df
+
+    def _load_series(self, keys):
+        """Returns {key: (meta, frame) or None} for `(ticker, timeframe)` keys.
+
+        Series are served from the bar store. The first time this instance needs a
+        series, its cached `latest_timestamp` is checked against Firestore with a
+        field-masked read, and only missing or outdated series are read: their
+        head document and the latest segments, holding max_datapoints bars.
+        """
+        unchecked = [key for key in dict.fromkeys(keys) if key not in self._validated]
+        if unchecked:
+            cached = [key for key in unchecked if self.bar_store.get(key) is not None]
+            if cached:
+                refs = {key: self._document_ref(*key) for key in cached}
+                stamps = get_all(self.db, refs.values(), field_paths=['latest_timestamp'])
+                for key, ref in refs.items():
+                    stamp = stamps[ref.path]
+                    if stamp is None or stamp.get('latest_timestamp') != self.bar_store.latest_timestamp(key):
+                        self.bar_store.invalidate(key)
+
+            missing = [key for key in unchecked if self.bar_store.get(key) is None]
+            for key, (meta, frame) in self._read_series(missing).items():
+                self.bar_store.put(key, meta, frame)
+            self._validated.update(unchecked)
+        return {key: self.bar_store.get(key) for key in keys}
+
+    def _document_ref(self, ticker, timeframe):
+        return self.db.collection(self.table).document(f"{ticker}_{timeframe}")
+
+    def _segment_ref(self, ticker, timeframe, bucket):
+        return self._document_ref(ticker, timeframe).collection('segments').document(bucket)
+
+    def _get_documents(self, keys):
+        """Reads many `(ticker, timeframe)` documents in bulk, returns {key: dict or None}."""
+        refs = {key: self._document_ref(*key) for key in keys}
+        documents = get_all(self.db, refs.values())
+        return {key: documents[ref.path] for key, ref in refs.items()}
+
+    def _read_series(self, keys):
+        """Reads the head documents and the latest segments of many series, returns {key: (meta, frame)}."""
+        heads = {key: doc for key, doc in self._get_documents(keys).items() if doc is not None}
+        tails = {}
+        for key, doc in heads.items():
+            if doc.get('layout') == 'segments':
+                # Newest segments first until they hold max_datapoints bars
+                tails[key] = []
+                held = 0
+                for bucket in sorted(doc['segments'], reverse=True):
+                    if held >= self.max_datapoints:
+                        break
+                    tails[key].insert(0, bucket)
+                    held += doc['segments'][bucket]
+        refs = {(key, bucket): self._segment_ref(*key, bucket) for key, buckets in tails.items() for bucket in buckets}
+        documents = get_all(self.db, refs.values())
+
+        series = {}
+        for key, doc in heads.items():
+            meta = {k: v for k, v in doc.items() if k not in self.codec.FIELDS}
+            if key not in tails:
+                # Written before segments, the bars are in the head document
+                series[key] = (meta, self.codec.decode(doc))
+                continue
+            frames = [self.codec.decode(documents[refs[(key, bucket)].path]) for bucket in tails[key] if documents[refs[(key, bucket)].path] is not None]
+            if frames:
+                series[key] = (meta, pd.concat(frames) if len(frames) > 1 else frames[0])
+        return series
 
     def chart(self, ticker, output_filename='image.png'):
         data = self.get_data(ticker, 'mc')
@@ -228,4 +701,4 @@ class DataCaching:
                 ['marketCycle_1m', 'marketCycle_1h', 'marketCycle_1d', 'marketCycle_5d', 20, 50, 80]
             ], output_filename=output_filename)
         else:
-            print(f"No data available for {ticker} to generate chart.")
+            logger.warning("No data available for %s to generate chart.", ticker)
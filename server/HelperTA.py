@@ -1,5 +1,8 @@
+import math
+from collections import deque
 import pandas as pd
 import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
 
 
 class HelperTA:
@@ -41,4 +44,338 @@ class HelperTA:
         k, d = self.stockRSI(srsiPrice, srsiK, srsiD, srsiPeriod, srsiSmoothing)
         aggr = ((DCO + DCOs) * dcoWeight + (rsiValue + rsiK) * rsiWeight + (k + d) * srsiWeight) / (2 * (dcoWeight + rsiWeight + srsiWeight))
         return aggr
-    
+
+    # Panel mode: the methods below work on 2-D time x ticker arrays and compute
+    # every ticker at once. Columns must be gap-free, MarketCyclePanel takes care
+    # of compacting columns with missing bars.
+
+    def RollingPanel(self, data, window, reducer=np.mean):
+        out = np.full(data.shape, np.nan)
+        if len(data) >= window:
+            out[window - 1:] = reducer(sliding_window_view(data, window, axis=0), axis=-1)
+        return out
+
+    def EwmPanel(self, data, span):
+        # pandas' recurrence, as in _Ewm, so flat stretches stay exactly flat
+        decay = 1.0 - 2.0 / (span + 1.0)
+        out = np.empty(data.shape)
+        weighted = np.full(data.shape[1:], np.nan)
+        old_wt = np.ones(data.shape[1:])
+        for t in range(len(data)):
+            value = data[t]
+            started = ~np.isnan(weighted)
+            observed = ~np.isnan(value)
+            np.multiply(old_wt, decay, out=old_wt, where=started)
+            np.divide(old_wt * weighted + value, old_wt + 1.0, out=weighted, where=started & observed & (weighted != value))
+            np.add(old_wt, 1.0, out=old_wt, where=started & observed)
+            np.copyto(weighted, value, where=~started & observed)
+            out[t] = weighted
+        return out
+
+    def StochasticPanel(self, data, period=14):
+        low = self.RollingPanel(data, period, np.min)
+        high = self.RollingPanel(data, period, np.max)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return 100 * ((data - low) / (high - low))
+
+    def RSIPanel(self, data, period=14):
+        delta = np.full(data.shape, np.nan)
+        delta[1:] = data[1:] - data[:-1]
+        up = np.where(delta < 0, 0.0, delta)
+        down = np.abs(np.where(delta > 0, 0.0, delta))
+        with np.errstate(divide='ignore', invalid='ignore'):
+            RS = self.EwmPanel(up, period) / self.EwmPanel(down, period)
+            return 100.0 - (100.0 / (1.0 + RS))
+
+    def stockRSIPanel(self, data, K=5, D=5, rsiPeriod=20, stochPeriod=3):
+        rsi = self.RSIPanel(data, period=rsiPeriod)
+        stoch = self.StochasticPanel(rsi, period=stochPeriod)
+        k = self.RollingPanel(stoch, K)
+        d = self.RollingPanel(k, D)
+        return (k, d)
+
+    def DCOPanel(self, data, donchianPeriod=20, smaPeriod=3):
+        lower = self.RollingPanel(data, donchianPeriod, np.min)
+        upper = self.RollingPanel(data, donchianPeriod, np.max)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            DCO = (data - lower) / (upper - lower) * 100
+        s = self.RollingPanel(DCO, smaPeriod)
+        return (DCO, s)
+
+    def MarketCyclePanel(self, donchianPrice, rsiPrice, srsiPrice, donchianPeriod, donchianSmoothing, rsiPeriod, rsiSmoothing, srsiPeriod, srsiSmoothing, srsiK, srsiD, rsiWeight, srsiWeight, dcoWeight, valid=None):
+        """MarketCycle for a whole time x ticker panel.
+
+        `valid` is an optional boolean mask of the bars to use. Each column is
+        computed as if its invalid bars had been dropped beforehand, which is
+        what the per-ticker path does with `dropna`, and invalid bars get NaN.
+        """
+        prices = [np.asarray(p, dtype=float) for p in (donchianPrice, rsiPrice, srsiPrice)]
+        if valid is not None:
+            valid = np.asarray(valid, dtype=bool)
+            # Stable sort moves the valid bars of each column to the top, in order
+            order = np.argsort(~valid, axis=0, kind='stable')
+            prices = [np.take_along_axis(p, order, axis=0) for p in prices]
+        donchianPrice, rsiPrice, srsiPrice = prices
+
+        DCO, DCOs = self.DCOPanel(donchianPrice, donchianPeriod, donchianSmoothing)
+        rsiValue = self.RSIPanel(rsiPrice, rsiPeriod)
+        rsiK = self.RollingPanel(rsiValue, rsiSmoothing)
+        k, d = self.stockRSIPanel(srsiPrice, srsiK, srsiD, srsiPeriod, srsiSmoothing)
+        aggr = ((DCO + DCOs) * dcoWeight + (rsiValue + rsiK) * rsiWeight + (k + d) * srsiWeight) / (2 * (dcoWeight + rsiWeight + srsiWeight))
+
+        if valid is not None:
+            aggr = np.take_along_axis(aggr, np.argsort(order, axis=0), axis=0)
+            aggr[~valid] = np.nan
+        return aggr
+
+
+def _divide(a, b):
+    # Same semantics as a pandas/numpy float division: x/0 is +-inf, 0/0 is NaN
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return float(np.float64(a) / np.float64(b))
+
+
+class _RollingExtremes:
+    """Rolling min/max over the last `window` values using monotonic deques.
+
+    A window containing a NaN yields NaN, like `Series.rolling(window).min()`.
+    """
+
+    def __init__(self, window):
+        self.window = window
+        self.count = 0
+        self.last_nan = -1
+        self.lows = deque()
+        self.highs = deque()
+
+    def update(self, value):
+        i = self.count
+        self.count += 1
+        if math.isnan(value):
+            self.last_nan = i
+        else:
+            while self.lows and self.lows[-1][1] >= value:
+                self.lows.pop()
+            self.lows.append((i, value))
+            while self.highs and self.highs[-1][1] <= value:
+                self.highs.pop()
+            self.highs.append((i, value))
+        while self.lows and self.lows[0][0] <= i - self.window:
+            self.lows.popleft()
+        while self.highs and self.highs[0][0] <= i - self.window:
+            self.highs.popleft()
+        if self.count < self.window or i - self.last_nan < self.window:
+            return np.nan, np.nan
+        return self.lows[0][1], self.highs[0][1]
+
+    def to_dict(self):
+        return {
+            'window': self.window,
+            'count': self.count,
+            'last_nan': self.last_nan,
+            # Firestore does not accept nested arrays, keep positions and values apart
+            'low_positions': [i for i, _ in self.lows],
+            'low_values': [v for _, v in self.lows],
+            'high_positions': [i for i, _ in self.highs],
+            'high_values': [v for _, v in self.highs]
+        }
+
+    @classmethod
+    def from_dict(cls, state):
+        obj = cls(state['window'])
+        obj.count = state['count']
+        obj.last_nan = state['last_nan']
+        obj.lows = deque(zip(state['low_positions'], state['low_values']))
+        obj.highs = deque(zip(state['high_positions'], state['high_values']))
+        return obj
+
+
+class _RollingMean:
+    """Rolling mean over the last `window` values, NaN while the window holds a NaN."""
+
+    def __init__(self, window):
+        self.window = window
+        self.values = deque(maxlen=window)
+
+    def update(self, value):
+        self.values.append(value)
+        if len(self.values) < self.window:
+            return np.nan
+        return math.fsum(self.values) / self.window
+
+    def to_dict(self):
+        return {'window': self.window, 'values': list(self.values)}
+
+    @classmethod
+    def from_dict(cls, state):
+        obj = cls(state['window'])
+        obj.values.extend(float(v) for v in state['values'])
+        return obj
+
+
+class _Ewm:
+    """Adjusted exponentially weighted mean, same as `Series.ewm(span=span).mean()`.
+
+    Follows pandas' own recurrence, a running weighted average and the weight
+    of its past values, so values are equal to the bit: a flat stretch gives
+    exactly flat means, and downstream ratios like the Stochastic's 0/0 are
+    NaN on the same bars as the batch computation.
+    """
+
+    def __init__(self, span):
+        self.span = span
+        self.decay = 1.0 - 2.0 / (span + 1.0)
+        self.weighted = np.nan
+        self.old_wt = 1.0
+
+    def update(self, value):
+        if not math.isnan(self.weighted):
+            self.old_wt *= self.decay
+            if not math.isnan(value):
+                if self.weighted != value:
+                    self.weighted = (self.old_wt * self.weighted + value) / (self.old_wt + 1.0)
+                self.old_wt += 1.0
+        elif not math.isnan(value):
+            self.weighted = value
+        return self.weighted
+
+    def to_dict(self):
+        return {'span': self.span, 'weighted': self.weighted, 'old_wt': self.old_wt}
+
+    @classmethod
+    def from_dict(cls, state):
+        obj = cls(state['span'])
+        if 'num' in state:
+            # States stored before: the weighted sum and total weight of the values
+            obj.weighted = state['num'] / state['den'] if state['den'] else np.nan
+            obj.old_wt = state['den'] if state['den'] else 1.0
+        else:
+            obj.weighted = state['weighted']
+            obj.old_wt = state['old_wt']
+        return obj
+
+
+class _IncrementalRSI:
+    def __init__(self, period):
+        self.prev = np.nan
+        self.up = _Ewm(period)
+        self.down = _Ewm(period)
+
+    def update(self, price):
+        delta = price - self.prev
+        self.prev = price
+        roll_up = self.up.update(max(delta, 0.0) if not math.isnan(delta) else np.nan)
+        roll_down = self.down.update(-min(delta, 0.0) if not math.isnan(delta) else np.nan)
+        RS = _divide(roll_up, roll_down)
+        return 100.0 - _divide(100.0, 1.0 + RS)
+
+    def to_dict(self):
+        return {'prev': self.prev, 'up': self.up.to_dict(), 'down': self.down.to_dict()}
+
+    @classmethod
+    def from_dict(cls, state):
+        obj = cls(state['up']['span'])
+        obj.prev = state['prev']
+        obj.up = _Ewm.from_dict(state['up'])
+        obj.down = _Ewm.from_dict(state['down'])
+        return obj
+
+
+class IncrementalMarketCycle:
+    """Streaming version of `HelperTA.MarketCycle`.
+
+    Each `update` consumes one new bar in O(1) and returns the MarketCycle value
+    for it, matching the batch computation over the same series. `revise`
+    replaces the last bar instead (e.g. the still-open candle of the current
+    period). The whole state round-trips through `to_dict`/`from_dict` so it can
+    be stored next to the series.
+    """
+
+    _COMPONENTS = ['dco_range', 'dco_mean', 'rsi', 'rsi_mean', 'srsi', 'srsi_range', 'srsi_k', 'srsi_d']
+
+    def __init__(self, donchianPeriod, donchianSmoothing, rsiPeriod, rsiSmoothing, srsiPeriod, srsiSmoothing, srsiK, srsiD, rsiWeight, srsiWeight, dcoWeight):
+        self.params = {
+            'donchianPeriod': donchianPeriod,
+            'donchianSmoothing': donchianSmoothing,
+            'rsiPeriod': rsiPeriod,
+            'rsiSmoothing': rsiSmoothing,
+            'srsiPeriod': srsiPeriod,
+            'srsiSmoothing': srsiSmoothing,
+            'srsiK': srsiK,
+            'srsiD': srsiD,
+            'rsiWeight': rsiWeight,
+            'srsiWeight': srsiWeight,
+            'dcoWeight': dcoWeight
+        }
+        self.dco_range = _RollingExtremes(donchianPeriod)
+        self.dco_mean = _RollingMean(donchianSmoothing)
+        self.rsi = _IncrementalRSI(rsiPeriod)
+        self.rsi_mean = _RollingMean(rsiSmoothing)
+        self.srsi = _IncrementalRSI(srsiPeriod)
+        self.srsi_range = _RollingExtremes(srsiSmoothing)
+        self.srsi_k = _RollingMean(srsiK)
+        self.srsi_d = _RollingMean(srsiD)
+        self.previous = None
+
+    def update(self, donchianPrice, rsiPrice=None, srsiPrice=None):
+        self.previous = self._components_to_dict()
+        return self._step(donchianPrice, rsiPrice, srsiPrice)
+
+    def revise(self, donchianPrice, rsiPrice=None, srsiPrice=None):
+        if self.previous is None:
+            raise ValueError('No bar to revise')
+        self._components_from_dict(self.previous)
+        return self._step(donchianPrice, rsiPrice, srsiPrice)
+
+    def run(self, donchianPrice, rsiPrice=None, srsiPrice=None):
+        """Feeds a whole series bar by bar and returns the MarketCycle values as a numpy array."""
+        donchianPrice = np.asarray(donchianPrice, dtype=float)
+        rsiPrice = donchianPrice if rsiPrice is None else np.asarray(rsiPrice, dtype=float)
+        srsiPrice = donchianPrice if srsiPrice is None else np.asarray(srsiPrice, dtype=float)
+        out = np.empty(len(donchianPrice))
+        for i in range(len(donchianPrice)):
+            out[i] = self.update(donchianPrice[i], rsiPrice[i], srsiPrice[i])
+        return out
+
+    def _step(self, donchianPrice, rsiPrice, srsiPrice):
+        donchianPrice = float(donchianPrice)
+        rsiPrice = donchianPrice if rsiPrice is None else float(rsiPrice)
+        srsiPrice = donchianPrice if srsiPrice is None else float(srsiPrice)
+        p = self.params
+
+        lower, upper = self.dco_range.update(donchianPrice)
+        DCO = _divide(donchianPrice - lower, upper - lower) * 100
+        DCOs = self.dco_mean.update(DCO)
+
+        rsiValue = self.rsi.update(rsiPrice)
+        rsiK = self.rsi_mean.update(rsiValue)
+
+        srsiValue = self.srsi.update(srsiPrice)
+        low, high = self.srsi_range.update(srsiValue)
+        stoch = 100 * _divide(srsiValue - low, high - low)
+        k = self.srsi_k.update(stoch)
+        d = self.srsi_d.update(k)
+
+        return ((DCO + DCOs) * p['dcoWeight'] + (rsiValue + rsiK) * p['rsiWeight'] + (k + d) * p['srsiWeight']) / (2 * (p['dcoWeight'] + p['rsiWeight'] + p['srsiWeight']))
+
+    def _components_to_dict(self):
+        return {name: getattr(self, name).to_dict() for name in self._COMPONENTS}
+
+    def _components_from_dict(self, state):
+        for name in self._COMPONENTS:
+            component = getattr(self, name)
+            setattr(self, name, type(component).from_dict(state[name]))
+
+    def to_dict(self):
+        return {
+            'params': dict(self.params),
+            'components': self._components_to_dict(),
+            'previous': self.previous
+        }
+
+    @classmethod
+    def from_dict(cls, state):
+        obj = cls(**state['params'])
+        obj._components_from_dict(state['components'])
+        obj.previous = state.get('previous')
+        return obj
@@ -0,0 +1,146 @@
+import itertools
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+import numpy as np
+import pandas as pd
+
+PARAMS = ['donchianPeriod', 'donchianSmoothing', 'rsiPeriod', 'rsiSmoothing', 'srsiPeriod', 'srsiSmoothing', 'srsiK', 'srsiD', 'rsiWeight', 'srsiWeight', 'dcoWeight']
+
+# Sweep process pools, kept across runs like DataCaching's compute pools
+_PROCESS_POOLS = {}
+_PROCESS_POOLS_LOCK = threading.Lock()
+
+
+def _donchian_components(prices, period, smoothings):
+    """(DCO + DCO smoothed) for one donchianPeriod and each smoothing, sharing the channel and DCO."""
+    lower = prices.rolling(window=period).min()
+    upper = prices.rolling(window=period).max()
+    dco = (prices - lower) / (upper - lower) * 100
+    return {('dco', period, smoothing): (dco + dco.rolling(window=smoothing).mean()).to_numpy() for smoothing in smoothings}
+
+
+def _rsi(prices, period):
+    delta = prices.diff()
+    roll_up = delta.clip(lower=0).ewm(span=period).mean()
+    roll_down = (-delta).clip(lower=0).ewm(span=period).mean()
+    return 100.0 - (100.0 / (1.0 + roll_up / roll_down))
+
+
+def _rsi_components(prices, period, rsi_smoothings, srsi_stages):
+    """RSI and stochastic RSI components of one RSI period, which both share.
+
+    Each stochastic stage (smoothing, then K, then D) is computed once and
+    reused by every combination extending it.
+    """
+    rsi = _rsi(prices, period)
+    components = {('rsi', period, smoothing): (rsi + rsi.rolling(window=smoothing).mean()).to_numpy() for smoothing in rsi_smoothings}
+    for smoothing, stages in srsi_stages.items():
+        low = rsi.rolling(window=smoothing).min()
+        high = rsi.rolling(window=smoothing).max()
+        stoch = 100 * ((rsi - low) / (high - low))
+        for k_window, d_windows in stages.items():
+            k = stoch.rolling(window=k_window).mean()
+            for d_window in d_windows:
+                components[('srsi', period, smoothing, k_window, d_window)] = (k + k.rolling(window=d_window).mean()).to_numpy()
+    return components
+
+
+class MarketCycleSweep:
+    """Evaluates HelperTA.MarketCycle for a grid of parameter sets at once.
+
+    MarketCycle is a weighted mean of three components: DCO (donchianPeriod,
+    donchianSmoothing), RSI (rsiPeriod, rsiSmoothing) and stochastic RSI
+    (srsiPeriod, srsiSmoothing, srsiK, srsiD). Each distinct component is
+    computed once, grouped by the rolling channel or RSI it derives from, on a
+    process pool (`workers=0` computes in-process). A combination then only
+    costs its weighted sum, so the weights are nearly free to sweep.
+    """
+
+    def __init__(self, workers=None):
+        self.workers = workers if workers is not None else os.cpu_count() or 1
+
+    @staticmethod
+    def grid(base, **ranges):
+        """Every combination of `ranges` ({param: values}), other parameters taken from `base`."""
+        names = list(ranges)
+        return [{**base, **dict(zip(names, values))} for values in itertools.product(*(ranges[name] for name in names))]
+
+    def run(self, prices, combinations, score=None):
+        """Sweeps `combinations` (parameter dicts) over `prices`, one series or a bars x series panel.
+
+        Returns {'params': DataFrame with one row per combination, 'values':
+        float32 array}. Without `score`, values holds the MarketCycle series,
+        shaped (combinations, bars) or (combinations, bars, series). With it,
+        values holds `score(market_cycle)` of each combination instead, e.g. a
+        backtest return, which keeps the result small for long sweeps.
+        """
+        params = pd.DataFrame(combinations, columns=PARAMS)
+        if params.isna().any().any():
+            raise ValueError('Every combination needs all MarketCycle parameters')
+        frame = pd.DataFrame(np.asarray(prices, dtype=float))
+        components = self._components(frame, params)
+
+        values = []
+        for row in params.itertuples(index=False):
+            weights = row.dcoWeight + row.rsiWeight + row.srsiWeight
+            market_cycle = (
+                components[('dco', row.donchianPeriod, row.donchianSmoothing)] * row.dcoWeight
+                + components[('rsi', row.rsiPeriod, row.rsiSmoothing)] * row.rsiWeight
+                + components[('srsi', row.srsiPeriod, row.srsiSmoothing, row.srsiK, row.srsiD)] * row.srsiWeight
+            ) / (2 * weights)
+            if np.ndim(prices) == 1:
+                market_cycle = market_cycle[:, 0]
+            values.append(score(market_cycle) if score is not None else market_cycle)
+        return {'params': params, 'values': np.asarray(values, dtype=np.float32)}
+
+    def _components(self, frame, params):
+        tasks = []
+        for period, group in params.groupby('donchianPeriod'):
+            tasks.append((_donchian_components, frame, period, sorted(set(group['donchianSmoothing']))))
+
+        # rsiPeriod and srsiPeriod values share their RSI
+        rsi_smoothings = {}
+        for period, smoothing in set(zip(params['rsiPeriod'], params['rsiSmoothing'])):
+            rsi_smoothings.setdefault(period, set()).add(smoothing)
+        srsi_stages = {}
+        for period, smoothing, k_window, d_window in set(zip(params['srsiPeriod'], params['srsiSmoothing'], params['srsiK'], params['srsiD'])):
+            srsi_stages.setdefault(period, {}).setdefault(smoothing, {}).setdefault(k_window, set()).add(d_window)
+        for period in sorted(set(rsi_smoothings) | set(srsi_stages)):
+            tasks.append((_rsi_components, frame, period, sorted(rsi_smoothings.get(period, ())), srsi_stages.get(period, {})))
+
+        components = {}
+        if self.workers and len(tasks) > 1:
+            for computed in self._map(_run_task, tasks):
+                components.update(computed)
+        else:
+            for task in tasks:
+                components.update(_run_task(task))
+        return components
+
+    def _executor(self):
+        with _PROCESS_POOLS_LOCK:
+            if self.workers not in _PROCESS_POOLS:
+                # spawn, like DataCaching's compute pool: the parent may hold gRPC channels
+                _PROCESS_POOLS[self.workers] = ProcessPoolExecutor(self.workers, mp_context=multiprocessing.get_context('spawn'))
+            return _PROCESS_POOLS[self.workers]
+
+    def _map(self, fn, *iterables):
+        """Results of `fn` over `iterables` on the shared pool; a broken pool is replaced and the tasks run again once."""
+        executor = self._executor()
+        try:
+            return list(executor.map(fn, *iterables))
+        except BrokenProcessPool:
+            # A worker died, e.g. killed out of memory: the pool refuses any new task
+            with _PROCESS_POOLS_LOCK:
+                if _PROCESS_POOLS.get(self.workers) is executor:
+                    del _PROCESS_POOLS[self.workers]
+            executor.shutdown(wait=False)
+            return list(self._executor().map(fn, *iterables))
+
+
+def _run_task(task):
+    fn, *args = task
+    return fn(*args)
@@ -0,0 +1,85 @@
+import numpy as np
+import pandas as pd
+
+
+def _nanoseconds(index):
+    return np.asarray(index.values, dtype='datetime64[ns]').astype('i8')
+
+
+class TimeframeAligner:
+    """Aligns higher timeframe marketCycle series onto the 1min bars.
+
+    Bars are timestamped by their start, but a bar's marketCycle is only
+    known once it has closed, `intervals[timeframe]` later. Each 1min bar
+    therefore gets the value of the latest higher timeframe bar closed by the
+    time the 1min bar closes (a backward as-of join on close times), found
+    with `searchsorted` on sorted int64 timestamps. A 1min bar never sees the
+    still-open higher timeframe bar it falls into, nor any later bar.
+    """
+
+    def __init__(self, columns=None, intervals=None, base_interval=pd.Timedelta(minutes=1)):
+        self.columns = columns or {
+            '1h': 'marketCycle_1h',
+            '1D': 'marketCycle_1d',
+            '5D': 'marketCycle_5d'
+        }
+        # Bar lengths: daily bars count as closed at the next midnight, after the session
+        self.intervals = intervals or {
+            '1h': pd.Timedelta(hours=1),
+            '1D': pd.Timedelta(days=1),
+            '5D': pd.Timedelta(days=5)
+        }
+        self.base_interval = base_interval
+
+    def asof(self, target_index, source):
+        """Values of the `source` series as of each timestamp of `target_index`."""
+        if not source.index.is_monotonic_increasing:
+            source = source.sort_index(kind='stable')
+        # side='right' lands after duplicated timestamps, so the last duplicate wins
+        positions = np.searchsorted(_nanoseconds(source.index), _nanoseconds(target_index), side='right') - 1
+        values = source.to_numpy(dtype=float)[np.maximum(positions, 0)]
+        return np.where(positions >= 0, values, np.nan)
+
+    def closed(self, timeframe, source):
+        """`source` indexed by the close time of its bars instead of their start."""
+        return source.set_axis(source.index + self.intervals[timeframe], axis=0)
+
+    def align(self, base, sources):
+        """Builds the combined frame: `base` with its own and every source's marketCycle aligned."""
+        combined = base.copy()
+        combined['marketCycle_1m'] = base['marketCycle']
+        closes = combined.index + self.base_interval
+        for timeframe, column in self.columns.items():
+            if sources.get(timeframe) is not None:
+                combined[column] = self.asof(closes, self.closed(timeframe, sources[timeframe]['marketCycle']))
+        return combined
+
+    def extend(self, combined, base, sources):
+        """Updates a previously combined frame with the new rows of `base`.
+
+        Rows before the last stored 1min bar are kept, unless they can see the
+        last closed bar of a source: that bar may have been revised since, or
+        closed since, while earlier bars are final. The rows from the first one
+        seeing it are recomputed along with the new ones, at most one source
+        bar's worth of rows.
+        """
+        columns = ['marketCycle_1m'] + [column for timeframe, column in self.columns.items() if sources.get(timeframe) is not None]
+        if combined is None or combined.empty or list(combined.columns) != list(base.columns) + columns:
+            return self.align(base, sources)
+
+        recompute_from = combined.index[-1]
+        end = base.index.max() + self.base_interval
+        for timeframe in self.columns:
+            source = sources.get(timeframe)
+            if source is None or source.empty:
+                continue
+            closes = source.index + self.intervals[timeframe]
+            closes = closes[closes <= end]
+            if len(closes):
+                # The first 1min bar closing at or after it sees the last closed bar
+                recompute_from = min(recompute_from, closes.max() - self.base_interval)
+        kept = combined[combined.index < recompute_from]
+        # Rows older than `base` are realigned from the 1min columns they already hold
+        older = combined[(combined.index >= recompute_from) & (combined.index < base.index.min())][list(base.columns)]
+        new_rows = self.align(pd.concat([older, base[base.index >= recompute_from]]), sources)
+        return pd.concat([kept, new_rows])
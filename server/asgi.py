@@ -0,0 +1,146 @@
+# asgi.py
+"""Async serving mode: uvicorn asgi:app --workers 2
+
+The read endpoints dominating traffic, /trade/positions, /trade/stats and
+/trade/prices, are served by async handlers using the Firestore async client
+and non-blocking quote fetches, so one process keeps many of them in flight
+instead of blocking a worker per request. Every other route falls through to
+the Flask app, mounted as a WSGI application, with its routes and responses
+unchanged.
+"""
+import contextlib
+import datetime
+import json
+import time
+from a2wsgi import WSGIMiddleware
+from firebase_admin import firestore_async
+from starlette.applications import Starlette
+from starlette.concurrency import run_in_threadpool
+from starlette.middleware import Middleware
+from starlette.middleware.cors import CORSMiddleware
+from starlette.responses import JSONResponse
+from starlette.routing import Mount, Route
+from werkzeug.http import http_date
+from main import app as flask_app, db, quote_cache, provider
+from market_data import YFinanceProvider
+from async_price_resolver import AsyncPriceResolver
+from trade_service import TradeService
+import metrics
+import portfolio
+
+async_db = firestore_async.client()
+# Sync service for the rare requests needing a transaction, e.g. building a missing portfolio
+trade_service = TradeService(db, quote_cache, provider=provider)
+price_resolver = None
+
+
+class FlaskJSONResponse(JSONResponse):
+    """Serializes like Flask's jsonify, so both modes return identical bodies."""
+
+    def render(self, content):
+        return json.dumps(content, default=self._default, separators=(',', ':')).encode('utf-8')
+
+    @staticmethod
+    def _default(value):
+        if isinstance(value, datetime.datetime):
+            return http_date(value)
+        raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+async def _valuation(project_name, fresh):
+    """Values the project's portfolio document, returns None when it was never built."""
+    portfolio_ref = async_db.collection('paper_portfolios').document(project_name)
+    portfolio_doc = await portfolio_ref.get()
+    if not portfolio_doc.exists:
+        return None
+
+    portfolio_data = portfolio_doc.to_dict()
+    prices = dict(portfolio_data.get('prices') or {})
+    missing = [ticker for ticker in portfolio_data['positions'] if fresh or ticker not in prices]
+    if missing:
+        prices.update(await price_resolver.get_many(missing))
+        changes = {'prices': {ticker: prices[ticker] for ticker in portfolio_data['positions'] if ticker in prices}}
+        if fresh:
+            changes['valued_at'] = portfolio_data['valued_at'] = datetime.datetime.now()
+        await portfolio_ref.update(changes)
+    return portfolio.summary(portfolio_data, prices)
+
+
+async def get_trade_stats(request):
+    project_name = request.query_params.get('project')
+    fresh = request.query_params.get('fresh', '').lower() in ('1', 'true')
+    if not project_name:
+        return FlaskJSONResponse({'error': 'Missing "project" parameter'}, 400)
+
+    try:
+        valuation = await _valuation(project_name, fresh)
+        if valuation is None:
+            response, status = await run_in_threadpool(trade_service.get_trade_stats, project_name, fresh)
+            return FlaskJSONResponse(response, status)
+        for position in valuation['positions']:
+            del position['profit']
+        return FlaskJSONResponse(valuation, 200)
+    except Exception as e:
+        return FlaskJSONResponse({'error': str(e)}, 500)
+
+
+async def get_positions(request):
+    project_name = request.query_params.get('project')
+    fresh = request.query_params.get('fresh', '').lower() in ('1', 'true')
+    if not project_name:
+        return FlaskJSONResponse({'error': 'Missing "project" parameter'}, 400)
+
+    try:
+        valuation = await _valuation(project_name, fresh)
+        if valuation is None:
+            response, status = await run_in_threadpool(trade_service.get_positions, project_name, fresh)
+            return FlaskJSONResponse(response, status)
+        return FlaskJSONResponse({
+            'positions': valuation['positions'],
+            'invested_value': valuation['invested_value'],
+            'open_value': valuation['open_value'],
+            'valued_at': valuation['valued_at']
+        }, 200)
+    except Exception as e:
+        return FlaskJSONResponse({'error': str(e)}, 500)
+
+
+async def get_prices(request):
+    tickers = request.query_params.get('tickers')
+    if not tickers:
+        return FlaskJSONResponse({'error': 'Missing "tickers" parameter'}, 400)
+    return FlaskJSONResponse(await price_resolver.get_many(tickers.split(',')), 200)
+
+
+def timed(route, handler):
+    """Observes a native handler in the same histogram as the Flask routes; mounted routes are timed by Flask."""
+    async def endpoint(request):
+        started = time.perf_counter()
+        response = await handler(request)
+        metrics.http_request_seconds.observe(
+            time.perf_counter() - started,
+            method=request.method, route=route, status=response.status_code
+        )
+        return response
+    return endpoint
+
+
+@contextlib.asynccontextmanager
+async def lifespan(app):
+    # Created on the server's event loop, which its connection pool and semaphore are bound to
+    global price_resolver
+    price_resolver = AsyncPriceResolver(quote_cache, provider=None if isinstance(provider, YFinanceProvider) else provider)
+    yield
+    await price_resolver.aclose()
+
+
+app = Starlette(
+    routes=[
+        Route('/trade/stats', timed('/trade/stats', get_trade_stats), methods=['GET']),
+        Route('/trade/positions', timed('/trade/positions', get_positions), methods=['GET']),
+        Route('/trade/prices', timed('/trade/prices', get_prices), methods=['GET']),
+        Mount('/', app=WSGIMiddleware(flask_app))
+    ],
+    middleware=[Middleware(CORSMiddleware, allow_origins=['*'], allow_methods=['*'], allow_headers=['*'])],
+    lifespan=lifespan
+)
@@ -0,0 +1,89 @@
+# async_price_resolver.py
+import asyncio
+import logging
+import time
+import httpx
+from quote_cache import QuoteCache
+import metrics
+
+logger = logging.getLogger(__name__)
+
+CHART_URL = 'https://query1.finance.yahoo.com/v8/finance/chart/{ticker}'
+
+
+class AsyncPriceResolver:
+    """Non-blocking counterpart of PriceResolver for the ASGI app.
+
+    Shares the process' QuoteCache with the Flask routes. Misses are fetched
+    from Yahoo's chart API over a pooled httpx client, at most `concurrency`
+    at a time, and concurrent requests for the same ticker await a single
+    fetch. The whole resolution is capped by `deadline` seconds; a ticker
+    that could not be priced is left out of the result. With a `provider`,
+    such as the offline ReplayProvider, quotes come from it on worker threads
+    instead.
+    """
+
+    def __init__(self, quote_cache=None, client=None, concurrency=16, deadline=10, provider=None):
+        self.quote_cache = quote_cache if quote_cache is not None else QuoteCache()
+        self.provider = provider
+        self.client = client if client is not None else httpx.AsyncClient(
+            timeout=deadline,
+            headers={'User-Agent': 'Mozilla/5.0'},
+            limits=httpx.Limits(max_connections=concurrency)
+        )
+        self.deadline = deadline
+        self._semaphore = asyncio.Semaphore(concurrency)
+        self._flights = {}
+
+    async def get_many(self, tickers):
+        """Returns a {ticker: price} dict, tickers without a price are omitted."""
+        tickers = list(dict.fromkeys(tickers))
+        prices = self.quote_cache.peek_many(tickers)
+        missing = [ticker for ticker in tickers if ticker not in prices]
+        if missing:
+            flights = [self._flight(ticker) for ticker in missing]
+            done, not_done = await asyncio.wait(flights, timeout=self.deadline)
+            for ticker, flight in zip(missing, flights):
+                if flight in done and flight.result() is not None:
+                    prices[ticker] = flight.result()
+                elif flight in not_done:
+                    logger.warning("Timed out fetching price for %s", ticker)
+        return prices
+
+    async def aclose(self):
+        await self.client.aclose()
+
+    def _flight(self, ticker):
+        flight = self._flights.get(ticker)
+        if flight is None:
+            flight = self._flights[ticker] = asyncio.ensure_future(self._fetch(ticker))
+            flight.add_done_callback(lambda _: self._flights.pop(ticker, None))
+        # Shielded: a request timing out must not cancel the fetch other requests await
+        return asyncio.ensure_future(asyncio.shield(flight))
+
+    async def _fetch(self, ticker):
+        started = time.perf_counter()
+        try:
+            return await self._fetch_price(ticker)
+        finally:
+            metrics.stage_seconds.observe(time.perf_counter() - started, stage='price_fetch')
+            metrics.stage_items.inc(stage='price_fetch')
+
+    async def _fetch_price(self, ticker):
+        try:
+            if self.provider is not None:
+                async with self._semaphore:
+                    price = await asyncio.to_thread(self.provider.latest_price, ticker)
+                if price is not None:
+                    self.quote_cache.put(ticker, price)
+                return price
+            async with self._semaphore:
+                response = await self.client.get(CHART_URL.format(ticker=ticker), params={'range': '1d', 'interval': '1m'})
+            response.raise_for_status()
+            price = float(response.json()['chart']['result'][0]['meta']['regularMarketPrice'])
+        except Exception as e:
+            metrics.stage_errors.inc(stage='price_fetch')
+            logger.error("Error fetching price for %s: %s", ticker, e)
+            return None
+        self.quote_cache.put(ticker, price)
+        return price
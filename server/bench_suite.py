@@ -0,0 +1,359 @@
+# bench_suite.py
+"""Offline benchmark suite for the data pipeline and the trade endpoints.
+
+Runs on synthetic OHLCV replayed by ReplayProvider and on MemoryFirestore, so
+results do not depend on Yahoo or on Firestore, and writes them as JSON:
+
+    python bench_suite.py --output bench.json
+    python bench_suite.py --quick --only indicators,serialization
+    python bench_suite.py --output new.json --compare bench.json
+
+Sections:
+    indicators     HelperTA.MarketCycle across series lengths, the panel
+                   version across ticker counts, IncrementalMarketCycle updates,
+                   with the max_abs_diff of the last two from the batch values
+    serialization  _save_to_firestore + flush of a new series and of a tick,
+                   get_data of the latest bars and of the history (bar store cold)
+    pipeline       DataCaching init() and update_data() on replayed bars
+    endpoints      latency percentiles of the trade endpoints (Flask test client)
+    backtest       Backtest.run on a year of 1m bars (a month with --quick),
+                   in-process and on the process pool
+    sweep          MarketCycleSweep over a MarketCycle parameter grid, against
+                   HelperTA.MarketCycle per combination
+
+Timings are in milliseconds.
+"""
+import argparse
+import datetime
+import json
+import logging
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import numpy as np
+import pandas as pd
+from flask import Flask
+from Backtest import Backtest
+from BarStore import BarStore
+from DataCaching import DataCaching
+from firestore_bulk import document_size
+from HelperTA import HelperTA, IncrementalMarketCycle
+from market_data import ReplayProvider
+from MarketCycleSweep import MarketCycleSweep
+from memory_firestore import MemoryFirestore
+from project_service import ProjectService
+from quote_cache import QuoteCache
+from trade_blueprint import TradeServices, create_trade_blueprint
+
+SESSION_MINUTES = 390
+
+
+def synthetic_ohlcv(index, seed):
+    """Geometric random walk bars on `index`, reproducible from `seed`."""
+    rng = np.random.default_rng(seed)
+    close = 100 * np.exp(np.cumsum(rng.normal(0, 0.001, len(index))))
+    spread = close * rng.uniform(0, 0.002, len(index))
+    return pd.DataFrame({
+        'Open': np.concatenate([[close[0]], close[:-1]]),
+        'High': close + spread,
+        'Low': close - spread,
+        'Close': close,
+        'Adj Close': close,
+        'Volume': rng.integers(100, 10000, len(index))
+    }, index=index)
+
+
+def write_replay_files(directory, tickers, days):
+    """Writes 1m bars of `days` regular sessions and two years of 1d bars per ticker."""
+    sessions = pd.bdate_range(end='2024-06-28', periods=days)
+    minutes = pd.DatetimeIndex(np.concatenate([
+        pd.date_range(session + pd.Timedelta(hours=13, minutes=30), periods=SESSION_MINUTES, freq='min').values
+        for session in sessions
+    ]), tz='UTC')
+    daily = pd.bdate_range(end=sessions[-1], periods=504)
+    for i, ticker in enumerate(tickers):
+        synthetic_ohlcv(minutes, i).to_csv(os.path.join(directory, f"{ticker}_1m.csv"))
+        synthetic_ohlcv(daily, 10000 + i).to_csv(os.path.join(directory, f"{ticker}_1d.csv"))
+    return sessions
+
+
+def summarize(samples):
+    samples = np.sort(np.asarray(samples, dtype=float) * 1000)
+    return {
+        'n': len(samples),
+        'min': float(samples[0]),
+        'median': float(np.median(samples)),
+        'mean': float(samples.mean()),
+        'p90': float(np.percentile(samples, 90)),
+        'p99': float(np.percentile(samples, 99)),
+        'max': float(samples[-1])
+    }
+
+
+def measure(fn, repeat):
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - started)
+    return summarize(samples)
+
+
+def max_abs_diff(actual, expected):
+    """Largest absolute difference of two arrays, inf when their NaNs are not at the same positions."""
+    actual, expected = np.asarray(actual, dtype=float), np.asarray(expected, dtype=float)
+    nan = np.isnan(actual)
+    if not np.array_equal(nan, np.isnan(expected)):
+        return float('inf')
+    return float(np.max(np.abs(actual[~nan] - expected[~nan]), initial=0.0))
+
+
+def bench_indicators(quick):
+    helper_ta = HelperTA()
+    params = DataCaching(MemoryFirestore(), bar_store=BarStore()).market_cycle_params
+    results = {'series': {}, 'panel': {}, 'incremental': {}}
+    repeat = 3 if quick else 10
+
+    for length in ([1000, 10000] if quick else [1000, 10000, 100000]):
+        close = synthetic_ohlcv(pd.RangeIndex(length), length)['Close']
+        results['series'][str(length)] = measure(lambda: helper_ta.MarketCycle(close, close, close, **params), repeat)
+
+    for tickers in ([10, 100] if quick else [10, 100, 500]):
+        panel = np.column_stack([synthetic_ohlcv(pd.RangeIndex(1000), i)['Close'].to_numpy() for i in range(tickers)])
+        expected = np.column_stack([helper_ta.MarketCycle(*[pd.Series(panel[:, i])] * 3, **params).to_numpy() for i in range(tickers)])
+        results['panel'][str(tickers)] = {
+            'panel': measure(lambda: helper_ta.MarketCyclePanel(panel, panel, panel, **params), repeat),
+            'per_ticker': measure(lambda: [helper_ta.MarketCycle(pd.Series(panel[:, i]), pd.Series(panel[:, i]), pd.Series(panel[:, i]), **params) for i in range(tickers)], repeat),
+            'max_abs_diff': max_abs_diff(helper_ta.MarketCyclePanel(panel, panel, panel, **params), expected)
+        }
+
+    close = synthetic_ohlcv(pd.RangeIndex(2000), 7)['Close'].to_numpy()
+    seeded = IncrementalMarketCycle(**params)
+    seeded.run(close[:1000])
+    state = seeded.to_dict()
+
+    def update_bars():
+        mc = IncrementalMarketCycle.from_dict(state)
+        return [mc.update(price) for price in close[1000:]]
+    results['incremental']['1000_updates'] = measure(update_bars, repeat)
+    expected = helper_ta.MarketCycle(*[pd.Series(close)] * 3, **params).to_numpy()
+    results['incremental']['max_abs_diff'] = max_abs_diff(update_bars(), expected[1000:])
+    results['incremental']['state_roundtrip'] = measure(lambda: IncrementalMarketCycle.from_dict(seeded.to_dict()), repeat * 10)
+    return results
+
+
+def bench_serialization(quick):
+    results = {}
+    repeat = 3 if quick else 10
+    for length in ([250, 5000] if quick else [250, 5000, 50000]):
+        index = pd.date_range('2024-01-02 14:30', periods=length, freq='min', tz='UTC')
+        data = synthetic_ohlcv(index, length)
+        data['marketCycle'] = np.linspace(0, 100, length)
+        db = MemoryFirestore()
+        cache = DataCaching(db, bar_store=BarStore())
+        series = iter(range(10 ** 6))
+
+        def save():
+            # A new series every time, so every segment is written
+            cache._save_to_firestore(f"S{next(series)}", '1min', data)
+            cache._flush_writes()
+
+        def tick():
+            # The last bar revised, saved with the recent bars like the pipeline does:
+            # only the open segment and the head are written
+            data.iloc[-1, data.columns.get_loc('Close')] += 0.01
+            cache._save_to_firestore('AAA', '1min', data.iloc[-cache.max_datapoints:])
+            cache._flush_writes()
+
+        def load(**kwargs):
+            # A cold bar store forces the Firestore read and decode path
+            reader = DataCaching(db, bar_store=BarStore())
+            reader.get_data('AAA', '1min', trim=False, **kwargs)
+
+        cache._save_to_firestore('AAA', '1min', data)
+        cache._flush_writes()
+        segments = db.collection(cache.table).document('AAA_1min').collection('segments').get()
+        results[str(length)] = {
+            'save': measure(save, repeat),
+            'tick': measure(tick, repeat),
+            'get_data': measure(load, repeat),
+            'get_history': measure(lambda: load(start=index[0]), repeat),
+            'head_bytes': document_size(cache._document_ref('AAA', '1min').get().to_dict()),
+            'segment_bytes': max(document_size(segment.to_dict()) for segment in segments)
+        }
+    return results
+
+
+def bench_pipeline(quick, directory):
+    tickers = [f"T{i:03d}" for i in range(5 if quick else 50)]
+    write_replay_files(directory, tickers, 3 if quick else 5)
+    provider = ReplayProvider(directory, speed=0, start='2024-06-28 16:00')
+    db = MemoryFirestore()
+    bar_store = BarStore()
+
+    def cache():
+        data_caching = DataCaching(db, bar_store=bar_store, provider=provider)
+        data_caching.setTickers(tickers)
+        if quick:
+            data_caching.pipeline['compute_workers'] = 0
+        return data_caching
+
+    results = {'tickers': len(tickers)}
+    started = time.perf_counter()
+    cache().init()
+    results['init'] = summarize([time.perf_counter() - started])
+    results['init_firestore_calls'] = dict(db.calls)
+
+    updates = []
+    for _ in range(3 if quick else 10):
+        provider.advance(60)
+        data_caching = cache()
+        started = time.perf_counter()
+        data_caching.update_data()
+        updates.append(time.perf_counter() - started)
+    results['update_data'] = summarize(updates)
+    results['firestore_calls'] = dict(db.calls)
+    return results
+
+
+def bench_endpoints(quick, directory):
+    tickers = [f"T{i:03d}" for i in range(20)]
+    write_replay_files(directory, tickers, 2)
+    provider = ReplayProvider(directory, speed=0, start='2024-06-28 16:00')
+    db = MemoryFirestore()
+    ProjectService(db).create_project({'name': 'bench', 'cash': 10 ** 9})
+
+    app = Flask(__name__)
+    app.register_blueprint(create_trade_blueprint(TradeServices(db, QuoteCache(ttl=3600), provider=provider)))
+    client = app.test_client()
+    repeat = 50 if quick else 500
+    rng = np.random.default_rng(0)
+
+    def buy():
+        client.post('/trade/buy', json={'project': 'bench', 'ticker': str(rng.choice(tickers)), 'qty': 1, 'price': 100})
+
+    def sell():
+        client.post('/trade/sell', json={'project': 'bench', 'ticker': str(rng.choice(tickers)), 'qty': 1, 'price': 100})
+
+    legs = [{'side': 'buy', 'ticker': ticker, 'qty': 1, 'price': 100} for ticker in tickers]
+    results = {
+        'buy': measure(buy, repeat),
+        'sell': measure(sell, repeat),
+        'batch_20_legs': measure(lambda: client.post('/trade/batch', json={'project': 'bench', 'legs': legs}), repeat // 5),
+        'stats': measure(lambda: client.get('/trade/stats?project=bench'), repeat),
+        'positions': measure(lambda: client.get('/trade/positions?project=bench'), repeat),
+        'logs': measure(lambda: client.get('/trade/logs?project=bench&per_page=50'), repeat),
+        'prices': measure(lambda: client.get(f"/trade/prices?tickers={','.join(tickers)}"), repeat)
+    }
+    return results
+
+
+def bench_backtest(quick):
+    params = DataCaching(MemoryFirestore(), bar_store=BarStore()).market_cycle_params
+    index = pd.date_range('2024-01-02 14:30', periods=(21 if quick else 252) * SESSION_MINUTES, freq='min', tz='UTC')
+    frames = {f"T{i:03d}": synthetic_ohlcv(index, i) for i in range(4 if quick else 20)}
+    results = {'tickers': len(frames), 'bars': len(index)}
+    for name, workers in [('in_process', 0), ('process_pool', None)]:
+        backtest = Backtest(workers=workers, market_cycle_params=params)
+        # The first run starts the pool, it is not part of the measurement
+        summary = backtest.run(frames)['summary']
+        results[name] = measure(lambda: backtest.run(frames), 1 if quick else 3)
+    results['trades'] = summary['trades']
+    return results
+
+
+def bench_sweep(quick):
+    params = DataCaching(MemoryFirestore(), bar_store=BarStore()).market_cycle_params
+    close = synthetic_ohlcv(pd.RangeIndex(25000 if quick else 250000), 3)['Close']
+    ranges = {'donchianPeriod': [10, 14, 20, 28], 'rsiPeriod': [10, 14, 20], 'srsiK': [3, 5], 'rsiWeight': [0.5, 1.0]}
+    if not quick:
+        ranges.update({'srsiPeriod': [14, 20, 28], 'srsiD': [3, 5], 'dcoWeight': [0.5, 1.0]})
+    combinations = MarketCycleSweep.grid(params, **ranges)
+    sweep = MarketCycleSweep()
+    sweep.run(close[:1000], combinations[:2])  # starts the pool
+    return {
+        'bars': len(close),
+        'combinations': len(combinations),
+        'sweep': measure(lambda: sweep.run(close, combinations, score=np.nanmean), 1),
+        # Extrapolated to the whole grid from a few combinations
+        'per_combination_x_combinations': {
+            key: value * len(combinations) if key != 'n' else value
+            for key, value in measure(lambda: HelperTA().MarketCycle(close, close, close, **combinations[0]), 3).items()
+        }
+    }
+
+
+def metadata():
+    try:
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        'date': datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        'commit': commit,
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'pandas': pd.__version__,
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count()
+    }
+
+
+def compare(results, baseline, path=''):
+    """Prints the median time ratio of every benchmark present in both runs."""
+    for key, value in results.items():
+        if not isinstance(value, dict) or key not in baseline:
+            continue
+        if 'median' in value and 'median' in baseline[key]:
+            ratio = value['median'] / baseline[key]['median'] if baseline[key]['median'] else float('nan')
+            print(f"{path}{key}: {baseline[key]['median']:.3f} -> {value['median']:.3f} ms ({ratio:.2f}x)", file=sys.stderr)
+        else:
+            compare(value, baseline[key], f"{path}{key}.")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--output', help='Write the results to this JSON file')
+    parser.add_argument('--compare', help='Print the ratios against a previous results file')
+    parser.add_argument('--only', help='Comma-separated sections to run')
+    parser.add_argument('--quick', action='store_true', help='Smaller inputs and fewer repetitions')
+    args = parser.parse_args()
+    # The pipeline logs a warning per ticker lacking history on the short replays
+    logging.basicConfig(level=logging.ERROR)
+
+    sections = args.only.split(',') if args.only else ['indicators', 'serialization', 'pipeline', 'endpoints', 'backtest', 'sweep']
+    results = {'metadata': metadata(), 'quick': args.quick}
+    with tempfile.TemporaryDirectory() as directory:
+        for section in sections:
+            print(f"Running {section} benchmarks...", file=sys.stderr)
+            section_directory = os.path.join(directory, section)
+            os.makedirs(section_directory)
+            if section == 'indicators':
+                results[section] = bench_indicators(args.quick)
+            elif section == 'serialization':
+                results[section] = bench_serialization(args.quick)
+            elif section == 'pipeline':
+                results[section] = bench_pipeline(args.quick, section_directory)
+            elif section == 'endpoints':
+                results[section] = bench_endpoints(args.quick, section_directory)
+            elif section == 'backtest':
+                results[section] = bench_backtest(args.quick)
+            elif section == 'sweep':
+                results[section] = bench_sweep(args.quick)
+            else:
+                raise SystemExit(f"Unknown section: {section}")
+
+    print(json.dumps(results, indent=2))
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+    if args.compare:
+        with open(args.compare) as f:
+            compare(results, json.load(f))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,119 @@
+# bench_trade_concurrency.py
+"""Stress benchmark for concurrent trade execution.
+
+Fires buy and sell orders on a single project from many threads, then checks
+the final cash and positions against a replay of the trade log: any lost
+update, overdraft or oversell shows up as a mismatch.
+
+    python bench_trade_concurrency.py --orders 2000 --workers 32 --latency 0.002
+
+Runs on the in-memory Firestore stand-in by default. With --emulator it uses
+the Firestore emulator pointed to by FIRESTORE_EMULATOR_HOST.
+"""
+import argparse
+import datetime
+import json
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
+from memory_firestore import MemoryFirestore
+from trade_service import TradeService
+
+
+def replay(db, project_name, initial_cash):
+    cash = initial_cash
+    positions = {}
+    for doc in db.collection('paper_trades').where('project', '==', project_name).stream():
+        trade = doc.to_dict()
+        value = trade['qty'] * trade['price']
+        sign = 1 if trade['type'] == 'buy' else -1
+        cash -= sign * value
+        positions[trade['ticker']] = positions.get(trade['ticker'], 0) + sign * trade['qty']
+    return cash, {ticker: qty for ticker, qty in positions.items() if qty}
+
+
+def run(db, orders, workers, tickers, max_attempts, initial_cash, seed):
+    project_name = f"bench-{int(time.time() * 1000)}"
+    db.collection('paper_projects').document(project_name).set({
+        'create_date': datetime.datetime.now(),
+        'project': project_name,
+        'cash': initial_cash,
+        'initial_cash': initial_cash
+    })
+    service = TradeService(db, max_attempts=max_attempts)
+    rng = random.Random(seed)
+    legs = [{
+        'project': project_name,
+        'ticker': rng.choice(tickers),
+        'qty': rng.randint(1, 10),
+        'price': 100,
+        'side': rng.choice(['buy', 'buy', 'sell'])
+    } for _ in range(orders)]
+
+    def submit(leg):
+        started = time.perf_counter()
+        if leg['side'] == 'buy':
+            _, status = service.buy_trade(leg)
+        else:
+            _, status = service.sell_trade(leg)
+        return status, time.perf_counter() - started
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        results = list(executor.map(submit, legs))
+    elapsed = time.perf_counter() - started
+
+    project = db.collection('paper_projects').document(project_name).get().to_dict()
+    stored_positions = {}
+    for doc in db.collection('trade_positions').where('project', '==', project_name).stream():
+        position = doc.to_dict()
+        stored_positions[position['ticker']] = position['qty']
+    expected_cash, expected_positions = replay(db, project_name, initial_cash)
+
+    latencies = sorted(latency for _, latency in results)
+    statuses = {}
+    for status, _ in results:
+        statuses[str(status)] = statuses.get(str(status), 0) + 1
+    return {
+        'orders': orders,
+        'workers': workers,
+        'elapsed': elapsed,
+        'orders_per_second': orders / elapsed if elapsed else None,
+        'statuses': statuses,
+        'p50_ms': latencies[len(latencies) // 2] * 1000,
+        'p99_ms': latencies[int(len(latencies) * 0.99) - 1] * 1000,
+        'cash': project['cash'],
+        'expected_cash': expected_cash,
+        'positions_match': stored_positions == expected_positions,
+        'cash_matches': abs(project['cash'] - expected_cash) < 1e-6,
+        'no_overdraft': project['cash'] >= 0,
+        'aborted_commits': getattr(db, 'calls', {}).get('aborted')
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--orders', type=int, default=1000)
+    parser.add_argument('--workers', type=int, default=32)
+    parser.add_argument('--tickers', default='AAPL,MSFT,NVDA')
+    parser.add_argument('--cash', type=float, default=200000)
+    parser.add_argument('--max-attempts', type=int, default=20)
+    parser.add_argument('--latency', type=float, default=0.001, help='Simulated round trip of the in-memory stand-in, in seconds')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--emulator', action='store_true')
+    args = parser.parse_args()
+
+    if args.emulator:
+        from google.cloud import firestore
+        db = firestore.Client(project='paper-bench')
+    else:
+        db = MemoryFirestore(latency=args.latency)
+
+    result = run(db, args.orders, args.workers, args.tickers.split(','), args.max_attempts, args.cash, args.seed)
+    print(json.dumps(result, indent=2))
+    if not (result['positions_match'] and result['cash_matches'] and result['no_overdraft']):
+        raise SystemExit('Lost updates detected')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,117 @@
+# firestore_bulk.py
+import datetime
+from firebase_admin import firestore
+import metrics
+
+# Firestore limits a commit to 500 writes and a request to 10 MiB
+MAX_BATCH_WRITES = 500
+MAX_BATCH_BYTES = 9 * 1024 * 1024
+
+
+def document_size(value):
+    """Approximates the Firestore storage size of a value, following the documented rules."""
+    if value is None or isinstance(value, bool):
+        return 1
+    if isinstance(value, (int, float, datetime.datetime)):
+        return 8
+    if isinstance(value, str):
+        return len(value.encode('utf-8')) + 1
+    if isinstance(value, bytes):
+        return len(value)
+    if isinstance(value, dict):
+        return sum(len(str(k).encode('utf-8')) + 1 + document_size(v) for k, v in value.items())
+    if isinstance(value, (list, tuple)):
+        return sum(document_size(v) for v in value)
+    return 8
+
+
+class FirestoreBulkWriter:
+    """Groups document writes into WriteBatch commits.
+
+    Writes are buffered and committed once a batch reaches Firestore's write
+    count or request size limit, and on `flush()`. Callbacks registered with
+    `on_commit` run once the writes queued before them are committed. Works
+    with the Firestore client, the emulator and `MemoryFirestore`.
+    """
+
+    def __init__(self, db, max_writes=MAX_BATCH_WRITES, max_bytes=MAX_BATCH_BYTES):
+        self.db = db
+        self.max_writes = max_writes
+        self.max_bytes = max_bytes
+        self.commits = 0
+        self._batch = None
+        self._writes = 0
+        self._bytes = 0
+        self._callbacks = []
+
+    def on_commit(self, callback):
+        """Calls `callback()` after the writes queued so far are committed, not if their commit fails."""
+        if self._batch is None or not self._writes:
+            callback()
+        else:
+            self._callbacks.append(callback)
+
+    def set(self, doc_ref, data, merge=False):
+        self._add(doc_ref, data, lambda batch: batch.set(doc_ref, data, merge=merge))
+
+    def update(self, doc_ref, data):
+        self._add(doc_ref, data, lambda batch: batch.update(doc_ref, data))
+
+    def delete(self, doc_ref):
+        self._add(doc_ref, None, lambda batch: batch.delete(doc_ref))
+
+    def flush(self):
+        if self._batch is not None and self._writes:
+            with metrics.stage_seconds.time(stage='firestore_write'):
+                self._batch.commit()
+            metrics.stage_items.inc(self._writes, stage='firestore_write')
+            self.commits += 1
+        self._batch = None
+        self._writes = 0
+        self._bytes = 0
+        callbacks, self._callbacks = self._callbacks, []
+        for callback in callbacks:
+            callback()
+
+    def _add(self, doc_ref, data, write):
+        size = len(doc_ref.path) + 16 + (document_size(data) if data is not None else 0)
+        if self._writes and (self._writes + 1 > self.max_writes or self._bytes + size > self.max_bytes):
+            self.flush()
+        if self._batch is None:
+            self._batch = self.db.batch()
+        write(self._batch)
+        self._writes += 1
+        self._bytes += size
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.flush()
+
+
+def get_all(db, doc_refs, field_paths=None, chunk_size=100):
+    """Reads many documents with multi-document gets, returns {path: dict or None}."""
+    doc_refs = list(doc_refs)
+    documents = {doc_ref.path: None for doc_ref in doc_refs}
+    for i in range(0, len(doc_refs), chunk_size):
+        with metrics.stage_seconds.time(stage='firestore_read'):
+            snapshots = list(db.get_all(doc_refs[i:i + chunk_size], field_paths=field_paths))
+        metrics.stage_items.inc(len(snapshots), stage='firestore_read')
+        for snapshot in snapshots:
+            if snapshot.exists:
+                documents[snapshot.reference.path] = snapshot.to_dict()
+    return documents
+
+
+def run_transaction(db, fn, max_attempts=5):
+    """Runs `fn(transaction)` in a transaction, retried on contention.
+
+    All reads must go through the transaction and happen before the writes.
+    Raises ValueError once `max_attempts` commits were aborted.
+    """
+    runner = getattr(db, 'run_transaction', None)
+    if runner is not None:
+        return runner(fn, max_attempts=max_attempts)
+    return firestore.transactional(fn)(db.transaction(max_attempts=max_attempts))
@@ -0,0 +1,74 @@
+# ledger.py
+# Paper-trading bookkeeping rules shared by live trades, batches and backtests.
+import math
+
+
+class LedgerError(Exception):
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+
+def positive(value):
+    """True for a finite number above zero, as a quantity or price must be; bools and strings are not numbers."""
+    return isinstance(value, (int, float)) and not isinstance(value, bool) and math.isfinite(value) and value > 0
+
+
+def apply_buy(cash, position, project_name, ticker, qty, price, now):
+    """Returns (cash, position) after buying `qty` at `price`; `position` is None when not held."""
+    if cash < qty * price:
+        raise LedgerError('Insufficient funds')
+
+    cash -= qty * price
+    if position is not None:
+        position = dict(position)
+        current_qty = position.get('qty', 0)
+        current_cost = position.get('avg_cost', 0) * current_qty
+        new_qty = current_qty + qty
+        position['avg_cost'] = (current_cost + qty * price) / new_qty
+        position['qty'] = new_qty
+        position['last_buy_date'] = now
+    else:
+        position = {
+            'create_date': now,
+            'project': project_name,
+            'ticker': ticker,
+            'qty': qty,
+            'avg_cost': price,
+            'last_buy_date': now,
+            'last_sell_date': None
+        }
+    return cash, position
+
+
+def apply_sell(cash, position, qty, price, now):
+    """Returns (cash, position, profit, gains_percent) after selling; position is None once closed."""
+    if position is None:
+        raise LedgerError('Ticker not in portfolio')
+    if position['qty'] < qty:
+        raise LedgerError('Not enough shares to sell')
+
+    cash += qty * price
+    avg_cost = position['avg_cost']
+    profit = (price - avg_cost) * qty
+    gains_percent = ((price - avg_cost) / avg_cost) * 100 if avg_cost else 0
+
+    remaining_qty = position['qty'] - qty
+    if remaining_qty == 0:
+        position = None
+    else:
+        position = dict(position)
+        position['qty'] = remaining_qty
+        position['last_sell_date'] = now
+    return cash, position, profit, gains_percent
+
+
+def trade_record(project_name, side, ticker, qty, price, now):
+    return {
+        'create_date': now,
+        'project': project_name,
+        'type': side,
+        'ticker': ticker,
+        'qty': qty,
+        'price': price
+    }
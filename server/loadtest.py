@@ -0,0 +1,77 @@
+# loadtest.py
+"""Load-test harness comparing the serving modes on one process.
+
+Keeps `--concurrency` requests in flight against each path for `--duration`
+seconds and reports throughput and latency percentiles:
+
+    gunicorn -w 1 --threads 8 -b :8080 main:app
+    python loadtest.py --url http://localhost:8080 --project example_project
+
+    uvicorn asgi:app --workers 1 --port 8080
+    python loadtest.py --url http://localhost:8080 --project example_project
+"""
+import argparse
+import asyncio
+import json
+import time
+import httpx
+
+
+async def run_path(client, url, concurrency, duration):
+    latencies = []
+    statuses = {}
+    deadline = time.monotonic() + duration
+
+    async def worker():
+        while time.monotonic() < deadline:
+            started = time.perf_counter()
+            try:
+                response = await client.get(url)
+                status = str(response.status_code)
+            except httpx.HTTPError as e:
+                status = type(e).__name__
+            latencies.append(time.perf_counter() - started)
+            statuses[status] = statuses.get(status, 0) + 1
+
+    started = time.monotonic()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.monotonic() - started
+
+    latencies.sort()
+    percentile = lambda p: latencies[min(len(latencies) - 1, int(len(latencies) * p))] * 1000 if latencies else None
+    return {
+        'requests': len(latencies),
+        'requests_per_second': len(latencies) / elapsed,
+        'statuses': statuses,
+        'p50_ms': percentile(0.5),
+        'p90_ms': percentile(0.9),
+        'p99_ms': percentile(0.99)
+    }
+
+
+async def main(args):
+    paths = [
+        f"/trade/positions?project={args.project}",
+        f"/trade/prices?tickers={args.tickers}"
+    ]
+    limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+    results = {'url': args.url, 'concurrency': args.concurrency, 'duration': args.duration, 'paths': {}}
+    async with httpx.AsyncClient(base_url=args.url, limits=limits, timeout=args.timeout) as client:
+        for path in paths:
+            results['paths'][path] = await run_path(client, path, args.concurrency, args.duration)
+    print(json.dumps(results, indent=2))
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--url', default='http://localhost:8080')
+    parser.add_argument('--project', default='example_project')
+    parser.add_argument('--tickers', default='AAPL,MSFT,NVDA,GOOGL,AMZN')
+    parser.add_argument('--concurrency', type=int, default=64)
+    parser.add_argument('--duration', type=float, default=20)
+    parser.add_argument('--timeout', type=float, default=30)
+    parser.add_argument('--output', help='Also write the results to this JSON file')
+    asyncio.run(main(parser.parse_args()))
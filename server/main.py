@@ -1,15 +1,21 @@
+import logging
 import os
+import time
 import firebase_admin
 from firebase_admin import credentials, firestore
-from flask import Flask, jsonify
+from flask import Flask, Response, g, jsonify, request
 from flask_cors import CORS
 from project_blueprint import create_project_blueprint
-from trade_blueprint import create_trade_blueprint
+from trade_blueprint import TradeServices, create_trade_blueprint
+from quote_cache import QuoteCache
+from market_data import provider_from_env
+import metrics
 
-# Initialize Firebase app
-cred = credentials.Certificate('firebase.json')
-firebase_admin.initialize_app(cred)
-db = firestore.client()
+# LOG_LEVEL=WARNING silences the per-step pipeline messages, DEBUG adds per-ticker ones
+logging.basicConfig(
+    level=os.environ.get('LOG_LEVEL', 'INFO').upper(),
+    format='%(asctime)s %(levelname)s %(name)s: %(message)s'
+)
 
 def create_app(*args, **kwargs):
     app = Flask(__name__)
@@ -17,7 +23,27 @@ def create_app(*args, **kwargs):
 
     # Register blueprints with the Firestore client
     app.register_blueprint(create_project_blueprint(db))
-    app.register_blueprint(create_trade_blueprint(db))
+    app.register_blueprint(create_trade_blueprint(trade_services))
+
+    @app.before_request
+    def start_timer():
+        g.request_started = time.perf_counter()
+
+    @app.after_request
+    def observe_request(response):
+        # Labelled by route pattern, not by path, to keep the series count bounded
+        route = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+        metrics.http_request_seconds.observe(
+            time.perf_counter() - g.request_started,
+            method=request.method, route=route, status=response.status_code
+        )
+        return response
+
+    @app.route('/metrics')
+    def export_metrics():
+        for stat, value in quote_cache.stats().items():
+            metrics.quote_cache_events.set(value, stat=stat)
+        return Response(metrics.render(), content_type=metrics.CONTENT_TYPE)
 
     @app.route('/', defaults={'path': ''})
     @app.route('/<path:path>')
@@ -26,7 +52,27 @@ def create_app(*args, **kwargs):
 
     return app
 
-app = create_app()
+# The refresh's compute workers are spawned processes, which import the launching script
+# again as __mp_main__: under `python main.py` they must not connect or start anything
+if __name__ != '__mp_main__':
+    # Initialize Firebase app
+    cred = credentials.Certificate('firebase.json')
+    firebase_admin.initialize_app(cred)
+    db = firestore.client()
+
+    # Quote cache shared by every blueprint of this process
+    quote_cache = QuoteCache(
+        ttl=float(os.environ.get('QUOTE_CACHE_TTL', 15)),
+        max_entries=int(os.environ.get('QUOTE_CACHE_MAX_ENTRIES', 2048))
+    )
+    # yfinance, or MARKET_DATA=replay for offline, reproducible runs
+    provider = provider_from_env()
+    # Order book, stream publisher and the other trade objects, shared by every app of this process
+    trade_services = TradeServices(db, quote_cache, int(os.environ.get('TRADE_MAX_ATTEMPTS', 5)), provider)
+
+    app = create_app()
+    # Background services start once per process, never as a side effect of building an app
+    trade_services.start()
 
 if __name__ == '__main__':
     port = int(os.environ.get('PORT', 8080))
@@ -0,0 +1,229 @@
+# market_data.py
+import glob
+import logging
+import os
+import threading
+import time
+import pandas as pd
+import yfinance as yf
+
+logger = logging.getLogger(__name__)
+
+# yfinance periods as lookbacks; 'max' has none and 'ytd' is handled apart
+PERIODS = {
+    '1d': pd.Timedelta(days=1),
+    '5d': pd.Timedelta(days=5),
+    '1mo': pd.DateOffset(months=1),
+    '3mo': pd.DateOffset(months=3),
+    '6mo': pd.DateOffset(months=6),
+    '1y': pd.DateOffset(years=1),
+    '2y': pd.DateOffset(years=2),
+    '5y': pd.DateOffset(years=5),
+    '10y': pd.DateOffset(years=10)
+}
+
+# yfinance intervals as pandas resampling rules
+INTERVALS = {
+    '1m': 'min',
+    '2m': '2min',
+    '5m': '5min',
+    '15m': '15min',
+    '30m': '30min',
+    '60m': 'h',
+    '1h': 'h',
+    '1d': 'D',
+    '5d': '5D',
+    '1wk': 'W'
+}
+
+OHLCV = {'Open': 'first', 'High': 'max', 'Low': 'min', 'Close': 'last', 'Adj Close': 'last', 'Volume': 'sum'}
+
+
+class MarketDataProvider:
+    """Source of OHLCV history and latest quotes for DataCaching and the price resolvers.
+
+    Frames follow yfinance's layout: Open/High/Low/Close/Adj Close/Volume
+    columns and a timestamp index named 'Datetime' for intraday intervals and
+    'Date' for daily and longer ones.
+    """
+
+    def now(self):
+        """Current time of the provider, as Unix seconds."""
+        return time.time()
+
+    def download(self, tickers, interval, period=None, start=None, timeout=None):
+        """Returns {ticker: frame} with the bars of `interval` in `period` or since `start`."""
+        raise NotImplementedError
+
+    def latest_price(self, ticker):
+        """Returns the latest price of a ticker, or None."""
+        raise NotImplementedError
+
+    def latest_prices(self, tickers, timeout=None):
+        """Returns {ticker: price} for the tickers that could be priced."""
+        prices = {ticker: self.latest_price(ticker) for ticker in tickers}
+        return {ticker: price for ticker, price in prices.items() if price is not None}
+
+
+class YFinanceProvider(MarketDataProvider):
+    """Yahoo Finance through yfinance, one bulk `yf.download` per call."""
+
+    def download(self, tickers, interval, period=None, start=None, timeout=None):
+        kwargs = {'period': period} if start is None else {'start': start}
+        if timeout is not None:
+            kwargs['timeout'] = timeout
+        data = yf.download(tickers=tickers, interval=interval, group_by='ticker', progress=False, **kwargs)
+        frames = {}
+        for ticker in tickers:
+            if isinstance(data.columns, pd.MultiIndex):
+                if ticker not in data.columns.get_level_values(0):
+                    continue
+                frame = data[ticker]
+            elif len(tickers) == 1:
+                frame = data
+            else:
+                continue
+            frames[ticker] = frame.dropna(how='all')
+        return frames
+
+    def latest_price(self, ticker):
+        try:
+            stock = yf.Ticker(ticker)
+            return float(stock.history(period='1d')['Close'].iloc[-1])
+        except Exception as e:
+            logger.error("Error fetching price for %s: %s", ticker, e)
+            return None
+
+    def latest_prices(self, tickers, timeout=None):
+        prices = {}
+        for ticker, frame in self.download(tickers, '1d', period='1d', timeout=timeout).items():
+            closes = frame['Close'].dropna()
+            if not closes.empty:
+                prices[ticker] = float(closes.iloc[-1])
+        return prices
+
+
+class ReplayProvider(MarketDataProvider):
+    """Deterministic offline market data replayed from local files.
+
+    Bars are read from `{directory}/{TICKER}_{interval}.parquet` or `.csv`
+    (e.g. `AAPL_1m.csv`); an interval without its own file is resampled from
+    the ticker's 1m file. The replay clock starts at `start` (by default
+    `warmup` after the first recorded bar) and advances `speed` times faster
+    than real time, `speed=0` freezes it. Only bars at or before the clock
+    are served, so successive refreshes see new bars arrive as they did live.
+    """
+
+    def __init__(self, directory, speed=1.0, start=None, warmup=pd.Timedelta(days=1)):
+        self.directory = directory
+        self.speed = speed
+        self.warmup = warmup
+        self._frames = {}
+        self._lock = threading.Lock()
+        self._start = pd.Timestamp(start).timestamp() if start is not None else None
+        self._started = time.monotonic()
+
+    def now(self):
+        if self._start is None:
+            first_bars = [frame.index[0] for frame in self._load_all() if not frame.empty]
+            if not first_bars:
+                raise ValueError(f"No replay files in {self.directory}")
+            self._start = (min(first_bars) + self.warmup).timestamp()
+            self._started = time.monotonic()
+        return self._start + (time.monotonic() - self._started) * self.speed
+
+    def advance(self, seconds):
+        """Moves the replay clock forward, e.g. to step a frozen clock from one refresh to the next."""
+        self.now()
+        self._start += seconds
+
+    def download(self, tickers, interval, period=None, start=None, timeout=None):
+        now = pd.Timestamp(self.now(), unit='s', tz='UTC')
+        if start is not None:
+            start = pd.Timestamp(start)
+            start = start.tz_localize('UTC') if start.tzinfo is None else start
+        elif period == 'ytd':
+            start = now.normalize().replace(month=1, day=1)
+        elif period in PERIODS:
+            start = now - PERIODS[period]
+        elif period not in (None, 'max'):
+            raise ValueError(f"Unsupported period: {period}")
+
+        frames = {}
+        for ticker in tickers:
+            frame = self._bars(ticker, interval, now)
+            if frame is None:
+                continue
+            if start is not None:
+                frame = frame[frame.index >= start]
+            if not frame.empty:
+                frames[ticker] = frame
+        return frames
+
+    def latest_price(self, ticker):
+        now = pd.Timestamp(self.now(), unit='s', tz='UTC')
+        frame = self._bars(ticker, '1m', now)
+        if frame is None:
+            frame = self._bars(ticker, '1d', now)
+        if frame is None:
+            return None
+        closes = frame['Close'].dropna()
+        return float(closes.iloc[-1]) if not closes.empty else None
+
+    def _bars(self, ticker, interval, now):
+        """Bars up to `now`; resampled ones only aggregate the minutes up to `now`, like a live open candle."""
+        frame = self._load(ticker, interval)
+        if frame is not None:
+            return frame[frame.index <= now].copy()
+        minutes = self._load(ticker, '1m') if interval in INTERVALS else None
+        if minutes is None:
+            return None
+        return self._resample(minutes[minutes.index <= now], interval)
+
+    def _resample(self, frame, interval):
+        resampled = frame.resample(INTERVALS[interval]).agg({c: f for c, f in OHLCV.items() if c in frame.columns})
+        resampled = resampled.dropna(subset=['Close'])
+        resampled.index.name = 'Date' if interval in ('1d', '5d', '1wk') else 'Datetime'
+        return resampled
+
+    def _load(self, ticker, interval):
+        with self._lock:
+            if (ticker, interval) in self._frames:
+                return self._frames[(ticker, interval)]
+        frame = None
+        for extension, reader in [('parquet', pd.read_parquet), ('csv', lambda path: pd.read_csv(path, index_col=0, parse_dates=True))]:
+            path = os.path.join(self.directory, f"{ticker}_{interval}.{extension}")
+            if os.path.exists(path):
+                frame = self._normalize(reader(path), interval)
+                break
+        with self._lock:
+            self._frames[(ticker, interval)] = frame
+        return frame
+
+    def _load_all(self):
+        frames = []
+        for path in sorted(glob.glob(os.path.join(self.directory, '*_*.*'))):
+            ticker, interval = os.path.splitext(os.path.basename(path))[0].rsplit('_', 1)
+            frame = self._load(ticker, interval)
+            if frame is not None:
+                frames.append(frame)
+        return frames
+
+    def _normalize(self, frame, interval):
+        # Naive timestamps are taken as UTC
+        frame = frame.set_axis(pd.to_datetime(frame.index, utc=True), axis=0).sort_index(kind='stable')
+        if 'Adj Close' not in frame.columns and 'Close' in frame.columns:
+            frame['Adj Close'] = frame['Close']
+        frame.index.name = 'Date' if interval in ('1d', '5d', '1wk') else 'Datetime'
+        return frame
+
+
+def provider_from_env():
+    """MARKET_DATA=replay serves REPLAY_DIR at REPLAY_SPEED from REPLAY_START, anything else is yfinance."""
+    if os.environ.get('MARKET_DATA') == 'replay':
+        return ReplayProvider(
+            os.environ.get('REPLAY_DIR', 'replay'),
+            speed=float(os.environ.get('REPLAY_SPEED', 1)),
+            start=os.environ.get('REPLAY_START')
+        )
+    return YFinanceProvider()
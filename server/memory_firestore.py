@@ -0,0 +1,371 @@
+# memory_firestore.py
+import copy
+import threading
+import time
+import uuid
+
+
+def _get_field(data, field_path):
+    value = data
+    for part in field_path.split('.'):
+        if not isinstance(value, dict) or part not in value:
+            raise KeyError(field_path)
+        value = value[part]
+    return value
+
+
+def _set_field(data, field_path, value):
+    parts = field_path.split('.')
+    for part in parts[:-1]:
+        data = data.setdefault(part, {})
+    data[parts[-1]] = value
+
+
+def _matches(data, field, op, value):
+    try:
+        field_value = _get_field(data, field)
+    except KeyError:
+        return False
+    try:
+        if op == '==':
+            return field_value == value
+        if op == '!=':
+            return field_value != value
+        if op == '<':
+            return field_value < value
+        if op == '<=':
+            return field_value <= value
+        if op == '>':
+            return field_value > value
+        if op == '>=':
+            return field_value >= value
+        if op == 'in':
+            return field_value in value
+        if op == 'not-in':
+            return field_value not in value
+        if op == 'array_contains':
+            return value in field_value
+        if op == 'array_contains_any':
+            return any(v in field_value for v in value)
+    except TypeError:
+        return False
+    raise ValueError(f"Unsupported operator: {op}")
+
+
+class DocumentSnapshot:
+    def __init__(self, reference, data):
+        self.reference = reference
+        self.id = reference.id
+        self.exists = data is not None
+        self._data = data
+
+    def to_dict(self):
+        return copy.deepcopy(self._data) if self.exists else None
+
+    def get(self, field_path):
+        return copy.deepcopy(_get_field(self._data, field_path))
+
+
+class DocumentReference:
+    def __init__(self, db, path):
+        self._db = db
+        self.path = path
+        self.id = path.rsplit('/', 1)[-1]
+
+    @property
+    def parent(self):
+        return CollectionReference(self._db, self.path.rsplit('/', 1)[0])
+
+    def collection(self, name):
+        return CollectionReference(self._db, f"{self.path}/{name}")
+
+    def get(self, field_paths=None, transaction=None):
+        return self._db._snapshot(self, field_paths, transaction)
+
+    def set(self, data, merge=False):
+        self._db._write([('set', self, data, merge)])
+
+    def create(self, data):
+        self._db._write([('create', self, data, False)])
+
+    def update(self, data):
+        self._db._write([('update', self, data, False)])
+
+    def delete(self):
+        self._db._write([('delete', self, None, False)])
+
+    def __eq__(self, other):
+        return isinstance(other, DocumentReference) and other.path == self.path
+
+    def __hash__(self):
+        return hash(self.path)
+
+
+class Query:
+    def __init__(self, collection, filters=(), orders=(), limit=None, offset=0, start_after=None):
+        self._collection = collection
+        self._filters = list(filters)
+        self._orders = list(orders)
+        self._limit = limit
+        self._offset = offset
+        self._start_after = start_after
+
+    def _copy(self, **changes):
+        state = {
+            'filters': self._filters,
+            'orders': self._orders,
+            'limit': self._limit,
+            'offset': self._offset,
+            'start_after': self._start_after
+        }
+        state.update(changes)
+        return Query(self._collection, **state)
+
+    def where(self, field, op, value):
+        return self._copy(filters=self._filters + [(field, op, value)])
+
+    def order_by(self, field, direction='ASCENDING'):
+        return self._copy(orders=self._orders + [(field, direction)])
+
+    def limit(self, count):
+        return self._copy(limit=count)
+
+    def offset(self, count):
+        return self._copy(offset=count)
+
+    def start_after(self, document_fields):
+        """Cursor on the ordered fields, given as a snapshot or a dict (`__name__` holds the document id)."""
+        if isinstance(document_fields, DocumentSnapshot):
+            document_fields = dict(document_fields._data, __name__=document_fields.id)
+        return self._copy(start_after=dict(document_fields))
+
+    def count(self, alias=None):
+        return AggregationQuery(self, alias or 'count')
+
+    def stream(self, transaction=None):
+        snapshots = self._collection._db._query(self._collection.path, self._filters, transaction)
+        for field, direction in reversed(self._orders):
+            reverse = direction == 'DESCENDING'
+            if field == '__name__':
+                snapshots.sort(key=lambda snapshot: snapshot.id, reverse=reverse)
+            else:
+                snapshots = [s for s in snapshots if _has_field(s._data, field)]
+                snapshots.sort(key=lambda snapshot: _get_field(snapshot._data, field), reverse=reverse)
+        if self._start_after is not None:
+            snapshots = [snapshot for snapshot in snapshots if self._after_cursor(snapshot)]
+        snapshots = snapshots[self._offset:]
+        if self._limit is not None:
+            snapshots = snapshots[:self._limit]
+        return iter(snapshots)
+
+    def get(self, transaction=None):
+        return list(self.stream(transaction=transaction))
+
+    def _after_cursor(self, snapshot):
+        for field, direction in self._orders:
+            value = snapshot.id if field == '__name__' else _get_field(snapshot._data, field)
+            cursor = self._start_after[field]
+            if value != cursor:
+                return (value < cursor) if direction == 'DESCENDING' else (value > cursor)
+        return False
+
+
+class AggregationResult:
+    def __init__(self, alias, value):
+        self.alias = alias
+        self.value = value
+
+
+class AggregationQuery:
+    def __init__(self, query, alias):
+        self._query = query
+        self._alias = alias
+
+    def get(self, transaction=None):
+        return [[AggregationResult(self._alias, len(self._query.get(transaction=transaction)))]]
+
+
+def _has_field(data, field_path):
+    try:
+        _get_field(data, field_path)
+        return True
+    except KeyError:
+        return False
+
+
+class CollectionReference(Query):
+    def __init__(self, db, path):
+        self._db = db
+        self.path = path
+        self.id = path.rsplit('/', 1)[-1]
+        super().__init__(self)
+
+    def document(self, document_id=None):
+        return DocumentReference(self._db, f"{self.path}/{document_id or uuid.uuid4().hex[:20]}")
+
+    def add(self, data, document_id=None):
+        doc_ref = self.document(document_id)
+        doc_ref.create(data)
+        return None, doc_ref
+
+
+class WriteBatch:
+    def __init__(self, db):
+        self._db = db
+        self._writes = []
+
+    def set(self, reference, document_data, merge=False):
+        self._writes.append(('set', reference, document_data, merge))
+
+    def create(self, reference, document_data):
+        self._writes.append(('create', reference, document_data, False))
+
+    def update(self, reference, field_updates):
+        self._writes.append(('update', reference, field_updates, False))
+
+    def delete(self, reference):
+        self._writes.append(('delete', reference, None, False))
+
+    def commit(self):
+        writes, self._writes = self._writes, []
+        self._db._write(writes)
+        return writes
+
+
+class Transaction(WriteBatch):
+    """Optimistic transaction: the commit aborts if a document it read was written since."""
+
+    def __init__(self, db):
+        super().__init__(db)
+        self._read_versions = {}
+
+    def _record(self, path):
+        self._read_versions.setdefault(path, self._db._versions.get(path, 0))
+
+    def commit(self):
+        writes, self._writes = self._writes, []
+        self._db._write(writes, self._read_versions)
+        return writes
+
+
+class TransactionAborted(Exception):
+    pass
+
+
+class MemoryFirestore:
+    """In-memory stand-in for `firestore.client()`.
+
+    Implements the subset of the client API this server uses (documents,
+    collections, simple queries, batches and multi-document gets) so services
+    can run and be benchmarked without Firestore or its emulator. It also
+    counts round trips in `calls`, and `latency` seconds are slept on each
+    round trip to emulate the network.
+    """
+
+    def __init__(self, latency=0):
+        self.latency = latency
+        self._documents = {}
+        self._versions = {}
+        self._lock = threading.RLock()
+        self.calls = {'get': 0, 'get_all': 0, 'query': 0, 'commit': 0, 'writes': 0, 'aborted': 0}
+
+    def collection(self, name):
+        return CollectionReference(self, name)
+
+    def document(self, path):
+        return DocumentReference(self, path)
+
+    def batch(self):
+        return WriteBatch(self)
+
+    def transaction(self, **kwargs):
+        return Transaction(self)
+
+    def run_transaction(self, fn, max_attempts=5):
+        for _ in range(max_attempts):
+            transaction = self.transaction()
+            result = fn(transaction)
+            try:
+                transaction.commit()
+                return result
+            except TransactionAborted:
+                continue
+        raise ValueError(f"Failed to commit transaction in {max_attempts} attempts.")
+
+    def get_all(self, references, field_paths=None, transaction=None):
+        self._round_trip()
+        with self._lock:
+            self.calls['get_all'] += 1
+            return [self._read(reference, field_paths, transaction) for reference in references]
+
+    def _snapshot(self, reference, field_paths=None, transaction=None):
+        self._round_trip()
+        with self._lock:
+            self.calls['get'] += 1
+            return self._read(reference, field_paths, transaction)
+
+    def _round_trip(self):
+        if self.latency:
+            time.sleep(self.latency)
+
+    def _read(self, reference, field_paths=None, transaction=None):
+        if transaction is not None:
+            transaction._record(reference.path)
+        data = self._documents.get(reference.path)
+        if data is not None and field_paths is not None:
+            masked = {}
+            for field_path in field_paths:
+                if _has_field(data, field_path):
+                    _set_field(masked, field_path, _get_field(data, field_path))
+            data = masked
+        return DocumentSnapshot(reference, copy.deepcopy(data))
+
+    def _query(self, collection_path, filters, transaction=None):
+        self._round_trip()
+        with self._lock:
+            self.calls['query'] += 1
+            prefix = collection_path + '/'
+            snapshots = []
+            for path, data in self._documents.items():
+                if not path.startswith(prefix) or '/' in path[len(prefix):]:
+                    continue
+                if all(_matches(data, field, op, value) for field, op, value in filters):
+                    if transaction is not None:
+                        transaction._record(path)
+                    snapshots.append(DocumentSnapshot(DocumentReference(self, path), copy.deepcopy(data)))
+            return snapshots
+
+    def _write(self, writes, read_versions=None):
+        self._round_trip()
+        with self._lock:
+            if read_versions and any(self._versions.get(path, 0) != version for path, version in read_versions.items()):
+                self.calls['aborted'] += 1
+                raise TransactionAborted()
+            staged = dict(self._documents)
+            for op, reference, data, merge in writes:
+                current = staged.get(reference.path)
+                if op == 'create':
+                    if current is not None:
+                        raise ValueError(f"Document already exists: {reference.path}")
+                    staged[reference.path] = copy.deepcopy(data)
+                elif op == 'set':
+                    if merge and current is not None:
+                        merged = copy.deepcopy(current)
+                        merged.update(copy.deepcopy(data))
+                        staged[reference.path] = merged
+                    else:
+                        staged[reference.path] = copy.deepcopy(data)
+                elif op == 'update':
+                    if current is None:
+                        raise ValueError(f"No document to update: {reference.path}")
+                    updated = copy.deepcopy(current)
+                    for field_path, value in data.items():
+                        _set_field(updated, field_path, copy.deepcopy(value))
+                    staged[reference.path] = updated
+                elif op == 'delete':
+                    staged.pop(reference.path, None)
+            self._documents = staged
+            for _, reference, _, _ in writes:
+                self._versions[reference.path] = self._versions.get(reference.path, 0) + 1
+            self.calls['commit'] += 1
+            self.calls['writes'] += len(writes)
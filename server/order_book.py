@@ -0,0 +1,311 @@
+# order_book.py
+import bisect
+import datetime
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from firestore_bulk import run_transaction
+import ledger
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# Fills of a project per commit: the order, position and trade of each fill, plus cash and portfolio
+MAX_FILLS = 150
+# Orders returned by a listing, newest first
+MAX_LISTED = 500
+
+
+class _PriceLevels:
+    """Resting orders of one ticker triggered on the same side of the price.
+
+    Levels are kept sorted as `sign * level` so the crossed ones always form
+    the tail of the list: one bisection finds them and they are cut off
+    without shifting the others, O(log n + k) for k crossed orders.
+    """
+
+    def __init__(self, sign):
+        self.sign = sign
+        self.keys = []
+        self.orders = {}
+
+    def add(self, level, order_id):
+        key = self.sign * level
+        if key not in self.orders:
+            bisect.insort(self.keys, key)
+            self.orders[key] = []
+        self.orders[key].append(order_id)
+
+    def remove(self, level, order_id):
+        key = self.sign * level
+        ids = self.orders.get(key)
+        if ids is None or order_id not in ids:
+            return
+        ids.remove(order_id)
+        if not ids:
+            del self.orders[key]
+            del self.keys[bisect.bisect_left(self.keys, key)]
+
+    def pop_crossed(self, price):
+        """Removes and returns the ids of the orders triggered at `price`, farthest levels first."""
+        i = bisect.bisect_left(self.keys, self.sign * price)
+        crossed = self.keys[i:]
+        del self.keys[i:]
+        return [order_id for key in reversed(crossed) for order_id in self.orders.pop(key)]
+
+    def __len__(self):
+        return len(self.orders)
+
+
+class OrderBook:
+    """Resting limit and stop orders, filled when a new price crosses their level.
+
+    Orders are stored in `paper_orders` and indexed in memory by ticker. A
+    buy limit or sell stop triggers when the price falls to its level or
+    below, a sell limit or buy stop when it rises to its level or above, so
+    each ticker has one sorted index per direction and a new price only visits
+    the crossed levels. Triggered orders are filled at that price by a single
+    background thread, through `TradeService.fill_orders` and so the same
+    ledger rules as `/trade/buy` and `/trade/sell`. The index reloads the open
+    orders every `reload_seconds`, picking up the ones placed on other
+    instances; an order reaching several instances is still filled once.
+    New and reloaded orders are matched against the last price seen of their
+    ticker only while it is at most `max_price_age` seconds old (the quote
+    cache TTL by default), otherwise they wait for the next price.
+    """
+
+    def __init__(self, db, trade_service, reload_seconds=60, max_price_age=None):
+        self.db = db
+        self.trade_service = trade_service
+        self.reload_seconds = reload_seconds
+        self.max_price_age = max_price_age if max_price_age is not None else trade_service.quote_cache.ttl
+        # ticker: (falling levels, rising levels)
+        self._books = {}
+        self._orders = {}
+        # ticker: (last price seen, time.monotonic() when seen)
+        self._prices = {}
+        # Orders placed while a reload runs, which its query may have missed
+        self._placed = set()
+        self._loaded_at = None
+        self._reloading = False
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='order-fills')
+
+    def place_order(self, data):
+        project_name = data.get('project')
+        ticker = data.get('ticker')
+        side = data.get('side')
+        order_type = data.get('type')
+        qty = data.get('qty')
+        price = data.get('price')
+
+        if not all([project_name, ticker, qty, price]):
+            return {'error': 'Missing required parameters'}, 400
+        if side not in ('buy', 'sell'):
+            return {'error': 'Invalid "side" parameter'}, 400
+        if order_type not in ('limit', 'stop'):
+            return {'error': 'Invalid "type" parameter'}, 400
+        if not ledger.positive(qty) or not ledger.positive(price):
+            return {'error': 'Invalid "qty" or "price" parameter'}, 400
+        if not self.db.collection('paper_projects').document(project_name).get().exists:
+            return {'error': 'Project not found'}, 404
+
+        order_ref = self.db.collection('paper_orders').document()
+        order = {
+            'create_date': datetime.datetime.now(),
+            'project': project_name,
+            'ticker': ticker.upper(),
+            'side': side,
+            'type': order_type,
+            'qty': qty,
+            'price': price,
+            'status': 'open'
+        }
+        order_ref.set(order)
+        order = {**order, 'id': order_ref.id}
+        with self._lock:
+            self._placed.add(order['id'])
+            self._index(order)
+            last = self._fresh_prices([order['ticker']])
+        # Marketable on arrival: filled at a recent enough last price instead of waiting for the next one
+        if last:
+            self._match(last)
+        return order, 200
+
+    def cancel_order(self, data):
+        project_name = data.get('project')
+        order_id = data.get('order_id')
+
+        if not project_name or not order_id:
+            return {'error': 'Missing "project" or "order_id" parameter'}, 400
+
+        order_ref = self.db.collection('paper_orders').document(order_id)
+
+        def execute(transaction):
+            snapshot = order_ref.get(transaction=transaction)
+            order = snapshot.to_dict() if snapshot.exists else None
+            if order is None or order['project'] != project_name:
+                return {'error': 'Order not found'}, 404
+            if order['status'] != 'open':
+                return {'error': f"Order is already {order['status']}"}, 409
+            transaction.update(order_ref, {'status': 'cancelled', 'close_date': datetime.datetime.now()})
+            return {**order, 'id': order_id, 'status': 'cancelled'}, 200
+
+        try:
+            response, status = run_transaction(self.db, execute, self.trade_service.max_attempts)
+        except ValueError as e:
+            logger.warning("Transaction aborted: %s", e)
+            return {'error': 'Too many concurrent orders on this project, please retry'}, 409
+        if status == 200:
+            with self._lock:
+                self._unindex(order_id)
+        return response, status
+
+    def get_orders(self, project_name, status=None):
+        """Orders of a project, newest first, optionally only those with `status`."""
+        if not project_name:
+            return {'error': 'Missing "project" parameter'}, 400
+        if status not in (None, 'open', 'filled', 'rejected', 'cancelled'):
+            return {'error': 'Invalid "status" parameter'}, 400
+
+        query = self.db.collection('paper_orders').where('project', '==', project_name)
+        if status:
+            query = query.where('status', '==', status)
+        orders = query.order_by('create_date', direction='DESCENDING').limit(MAX_LISTED).stream()
+        return {'orders': [{**doc.to_dict(), 'id': doc.id} for doc in orders]}, 200
+
+    def on_prices(self, prices):
+        """Matches new {ticker: price} quotes, returns the Future of the fills they trigger or None.
+
+        Only looks the crossed levels up in memory: reloads and fills run on
+        the background thread, so this is cheap enough for any price feed.
+        """
+        return self._match(prices, seen_at=time.monotonic())
+
+    def _match(self, prices, seen_at=None):
+        """Pops the orders crossed by `prices` and queues their fills; `seen_at` records them as the last prices."""
+        triggered = []
+        with self._lock:
+            if not self._reloading and (self._loaded_at is None or time.monotonic() - self._loaded_at > self.reload_seconds):
+                self._reloading = True
+                self._executor.submit(self.reload)
+            for ticker, price in prices.items():
+                if not ledger.positive(price):
+                    continue
+                ticker = ticker.upper()
+                if seen_at is not None:
+                    self._prices[ticker] = (price, seen_at)
+                book = self._books.get(ticker)
+                if book is None:
+                    continue
+                for levels in book:
+                    for order_id in levels.pop_crossed(price):
+                        # Levels of orders dropped by a fill are left behind when a reload re-added them
+                        if order_id in self._orders:
+                            triggered.append((self._orders[order_id], price))
+                if not book[0] and not book[1]:
+                    del self._books[ticker]
+        if not triggered:
+            return None
+        logger.info("%d resting orders triggered", len(triggered))
+        return self._executor.submit(self._fill, triggered)
+
+    def reload(self):
+        """Rebuilds the index from the open orders in Firestore, then matches them against the last prices."""
+        try:
+            with self._lock:
+                self._placed = set()
+            loaded = {doc.id: {**doc.to_dict(), 'id': doc.id} for doc in self.db.collection('paper_orders').where('status', '==', 'open').stream()}
+            with self._lock:
+                for order_id in self._placed:
+                    if order_id in self._orders:
+                        loaded.setdefault(order_id, self._orders[order_id])
+                self._books = {}
+                self._orders = {}
+                for order in loaded.values():
+                    self._index(order)
+                self._loaded_at = time.monotonic()
+                prices = self._fresh_prices(self._books)
+            logger.debug("Loaded %d open orders", len(loaded))
+        except Exception as e:
+            logger.error("Error loading the open orders: %s", e)
+            with self._lock:
+                self._loaded_at = time.monotonic()
+            return
+        finally:
+            with self._lock:
+                self._reloading = False
+        # Runs on the fill thread already, the fills are queued behind this reload
+        self._match(prices)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'open_orders': len(self._orders),
+                'tickers': len(self._books),
+                'levels': sum(len(falling) + len(rising) for falling, rising in self._books.values())
+            }
+
+    def _fresh_prices(self, tickers):
+        # Must be called with self._lock held
+        now = time.monotonic()
+        entries = {ticker: self._prices.get(ticker) for ticker in tickers}
+        return {ticker: entry[0] for ticker, entry in entries.items() if entry is not None and now - entry[1] <= self.max_price_age}
+
+    def _fill(self, triggered):
+        by_project = {}
+        for order, price in triggered:
+            by_project.setdefault(order['project'], []).append((order, price))
+
+        for project_name, fills in by_project.items():
+            for start in range(0, len(fills), MAX_FILLS):
+                chunk = fills[start:start + MAX_FILLS]
+                try:
+                    with metrics.stage_seconds.time(stage='order_fill'):
+                        response, status = self.trade_service.fill_orders(project_name, chunk)
+                except Exception as e:
+                    logger.error("Error filling orders of %s: %s", project_name, e)
+                    response, status = {'error': str(e)}, 500
+
+                if status == 200:
+                    metrics.stage_items.inc(response['executed'], stage='order_fill')
+                    with self._lock:
+                        for result in response['results']:
+                            self._unindex(result['order_id'])
+                elif status == 404:
+                    logger.warning("Dropping the orders of missing project %s", project_name)
+                    with self._lock:
+                        for order, _ in chunk:
+                            self._unindex(order['id'])
+                else:
+                    # Still open, retried at the next crossing price
+                    metrics.stage_errors.inc(stage='order_fill')
+                    logger.warning("Could not fill %d orders of %s: %s", len(chunk), project_name, response.get('error'))
+                    with self._lock:
+                        for order, _ in chunk:
+                            if order['id'] in self._orders:
+                                self._index(order)
+
+    def _index(self, order):
+        # Must be called with self._lock held
+        self._unindex(order['id'])
+        self._orders[order['id']] = order
+        falling, rising = self._books.setdefault(order['ticker'], (_PriceLevels(1), _PriceLevels(-1)))
+        if (order['side'] == 'buy') == (order['type'] == 'limit'):
+            falling.add(order['price'], order['id'])
+        else:
+            rising.add(order['price'], order['id'])
+
+    def _unindex(self, order_id):
+        # Must be called with self._lock held
+        order = self._orders.pop(order_id, None)
+        if order is None:
+            return
+        book = self._books.get(order['ticker'])
+        if book is None:
+            return
+        for levels in book:
+            levels.remove(order['price'], order_id)
+        if not book[0] and not book[1]:
+            del self._books[order['ticker']]
@@ -0,0 +1,84 @@
+# portfolio.py
+# Materialized per-project portfolio document, kept in paper_portfolios/{project}.
+#
+# It holds the cash, the positions (qty and cost basis), the prices of the
+# last valuation and the number of trades, so stats, positions and the trade
+# log total are served from one document read.
+# Trades rewrite it in their transaction, valuations only replace `prices`.
+
+
+def portfolio_ref(db, project_name):
+    return db.collection('paper_portfolios').document(project_name)
+
+
+def build(project_name, project_data, positions, now, trade_count=None):
+    """Builds the portfolio document from the project, its trade_positions documents and its number of trades."""
+    return {
+        'project': project_name,
+        'cash': project_data['cash'],
+        'initial_cash': project_data.get('initial_cash'),
+        'positions': {
+            position['ticker']: {'qty': position['qty'], 'avg_cost': position['avg_cost']}
+            for position in positions
+        },
+        'prices': {},
+        'valued_at': None,
+        'trade_count': trade_count,
+        'updated_at': now
+    }
+
+
+def apply_trades(portfolio, cash, positions, trades, now):
+    """Returns a copy of `portfolio` after `trades` trades left `cash` and `positions` ({ticker: position or None once closed})."""
+    portfolio = dict(portfolio)
+    held = dict(portfolio['positions'])
+    for ticker, position in positions.items():
+        if position is None:
+            held.pop(ticker, None)
+        else:
+            held[ticker] = {'qty': position['qty'], 'avg_cost': position['avg_cost']}
+    portfolio['positions'] = held
+    portfolio['prices'] = {t: p for t, p in portfolio.get('prices', {}).items() if t in held}
+    portfolio['cash'] = cash
+    if portfolio.get('trade_count') is not None:
+        portfolio['trade_count'] += trades
+    portfolio['updated_at'] = now
+    return portfolio
+
+
+def summary(portfolio, prices):
+    """Values the portfolio at `prices`; positions without a price are left out, as before."""
+    positions = []
+    invested_value = 0
+    open_value = 0
+    for ticker, position in portfolio['positions'].items():
+        current_price = prices.get(ticker)
+        if current_price is None:
+            continue
+
+        qty = position['qty']
+        avg_cost = position['avg_cost']
+        positions.append({
+            'ticker': ticker,
+            'qty': qty,
+            'avg_cost': avg_cost,
+            'current_price': current_price,
+            'gains': ((current_price - avg_cost) / avg_cost) * 100 if avg_cost else 0,
+            'profit': (current_price - avg_cost) * qty
+        })
+        invested_value += avg_cost * qty
+        open_value += current_price * qty
+
+    cash = portfolio['cash']
+    initial_cash = portfolio.get('initial_cash')
+    if initial_cash is None:
+        initial_cash = cash
+    return {
+        'positions': positions,
+        'cash': cash,
+        'invested_value': invested_value,
+        'open_value': open_value,
+        'gains': ((cash + open_value - initial_cash) / initial_cash) * 100 if initial_cash else 0,
+        'unrealized_gains': ((open_value - invested_value) / invested_value) * 100 if invested_value else 0,
+        'valued_at': portfolio.get('valued_at')
+    }
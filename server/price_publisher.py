@@ -0,0 +1,161 @@
+# price_publisher.py
+import json
+import logging
+import math
+import threading
+import time
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+
+class Subscription:
+    """Mailbox of one streaming client.
+
+    Holds at most one pending update per (event, ticker, timeframe): an update
+    arriving before the client consumed the previous one replaces it. A slow
+    client therefore gets the latest values instead of a growing backlog, and
+    publishing never blocks on it.
+    """
+
+    def __init__(self, tickers, timeframes):
+        self.tickers = set(tickers)
+        self.timeframes = set(timeframes)
+        self.delivered = 0
+        self.coalesced = 0
+        self.closed = False
+        self._pending = OrderedDict()
+        self._condition = threading.Condition()
+
+    def wants(self, event, ticker, timeframe):
+        return ticker in self.tickers and (timeframe is None or timeframe in self.timeframes)
+
+    def offer(self, key, message):
+        with self._condition:
+            if key in self._pending:
+                self.coalesced += 1
+            self._pending[key] = message
+            self._condition.notify()
+
+    def take(self, timeout):
+        """Returns the pending messages, waiting up to `timeout` seconds for one."""
+        with self._condition:
+            self._condition.wait_for(lambda: self._pending or self.closed, timeout)
+            messages = list(self._pending.values())
+            self._pending.clear()
+            self.delivered += len(messages)
+            return messages
+
+    def close(self):
+        with self._condition:
+            self.closed = True
+            self._condition.notify()
+
+
+class PricePublisher:
+    """Fans price and marketCycle updates out to streaming subscribers.
+
+    Prices of every subscribed ticker are fetched together once per `interval`
+    by a single poller thread, which only runs while there are subscribers, so
+    the upstream cost does not grow with the number of clients. DataCaching
+    publishes the last bar of each series it saves. Only changed prices are
+    published; new subscribers get the latest known values right away.
+    """
+
+    def __init__(self, load_prices, interval=5, heartbeat=15, max_subscribers=1000):
+        self.load_prices = load_prices
+        self.interval = interval
+        self.heartbeat = heartbeat
+        self.max_subscribers = max_subscribers
+        self._subscriptions = set()
+        self._latest = {}
+        self._lock = threading.Lock()
+        self._poller = None
+        self._stats = {'polls': 0, 'published': 0, 'rejected': 0, 'errors': 0}
+
+    def subscribe(self, tickers, timeframes=()):
+        """Returns a new Subscription, or None when `max_subscribers` is reached."""
+        subscription = Subscription(tickers, timeframes)
+        with self._lock:
+            if len(self._subscriptions) >= self.max_subscribers:
+                self._stats['rejected'] += 1
+                return None
+            self._subscriptions.add(subscription)
+            latest = list(self._latest.items())
+            if self._poller is None or not self._poller.is_alive():
+                self._poller = threading.Thread(target=self._poll, name='price-publisher', daemon=True)
+                self._poller.start()
+        for (event, ticker, timeframe), message in latest:
+            if subscription.wants(event, ticker, timeframe):
+                subscription.offer((event, ticker, timeframe), message)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        subscription.close()
+        with self._lock:
+            self._subscriptions.discard(subscription)
+
+    def publish(self, event, ticker, data, timeframe=None):
+        key = (event, ticker, timeframe)
+        message = {'event': event, 'ticker': ticker, 'timeframe': timeframe, **data}
+        with self._lock:
+            self._latest[key] = message
+            subscriptions = [s for s in self._subscriptions if s.wants(event, ticker, timeframe)]
+            self._stats['published'] += 1
+        for subscription in subscriptions:
+            subscription.offer(key, message)
+
+    def publish_bars(self, ticker, timeframe, data):
+        """Publishes the last bar of a saved series: its close and marketCycle columns."""
+        if data is None or data.empty:
+            return
+        row = data.iloc[-1]
+        values = {
+            column: None if isinstance(row[column], float) and math.isnan(row[column]) else float(row[column])
+            for column in data.columns if column == 'Close' or str(column).startswith('marketCycle')
+        }
+        self.publish('marketCycle', ticker, {'timestamp': data.index[-1].isoformat(), **values}, timeframe)
+
+    def events(self, subscription):
+        """Server-sent events of a subscription, with a comment line every `heartbeat` seconds of silence."""
+        try:
+            while not subscription.closed:
+                messages = subscription.take(self.heartbeat)
+                if not messages:
+                    yield ': keepalive\n\n'
+                for message in messages:
+                    yield f"event: {message['event']}\ndata: {json.dumps(message)}\n\n"
+        finally:
+            self.unsubscribe(subscription)
+
+    def stats(self):
+        with self._lock:
+            subscriptions = list(self._subscriptions)
+            stats = dict(self._stats)
+        stats['subscribers'] = len(subscriptions)
+        stats['tickers'] = len(set().union(*(s.tickers for s in subscriptions))) if subscriptions else 0
+        stats['delivered'] = sum(s.delivered for s in subscriptions)
+        stats['coalesced'] = sum(s.coalesced for s in subscriptions)
+        return stats
+
+    def _poll(self):
+        while True:
+            with self._lock:
+                if not self._subscriptions:
+                    self._poller = None
+                    return
+                tickers = sorted(set().union(*(s.tickers for s in self._subscriptions)))
+                self._stats['polls'] += 1
+            started = time.monotonic()
+            try:
+                prices = self.load_prices(tickers)
+            except Exception as e:
+                logger.error("Error polling prices for the stream: %s", e)
+                with self._lock:
+                    self._stats['errors'] += 1
+                prices = {}
+            for ticker, price in prices.items():
+                previous = self._latest.get(('price', ticker, None))
+                if previous is None or previous['price'] != price:
+                    self.publish('price', ticker, {'price': price, 'time': time.time()})
+            time.sleep(max(0, self.interval - (time.monotonic() - started)))
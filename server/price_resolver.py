@@ -0,0 +1,74 @@
+# price_resolver.py
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+from quote_cache import QuoteCache
+from market_data import YFinanceProvider
+import metrics
+
+logger = logging.getLogger(__name__)
+
+
+class PriceResolver:
+    """Resolves current prices for many tickers at once.
+
+    Cache misses are fetched with a single bulk call to the market data
+    provider (yfinance by default). Tickers the bulk call could not price fall
+    back to a bounded parallel fan-out, and the whole resolution is capped by
+    `deadline` seconds, waiting on other requests' fetches of the same
+    tickers included. A failing ticker is simply
+    left out of the result, it never fails the other ones.
+    """
+
+    def __init__(self, quote_cache=None, max_workers=8, deadline=10, provider=None):
+        self.quote_cache = quote_cache if quote_cache is not None else QuoteCache()
+        self.provider = provider if provider is not None else YFinanceProvider()
+        self.max_workers = max_workers
+        self.deadline = deadline
+        self._executor = ThreadPoolExecutor(max_workers=max_workers)
+
+    def get(self, ticker):
+        return self.quote_cache.get(ticker, self._fetch_one, timeout=self.deadline)
+
+    def get_many(self, tickers):
+        """Returns a {ticker: price} dict, tickers without a price are omitted."""
+        tickers = list(dict.fromkeys(tickers))
+        if not tickers:
+            return {}
+        prices = self.quote_cache.get_many(tickers, self._fetch_many, timeout=self.deadline)
+        return {ticker: price for ticker, price in prices.items() if price is not None}
+
+    def _fetch_many(self, tickers):
+        with metrics.stage_seconds.time(stage='price_fetch'):
+            prices = self._fetch_within_deadline(tickers)
+        metrics.stage_items.inc(len(tickers), stage='price_fetch')
+        return prices
+
+    def _fetch_within_deadline(self, tickers):
+        started = time.monotonic()
+        prices = {}
+        try:
+            prices = self.provider.latest_prices(tickers, timeout=self.deadline)
+        except Exception as e:
+            metrics.stage_errors.inc(stage='price_fetch')
+            logger.error("Error bulk fetching prices for %s: %s", tickers, e)
+
+        missing = [ticker for ticker in tickers if prices.get(ticker) is None]
+        remaining = self.deadline - (time.monotonic() - started)
+        if missing and remaining > 0:
+            futures = {self._executor.submit(self._fetch_one, ticker): ticker for ticker in missing}
+            done, not_done = wait(futures, timeout=remaining)
+            for future in done:
+                prices[futures[future]] = future.result()
+            for future in not_done:
+                future.cancel()
+                logger.warning("Timed out fetching price for %s", futures[future])
+        return prices
+
+    def _fetch_one(self, ticker):
+        """Fetches the current price for a given ticker symbol from the provider."""
+        try:
+            return self.provider.latest_price(ticker)
+        except Exception as e:
+            logger.error("Error fetching price for %s: %s", ticker, e)
+            return None
@@ -1,6 +1,12 @@
 # project_service.py
 from firebase_admin import firestore
 import datetime
+import logging
+import math
+from firestore_bulk import run_transaction
+import portfolio
+
+logger = logging.getLogger(__name__)
 
 class ProjectService:
     def __init__(self, db):
@@ -22,7 +28,10 @@ class ProjectService:
             'project': name,
             'cash': cash
         }
-        project_ref.set(project_data)
+        batch = self.db.batch()
+        batch.set(project_ref, project_data)
+        batch.set(portfolio.portfolio_ref(self.db, name), portfolio.build(name, project_data, [], project_data['create_date'], 0))
+        batch.commit()
         return project_data, 201
 
     def fund_project(self, data):
@@ -31,18 +40,28 @@ class ProjectService:
 
         if not project_name or amount is None:
             return {'error': 'Missing "project" or "amount" parameter'}, 400
+        if not isinstance(amount, (int, float)) or isinstance(amount, bool) or not math.isfinite(amount):
+            return {'error': 'Invalid "amount" parameter'}, 400
 
         project_ref = self.db.collection('paper_projects').document(project_name)
-        project_doc = project_ref.get()
+        portfolio_ref = portfolio.portfolio_ref(self.db, project_name)
 
-        if not project_doc.exists:
-            return {'error': 'Project not found'}, 404
+        def execute(transaction):
+            snapshots = {snapshot.reference.path: snapshot for snapshot in self.db.get_all([project_ref, portfolio_ref], transaction=transaction)}
+            if not snapshots[project_ref.path].exists:
+                return {'error': 'Project not found'}, 404
 
-        project_data = project_doc.to_dict()
-        project_data['cash'] += amount
-        project_ref.update({'cash': project_data['cash']})
+            cash = snapshots[project_ref.path].to_dict()['cash'] + amount
+            transaction.update(project_ref, {'cash': cash})
+            if snapshots[portfolio_ref.path].exists:
+                transaction.update(portfolio_ref, {'cash': cash})
+            return {'cash': cash}, 200
 
-        return {'cash': project_data['cash']}, 200
+        try:
+            return run_transaction(self.db, execute)
+        except ValueError as e:
+            logger.warning("Transaction aborted: %s", e)
+            return {'error': 'Too many concurrent updates on this project, please retry'}, 409
 
     def get_project(self, project_name):
         if not project_name:
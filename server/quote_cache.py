@@ -0,0 +1,206 @@
+# quote_cache.py
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+
+class _Flight:
+    def __init__(self):
+        self.event = threading.Event()
+        self.value = None
+
+
+class QuoteCache:
+    """In-process price cache shared by every blueprint.
+
+    Entries expire after `ttl` seconds, the least recently used entries are
+    evicted once `max_entries` is reached, and concurrent misses on the same
+    ticker wait on a single upstream fetch instead of each hitting Yahoo.
+    Expired entries are kept until replaced or evicted: a caller giving up on
+    a fetch after `timeout` seconds gets the expired price, or None.
+    """
+
+    def __init__(self, ttl=15, max_entries=2048):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._flights = {}
+        # Called with {ticker: price} for every fetched or put price, e.g. OrderBook.on_prices
+        self._listeners = []
+        self._lock = threading.Lock()
+        self._stats = {
+            'hits': 0,
+            'misses': 0,
+            'stale': 0,
+            'coalesced': 0,
+            'timeouts': 0,
+            'errors': 0,
+            'evictions': 0
+        }
+
+    def get(self, ticker, loader, timeout=None):
+        """Returns the cached price for `ticker`, calling `loader(ticker)` on a miss.
+
+        Waiting on another caller's fetch of `ticker` is capped by `timeout` seconds.
+        """
+        with self._lock:
+            value = self._lookup(ticker)
+            if value is not None:
+                return value
+            flight = self._flights.get(ticker)
+            leader = flight is None
+            if leader:
+                flight = self._flights[ticker] = _Flight()
+            else:
+                self._stats['coalesced'] += 1
+
+        if not leader:
+            if not flight.event.wait(timeout):
+                return self._expired(ticker)
+            return flight.value
+
+        try:
+            flight.value = loader(ticker)
+        except Exception as e:
+            logger.error("Error loading quote for %s: %s", ticker, e)
+            flight.value = None
+        finally:
+            with self._lock:
+                if flight.value is None:
+                    self._stats['errors'] += 1
+                else:
+                    self._store(ticker, flight.value)
+                del self._flights[ticker]
+            flight.event.set()
+        if flight.value is not None:
+            self._notify({ticker: flight.value})
+        return flight.value
+
+    def get_many(self, tickers, loader_many, timeout=None):
+        """Returns {ticker: price} for `tickers`, calling `loader_many(missing)` once for all misses.
+
+        Waiting on other callers' fetches is capped by `timeout` seconds from
+        the call, loading included.
+        """
+        started = time.monotonic()
+        prices = {}
+        led = {}
+        waiting = {}
+        with self._lock:
+            for ticker in tickers:
+                value = self._lookup(ticker)
+                if value is not None:
+                    prices[ticker] = value
+                elif ticker in self._flights:
+                    self._stats['coalesced'] += 1
+                    waiting[ticker] = self._flights[ticker]
+                else:
+                    led[ticker] = self._flights[ticker] = _Flight()
+
+        if led:
+            loaded = {}
+            try:
+                loaded = loader_many(list(led)) or {}
+            except Exception as e:
+                logger.error("Error loading quotes for %s: %s", list(led), e)
+            finally:
+                with self._lock:
+                    for ticker, flight in led.items():
+                        flight.value = loaded.get(ticker)
+                        if flight.value is None:
+                            self._stats['errors'] += 1
+                        else:
+                            self._store(ticker, flight.value)
+                        del self._flights[ticker]
+                for flight in led.values():
+                    flight.event.set()
+            self._notify({ticker: flight.value for ticker, flight in led.items() if flight.value is not None})
+            for ticker, flight in led.items():
+                prices[ticker] = flight.value
+
+        for ticker, flight in waiting.items():
+            remaining = None if timeout is None else max(timeout - (time.monotonic() - started), 0)
+            if flight.event.wait(remaining):
+                prices[ticker] = flight.value
+            else:
+                prices[ticker] = self._expired(ticker)
+        return prices
+
+    def peek_many(self, tickers):
+        """Returns {ticker: price} for the fresh entries only, without loading or waiting on anything."""
+        with self._lock:
+            prices = {ticker: self._lookup(ticker) for ticker in tickers}
+        return {ticker: price for ticker, price in prices.items() if price is not None}
+
+    def put(self, ticker, price):
+        with self._lock:
+            self._store(ticker, price)
+        self._notify({ticker: price})
+
+    def add_listener(self, listener):
+        """Calls `listener({ticker: price})` with the new prices each time quotes are fetched or put.
+
+        Listeners run in the thread storing the prices and must return quickly.
+        """
+        self._listeners.append(listener)
+
+    def invalidate(self, ticker=None):
+        with self._lock:
+            if ticker is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(ticker, None)
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats['size'] = len(self._entries)
+            stats['inflight'] = len(self._flights)
+        stats['ttl'] = self.ttl
+        stats['max_entries'] = self.max_entries
+        lookups = stats['hits'] + stats['misses']
+        stats['hit_ratio'] = stats['hits'] / lookups if lookups else 0
+        return stats
+
+    def _notify(self, prices):
+        if not prices:
+            return
+        for listener in self._listeners:
+            try:
+                listener(prices)
+            except Exception as e:
+                logger.error("Error in quote listener %r: %s", listener, e)
+
+    def _lookup(self, ticker):
+        # Must be called with self._lock held
+        entry = self._entries.get(ticker)
+        if entry is None:
+            self._stats['misses'] += 1
+            return None
+        price, stored_at = entry
+        if time.monotonic() - stored_at > self.ttl:
+            self._stats['stale'] += 1
+            self._stats['misses'] += 1
+            return None
+        self._entries.move_to_end(ticker)
+        self._stats['hits'] += 1
+        return price
+
+    def _expired(self, ticker):
+        # Fallback of a caller that timed out waiting on a fetch
+        logger.warning("Timed out waiting for the quote of %s", ticker)
+        with self._lock:
+            self._stats['timeouts'] += 1
+            entry = self._entries.get(ticker)
+        return entry[0] if entry is not None else None
+
+    def _store(self, ticker, price):
+        # Must be called with self._lock held
+        self._entries[ticker] = (price, time.monotonic())
+        self._entries.move_to_end(ticker)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self._stats['evictions'] += 1
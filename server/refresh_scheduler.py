@@ -0,0 +1,142 @@
+# refresh_scheduler.py
+import datetime
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from zoneinfo import ZoneInfo
+
+logger = logging.getLogger(__name__)
+
+MARKET_TZ = ZoneInfo('America/New_York')
+
+
+def every(seconds, offset=0):
+    """Cadence running on every multiple of `seconds`, `offset` seconds late so the bar is complete."""
+    def next_run(now):
+        return (now - offset) // seconds * seconds + seconds + offset
+    return next_run
+
+
+def after_close(hour=16, minute=15):
+    """Cadence running once per weekday at `hour:minute` New York time."""
+    def next_run(now):
+        current = datetime.datetime.fromtimestamp(now, MARKET_TZ)
+        candidate = current.replace(hour=hour, minute=minute, second=0, microsecond=0)
+        while candidate.timestamp() <= now or candidate.weekday() >= 5:
+            candidate = (candidate + datetime.timedelta(days=1)).replace(hour=hour, minute=minute)
+        return candidate.timestamp()
+    return next_run
+
+
+class RefreshJob:
+    def __init__(self, name, timeframes, cadence=None, initialize=False):
+        self.name = name
+        self.timeframes = timeframes
+        self.cadence = cadence
+        self.initialize = initialize
+        self.next_run = None
+        self.metrics = {
+            'runs': 0,
+            'failures': 0,
+            'skipped': 0,
+            'running': False,
+            'last_start': None,
+            'last_duration': None,
+            'last_success': None,
+            'last_error': None
+        }
+
+    def status(self):
+        status = dict(self.metrics)
+        status['timeframes'] = self.timeframes
+        status['next_run'] = self.next_run
+        return status
+
+
+class RefreshScheduler:
+    """Runs DataCaching refreshes in the background instead of in request threads.
+
+    Each timeframe is its own job with its natural cadence: 1min every minute,
+    1h every hour and 1D after the close. `init` and `tick` are on-demand jobs
+    refreshing every timeframe. Jobs sharing a timeframe never overlap:
+    triggering a job while one of its timeframes is being refreshed is counted
+    as skipped.
+    """
+
+    def __init__(self, run_refresh, jobs=None, poll_interval=1):
+        self.run_refresh = run_refresh
+        self.poll_interval = poll_interval
+        if jobs is None:
+            jobs = [
+                RefreshJob('1min', ['1min'], every(60, offset=5)),
+                RefreshJob('1h', ['1h'], every(3600, offset=30)),
+                RefreshJob('1D', ['1D'], after_close()),
+                RefreshJob('init', ['1min', '1h', '1D'], initialize=True),
+                RefreshJob('tick', ['1min', '1h', '1D'])
+            ]
+        self.jobs = {job.name: job for job in jobs}
+        self._timeframe_locks = {timeframe: threading.Lock() for job in jobs for timeframe in job.timeframes}
+        self._executor = ThreadPoolExecutor(max_workers=len(self.jobs))
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self._thread is not None:
+            return
+        now = time.time()
+        for job in self.jobs.values():
+            if job.cadence is not None:
+                job.next_run = job.cadence(now)
+        self._thread = threading.Thread(target=self._loop, name='refresh-scheduler', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def enqueue(self, name):
+        """Starts a job now, returns False if one of its timeframes is already being refreshed."""
+        job = self.jobs[name]
+        acquired = []
+        for timeframe in sorted(job.timeframes):
+            if not self._timeframe_locks[timeframe].acquire(blocking=False):
+                for lock in acquired:
+                    lock.release()
+                job.metrics['skipped'] += 1
+                return False
+            acquired.append(self._timeframe_locks[timeframe])
+        job.metrics['running'] = True
+        self._executor.submit(self._run, job)
+        return True
+
+    def status(self):
+        return {name: job.status() for name, job in self.jobs.items()}
+
+    def _loop(self):
+        while not self._stop.wait(self.poll_interval):
+            now = time.time()
+            for job in self.jobs.values():
+                if job.next_run is not None and job.next_run <= now:
+                    job.next_run = job.cadence(now)
+                    self.enqueue(job.name)
+
+    def _run(self, job):
+        started = time.time()
+        job.metrics['last_start'] = started
+        try:
+            self.run_refresh(job.timeframes, job.initialize)
+            job.metrics['last_success'] = time.time()
+            job.metrics['last_error'] = None
+        except Exception as e:
+            logger.error("Error running refresh job %s: %s", job.name, e)
+            job.metrics['failures'] += 1
+            job.metrics['last_error'] = str(e)
+        finally:
+            job.metrics['runs'] += 1
+            job.metrics['last_duration'] = time.time() - started
+            job.metrics['running'] = False
+            for timeframe in job.timeframes:
+                self._timeframe_locks[timeframe].release()
@@ -0,0 +1,208 @@
+# sharding.py
+import bisect
+import contextlib
+import hashlib
+import logging
+import math
+import os
+import socket
+import threading
+import time
+import uuid
+from firestore_bulk import run_transaction
+
+logger = logging.getLogger(__name__)
+
+
+def _hash(value):
+    # Stable across processes, unlike hash()
+    return int.from_bytes(hashlib.md5(value.encode('utf-8')).digest()[:8], 'big')
+
+
+class HashRing:
+    """Consistent hashing of keys onto members.
+
+    Every member owns `vnodes` points of the ring and a key belongs to the
+    member of the first point after the key's hash. Adding or removing a member
+    only moves the keys of the points it gains or loses, about 1/N of them.
+    """
+
+    def __init__(self, members, vnodes=64):
+        self.members = sorted(set(members))
+        points = sorted((_hash(f"{member}#{i}"), member) for member in self.members for i in range(vnodes))
+        self._hashes = [point for point, _ in points]
+        self._owners = [member for _, member in points]
+
+    def owner(self, key):
+        if not self._hashes:
+            return None
+        i = bisect.bisect(self._hashes, _hash(str(key))) % len(self._hashes)
+        return self._owners[i]
+
+    def assign(self, keys):
+        """Maps `keys` to members with bounded loads: at most ceil(len(keys) / N) keys each.
+
+        A key whose owner is full goes to the next member along the ring, so
+        loads stay balanced with few keys while most keys keep their owner when
+        members change. The result only depends on the members and the keys.
+        """
+        if not self._hashes:
+            return {}
+        capacity = math.ceil(len(keys) / len(self.members))
+        loads = {member: 0 for member in self.members}
+        owners = {}
+        for key in keys:
+            i = bisect.bisect(self._hashes, _hash(str(key)))
+            while loads[self._owners[i % len(self._hashes)]] >= capacity:
+                i += 1
+            owners[key] = self._owners[i % len(self._hashes)]
+            loads[owners[key]] += 1
+        return owners
+
+
+class ShardCoordinator:
+    """Splits the refresh of the watchlist across worker processes or nodes.
+
+    Tickers are hashed into `shards` fixed shards and shards are spread evenly
+    over the live workers with a HashRing. Workers are live while their heartbeat
+    document in `refresh_workers` has not expired; a background thread renews
+    it every `heartbeat_seconds` and it expires after three missed beats. A worker only refreshes the shards it holds
+    a lease on: `refresh_leases/{shard}` documents, claimed in a transaction
+    when free, expired or already its own, and valid for `lease_seconds`. So
+    two workers never refresh the same tickers, even while their views of the
+    membership disagree, and the shards of a worker that dies are taken over
+    once its heartbeat and leases expire. The heartbeat thread also renews
+    the leases and rebalances, so shards move even between refreshes, but a
+    shard is never released while a refresh may still be using it.
+    """
+
+    def __init__(self, db, worker_id=None, shards=64, lease_seconds=60, heartbeat_seconds=10, clock=time.time):
+        self.db = db
+        self.worker_id = worker_id or f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:6]}"
+        self.shards = shards
+        self.lease_seconds = lease_seconds
+        self.heartbeat_seconds = heartbeat_seconds
+        self.clock = clock
+        self.held = set()
+        self.members = [self.worker_id]
+        # Refreshes running on the held shards
+        self._busy = 0
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def shard_of(self, ticker):
+        return _hash(ticker) % self.shards
+
+    def start(self):
+        """Joins the workers and keeps the heartbeat alive in a background thread."""
+        if self._thread is not None:
+            return
+        self.heartbeat()
+        self._thread = threading.Thread(target=self._loop, name='shard-heartbeat', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Leaves gracefully: the other workers take the shards over without waiting for expiry."""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        with self._lock:
+            for shard in list(self.held):
+                self._release(shard)
+        self.db.collection('refresh_workers').document(self.worker_id).delete()
+
+    def heartbeat(self):
+        now = self.clock()
+        self.db.collection('refresh_workers').document(self.worker_id).set({
+            'worker_id': self.worker_id,
+            'heartbeat': now,
+            'expires_at': now + 3 * self.heartbeat_seconds
+        })
+
+    def live_workers(self):
+        workers = {doc.id for doc in self.db.collection('refresh_workers').where('expires_at', '>', self.clock()).stream()}
+        workers.add(self.worker_id)
+        return sorted(workers)
+
+    @contextlib.contextmanager
+    def assignment(self, tickers):
+        """Yields the part of `tickers` this worker refreshes, its shards stay held until the block exits."""
+        with self._lock:
+            held = self._sync()
+            self._busy += 1
+        try:
+            yield [ticker for ticker in tickers if self.shard_of(ticker) in held]
+        finally:
+            with self._lock:
+                self._busy -= 1
+
+    def status(self):
+        return {
+            'worker_id': self.worker_id,
+            'workers': self.members,
+            'shards': self.shards,
+            'held': sorted(self.held)
+        }
+
+    def _sync(self):
+        """Claims or renews this worker's shards and releases the moved ones when idle, returns the held shards.
+
+        Must be called with self._lock held.
+        """
+        self.members = self.live_workers()
+        owners = HashRing(self.members).assign([f"shard-{shard}" for shard in range(self.shards)])
+        wanted = {shard for shard in range(self.shards) if owners[f"shard-{shard}"] == self.worker_id}
+        if self._busy:
+            # A running refresh may use any held shard, keep them until it is done
+            wanted |= self.held
+        for shard in self.held - wanted:
+            self._release(shard)
+        for shard in wanted:
+            if self._claim(shard):
+                self.held.add(shard)
+            else:
+                # Still leased by its previous owner, retried on the next sync
+                self.held.discard(shard)
+        return set(self.held)
+
+    def _claim(self, shard):
+        lease_ref = self.db.collection('refresh_leases').document(str(shard))
+
+        def execute(transaction):
+            lease = lease_ref.get(transaction=transaction).to_dict()
+            now = self.clock()
+            if lease is not None and lease['owner'] != self.worker_id and lease['expires_at'] > now:
+                return False
+            transaction.set(lease_ref, {'shard': shard, 'owner': self.worker_id, 'expires_at': now + self.lease_seconds})
+            return True
+
+        try:
+            return run_transaction(self.db, execute)
+        except ValueError as e:
+            logger.warning("Could not claim shard %s: %s", shard, e)
+            return False
+
+    def _release(self, shard):
+        lease_ref = self.db.collection('refresh_leases').document(str(shard))
+
+        def execute(transaction):
+            lease = lease_ref.get(transaction=transaction).to_dict()
+            if lease is not None and lease['owner'] == self.worker_id:
+                transaction.delete(lease_ref)
+
+        try:
+            run_transaction(self.db, execute)
+        except ValueError as e:
+            logger.warning("Could not release shard %s: %s", shard, e)
+        self.held.discard(shard)
+
+    def _loop(self):
+        while not self._stop.wait(self.heartbeat_seconds):
+            try:
+                self.heartbeat()
+                with self._lock:
+                    self._sync()
+            except Exception as e:
+                logger.error("Error renewing the worker heartbeat and leases: %s", e)
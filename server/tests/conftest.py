@@ -0,0 +1,83 @@
+import os
+import sys
+import numpy as np
+import pandas as pd
+from concurrent.futures.process import BrokenProcessPool
+import pytest
+
+# The server modules are top-level modules of server/
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from memory_firestore import MemoryFirestore
+from project_service import ProjectService
+from quote_cache import QuoteCache
+from trade_service import TradeService
+
+
+# DataCaching's MarketCycle parameters
+MARKET_CYCLE_PARAMS = {
+    'donchianPeriod': 14,
+    'donchianSmoothing': 3,
+    'rsiPeriod': 14,
+    'rsiSmoothing': 3,
+    'srsiPeriod': 20,
+    'srsiSmoothing': 3,
+    'srsiK': 5,
+    'srsiD': 5,
+    'rsiWeight': 0.5,
+    'srsiWeight': 1.0,
+    'dcoWeight': 1.0
+}
+
+
+class BrokenPool:
+    """A process pool whose worker died: it refuses every task."""
+
+    def submit(self, *args, **kwargs):
+        raise BrokenProcessPool('A child process terminated abruptly')
+
+    def map(self, *args, **kwargs):
+        raise BrokenProcessPool('A child process terminated abruptly')
+
+    def shutdown(self, wait=True):
+        pass
+
+
+class NoProvider:
+    """Market data provider without any price, so tests only see the prices they give."""
+
+    def latest_prices(self, tickers, timeout=None):
+        return {}
+
+    def latest_price(self, ticker):
+        return None
+
+
+@pytest.fixture
+def db():
+    """MemoryFirestore holding project 'p' with 10000 cash."""
+    db = MemoryFirestore()
+    ProjectService(db).create_project({'name': 'p', 'cash': 10000})
+    return db
+
+
+@pytest.fixture
+def trade_service(db):
+    return TradeService(db, QuoteCache(ttl=15), provider=NoProvider())
+
+
+@pytest.fixture
+def make_bars():
+    """Builds a seeded random-walk OHLCV frame of `n` bars ending at `end`."""
+    def make(n, end='2024-06-28', freq='B', seed=0, tz=None):
+        index = pd.date_range(end=end, periods=n, freq=freq, tz=tz)
+        close = 100 + np.random.default_rng(seed).standard_normal(n).cumsum()
+        return pd.DataFrame({
+            'Open': close,
+            'High': close + 1,
+            'Low': close - 1,
+            'Close': close,
+            'Adj Close': close,
+            'Volume': 1000.0
+        }, index=index)
+    return make
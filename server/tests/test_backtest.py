@@ -0,0 +1,55 @@
+from concurrent.futures import ThreadPoolExecutor
+import pandas as pd
+import Backtest as backtest_module
+from Backtest import Backtest
+from conftest import BrokenPool
+
+
+def test_backtest_replaces_a_broken_pool(make_bars, monkeypatch):
+    monkeypatch.setattr(backtest_module, 'ProcessPoolExecutor', lambda workers, mp_context=None: ThreadPoolExecutor(workers))
+    monkeypatch.setitem(backtest_module._PROCESS_POOLS, 2, BrokenPool())
+    frames = {}
+    for i, ticker in enumerate(['AAA', 'BBB']):
+        frames[ticker] = make_bars(200, seed=i)
+        frames[ticker]['marketCycle'] = [10.0, 30.0, 90.0, 70.0] * 50
+
+    result = Backtest(workers=2).run(frames)
+
+    assert len(result['trades']) == len(Backtest(workers=0).run(frames)['trades']) > 0
+    assert isinstance(backtest_module._PROCESS_POOLS[2], ThreadPoolExecutor)
+    backtest_module._PROCESS_POOLS[2].shutdown()
+
+
+def _frame(start, close, cycle):
+    return pd.DataFrame({'Close': close, 'marketCycle': cycle}, index=pd.date_range(start, periods=len(close), freq='D'))
+
+
+def test_fills_sleeves_and_equity_of_a_known_crossing_sequence():
+    frames = {
+        # Sell signal without a position (skipped), buy at 30, sell at 50
+        'AAA': _frame('2024-01-01', [5.0, 6.0, 10.0, 30.0, 40.0, 50.0], [90.0, 70.0, 10.0, 25.0, 85.0, 75.0]),
+        # Trades after AAA's last bar: buy at 8, still held at the end
+        'BBB': _frame('2024-01-08', [7.0, 8.0, 9.0], [10.0, 30.0, 40.0])
+    }
+
+    result = Backtest(cash=2000, workers=0).run(frames)
+
+    trades = result['trades']
+    assert list(trades['type']) == ['buy', 'sell', 'buy']
+    # Whole shares of the 1000 sleeve: floor(1000 / 30) and floor(1000 / 8)
+    assert list(trades['qty']) == [33, 33, 125]
+    assert list(trades['price']) == [30.0, 50.0, 8.0]
+    assert list(trades['cash']) == [10.0, 1660.0, 0.0]
+    assert trades['profit'].iloc[1] == (50 - 30) * 33
+
+    equity = result['equity']
+    # AAA keeps its last value after its last bar, BBB is all cash before its first one
+    assert list(equity['AAA']) == [1000, 1000, 1000, 1000, 1330, 1660, 1660, 1660, 1660]
+    assert list(equity['BBB']) == [1000, 1000, 1000, 1000, 1000, 1000, 1000, 1000, 1125]
+    assert list(equity['equity']) == [2000, 2000, 2000, 2000, 2330, 2660, 2660, 2660, 2785]
+
+    summary = result['summary']
+    assert summary['final_equity'] == 2785
+    assert summary['realized_profit'] == 660
+    assert summary['win_rate'] == 1.0
+    assert summary['trades'] == 3
@@ -0,0 +1,166 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import pandas as pd
+import pytest
+import DataCaching as data_caching
+from DataCaching import DataCaching
+from conftest import BrokenPool
+from firestore_bulk import FirestoreBulkWriter
+from market_data import ReplayProvider
+from memory_firestore import MemoryFirestore
+
+
+def _data_caching(provider=None):
+    cache = DataCaching(MemoryFirestore(), provider=provider)
+    cache.pipeline['compute_workers'] = 0
+    return cache
+
+
+def test_panel_matches_per_ticker_with_unequal_histories(make_bars):
+    cache = _data_caching()
+    frames = {'AAA': make_bars(504, seed=1), 'BBB': make_bars(300, seed=2), 'CCC': make_bars(260, end='2024-05-31', seed=3)}
+    frames['AAA'].iloc[100:103] = np.nan
+
+    computed = cache._calculate_market_cycle_panel(frames, list(frames))
+
+    for ticker, frame in frames.items():
+        expected = cache._calculate_market_cycle(frame)
+        pd.testing.assert_index_equal(computed[ticker].index, expected.index)
+        np.testing.assert_allclose(computed[ticker]['marketCycle'], expected['marketCycle'], rtol=1e-9, equal_nan=True)
+
+
+def test_initialize_saves_tickers_with_unequal_histories(tmp_path, make_bars):
+    make_bars(504, seed=1).to_csv(tmp_path / 'AAA_1d.csv')
+    make_bars(300, seed=2).to_csv(tmp_path / 'BBB_1d.csv')
+    cache = _data_caching(ReplayProvider(str(tmp_path), speed=0, start='2024-06-29'))
+    cache.setTickers(['AAA', 'BBB'])
+
+    cache.refresh(['1D'], initialize=True)
+
+    for ticker in ['AAA', 'BBB']:
+        data = cache.get_data(ticker, '1D', trim=False)
+        assert data is not None
+        assert data['marketCycle'].notna().any()
+
+
+def test_refresh_replaces_a_broken_compute_pool(tmp_path, make_bars, monkeypatch):
+    make_bars(300, seed=1).to_csv(tmp_path / 'AAA_1d.csv')
+    cache = _data_caching(ReplayProvider(str(tmp_path), speed=0, start='2024-06-29'))
+    cache.setTickers(['AAA'])
+    cache.pipeline['compute_workers'] = 1
+    monkeypatch.setattr(data_caching, 'ProcessPoolExecutor', lambda workers, mp_context=None: ThreadPoolExecutor(workers))
+    monkeypatch.setitem(data_caching._PROCESS_POOLS, 1, BrokenPool())
+
+    cache.refresh(['1D'], initialize=True)
+
+    assert isinstance(data_caching._PROCESS_POOLS[1], ThreadPoolExecutor)
+    assert cache.get_data('AAA', '1D', trim=False)['marketCycle'].notna().any()
+    data_caching._PROCESS_POOLS[1].shutdown()
+
+
+def test_failing_persist_submit_releases_the_slot():
+    in_flight = threading.BoundedSemaphore(1)
+    in_flight.acquire()
+    persists = ThreadPoolExecutor(1)
+    persists.shutdown()
+
+    _data_caching()._queue_persist(persists, '1D', None, in_flight)
+
+    assert in_flight.acquire(timeout=1)
+
+
+class _Publisher:
+    def __init__(self):
+        self.published = []
+
+    def publish_bars(self, ticker, timeframe, data):
+        self.published.append((ticker, timeframe, data.index[-1]))
+
+
+def test_bars_are_published_once_committed(make_bars, monkeypatch):
+    publisher = _Publisher()
+    cache = DataCaching(MemoryFirestore(), publisher=publisher)
+    data = make_bars(10)
+    writer = FirestoreBulkWriter(cache.db)
+
+    cache._save_to_firestore('AAA', '1D', data, writer=writer)
+    assert publisher.published == []
+    writer.flush()
+    assert publisher.published == [('AAA', '1D', data.index[-1])]
+
+    writer = FirestoreBulkWriter(cache.db)
+    cache._save_to_firestore('BBB', '1D', data, writer=writer)
+
+    def unavailable():
+        raise RuntimeError('Firestore unavailable')
+
+    monkeypatch.setattr(writer._batch, 'commit', unavailable)
+    with pytest.raises(RuntimeError):
+        writer.flush()
+    assert publisher.published == [('AAA', '1D', data.index[-1])]
+
+
+def _stored_history(cache, ticker, timeframe):
+    return cache.get_data(ticker, timeframe, start=pd.Timestamp(0))
+
+
+def _replay_cache(db, provider):
+    cache = DataCaching(db, provider=provider)
+    cache.pipeline['compute_workers'] = 0
+    cache.setTickers(['AAA'])
+    return cache
+
+
+def _assert_5d_matches_full_recompute(cache):
+    daily = _stored_history(cache, 'AAA', '1D').drop(columns='marketCycle')
+    expected = cache._calculate_market_cycle(cache._resample_to_5d(daily))
+    stored = _stored_history(cache, 'AAA', '5D')
+    pd.testing.assert_index_equal(stored.index, expected.index)
+    np.testing.assert_allclose(stored['marketCycle'], expected['marketCycle'], rtol=1e-9, equal_nan=True)
+
+
+def test_5d_updates_match_full_history_recompute(tmp_path, make_bars):
+    make_bars(1500, seed=4).to_csv(tmp_path / 'AAA_1d.csv')
+    provider = ReplayProvider(str(tmp_path), speed=0, start='2024-03-01')
+    db = MemoryFirestore()
+    _replay_cache(db, provider).refresh(['1D'], initialize=True)
+
+    for _ in range(6):
+        provider.advance(7 * 86400)
+        _replay_cache(db, provider).refresh(['1D'])
+
+    _assert_5d_matches_full_recompute(_replay_cache(db, provider))
+
+
+def test_series_without_state_are_recomputed_over_full_history(tmp_path, make_bars):
+    make_bars(1500, seed=5).to_csv(tmp_path / 'AAA_1d.csv')
+    provider = ReplayProvider(str(tmp_path), speed=0, start='2024-03-01')
+    db = MemoryFirestore()
+    _replay_cache(db, provider).refresh(['1D'], initialize=True)
+    # As written before the incremental state existed
+    for timeframe in ['1D', '5D']:
+        ref = db.collection('paper_data').document(f'AAA_{timeframe}')
+        head = ref.get().to_dict()
+        head.pop('mc_state')
+        ref.set(head)
+
+    provider.advance(7 * 86400)
+    _replay_cache(db, provider).refresh(['1D'])
+
+    cache = _replay_cache(db, provider)
+    daily = _stored_history(cache, 'AAA', '1D')
+    expected = cache._calculate_market_cycle(daily.drop(columns='marketCycle'))
+    np.testing.assert_allclose(daily['marketCycle'], expected['marketCycle'], rtol=1e-9, equal_nan=True)
+    _assert_5d_matches_full_recompute(cache)
+
+
+def test_5d_bins_do_not_depend_on_the_first_bar(make_bars):
+    cache = _data_caching()
+    daily = make_bars(60, end='2024-04-30', tz='America/New_York')
+
+    full = cache._resample_to_5d(daily)
+    later = cache._resample_to_5d(daily.iloc[7:])
+
+    pd.testing.assert_index_equal(later.index[1:], full.index[-len(later) + 1:])
+    assert set(np.diff(full.index.tz_localize(None).values).astype('timedelta64[D]').astype(int)) == {5}
@@ -0,0 +1,72 @@
+import json
+import numpy as np
+import pandas as pd
+import pytest
+from conftest import MARKET_CYCLE_PARAMS as PARAMS
+from HelperTA import HelperTA, IncrementalMarketCycle, _Ewm
+
+
+@pytest.fixture
+def close(make_bars):
+    close = make_bars(400, seed=7)['Close'].copy()
+    # A flat stretch: zero Donchian range and zero RSI moves, the 0/0 cases
+    close.iloc[200:230] = close.iloc[199]
+    return close
+
+
+def _batch(close):
+    return HelperTA().MarketCycle(close, close, close, **PARAMS).to_numpy()
+
+
+def test_incremental_matches_batch(close):
+    np.testing.assert_allclose(IncrementalMarketCycle(**PARAMS).run(close), _batch(close), rtol=1e-9, atol=1e-9, equal_nan=True)
+
+
+def test_incremental_resumes_from_its_stored_state(close):
+    mc = IncrementalMarketCycle(**PARAMS)
+    head = mc.run(close.iloc[:250])
+    # The state is stored in Firestore: it must survive a JSON round-trip
+    resumed = IncrementalMarketCycle.from_dict(json.loads(json.dumps(mc.to_dict())))
+    tail = resumed.run(close.iloc[250:])
+    np.testing.assert_allclose(np.concatenate([head, tail]), _batch(close), rtol=1e-9, atol=1e-9, equal_nan=True)
+
+
+def test_revise_replaces_the_last_bar(close):
+    mc = IncrementalMarketCycle(**PARAMS)
+    mc.run(close.iloc[:-1])
+    mc.update(close.iloc[-1] * 1.05)
+    revised = mc.revise(close.iloc[-1])
+    assert revised == pytest.approx(_batch(close)[-1], rel=1e-9)
+    with pytest.raises(ValueError):
+        IncrementalMarketCycle(**PARAMS).revise(1.0)
+
+
+def test_ewm_resumes_from_a_weighted_sum_state(close):
+    values = close.diff().to_numpy()
+    decay = 1.0 - 2.0 / (14 + 1.0)
+    num = den = 0.0
+    for value in values[:100]:
+        num, den = (num * decay, den * decay) if np.isnan(value) else (value + decay * num, 1.0 + decay * den)
+    ewm = _Ewm.from_dict({'span': 14, 'num': num, 'den': den})
+    resumed = [ewm.update(value) for value in values[100:]]
+    np.testing.assert_allclose(resumed, close.diff().ewm(span=14).mean().to_numpy()[100:], rtol=1e-9)
+
+
+def test_panel_matches_batch_per_column(make_bars, close):
+    columns = [close.to_numpy(), make_bars(400, seed=8)['Close'].to_numpy(), make_bars(400, seed=9)['Close'].to_numpy()]
+    panel = HelperTA().MarketCyclePanel(*[np.column_stack(columns)] * 3, **PARAMS)
+    for i, column in enumerate(columns):
+        np.testing.assert_allclose(panel[:, i], _batch(pd.Series(column)), rtol=1e-9, atol=1e-9, equal_nan=True)
+
+
+def test_panel_valid_mask_drops_the_bars_like_dropna(make_bars, close):
+    other = make_bars(400, seed=8)['Close']
+    valid = np.ones((400, 2), dtype=bool)
+    valid[:60, 0] = False
+    valid[150:155, 1] = False
+    prices = np.column_stack([close.to_numpy(), other.to_numpy()])
+    panel = HelperTA().MarketCyclePanel(prices, prices, prices, valid=valid, **PARAMS)
+    for i, column in enumerate([close, other]):
+        expected = np.full(400, np.nan)
+        expected[valid[:, i]] = _batch(column[valid[:, i]])
+        np.testing.assert_allclose(panel[:, i], expected, rtol=1e-9, atol=1e-9, equal_nan=True)
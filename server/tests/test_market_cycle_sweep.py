@@ -0,0 +1,49 @@
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import pandas as pd
+import pytest
+import MarketCycleSweep as market_cycle_sweep
+from conftest import MARKET_CYCLE_PARAMS as PARAMS, BrokenPool
+from HelperTA import HelperTA
+from MarketCycleSweep import MarketCycleSweep
+
+RANGES = {'donchianPeriod': [10, 14], 'rsiPeriod': [10, 14], 'srsiK': [3, 5], 'rsiWeight': [0.5, 1.0]}
+
+
+@pytest.fixture
+def prices(make_bars):
+    close = make_bars(300, seed=7)['Close'].to_numpy().copy()
+    # A flat stretch, where components are 0/0 = NaN
+    close[150:170] = close[149]
+    return np.column_stack([close, make_bars(300, seed=8)['Close'].to_numpy()])
+
+
+def _batch(close, combination):
+    close = pd.Series(close)
+    return HelperTA().MarketCycle(close, close, close, **combination).to_numpy()
+
+
+def test_sweep_matches_market_cycle_per_combination(prices):
+    combinations = MarketCycleSweep.grid(PARAMS, **RANGES)
+    series = MarketCycleSweep(workers=0).run(prices[:, 0], combinations)['values']
+    panel = MarketCycleSweep(workers=0).run(prices, combinations)['values']
+
+    assert series.shape == (len(combinations), len(prices))
+    assert panel.shape == (len(combinations), len(prices), 2)
+    for i, combination in enumerate(combinations):
+        # Values are float32
+        np.testing.assert_allclose(series[i], _batch(prices[:, 0], combination), rtol=0, atol=1e-4, equal_nan=True)
+        for column in range(2):
+            np.testing.assert_allclose(panel[i, :, column], _batch(prices[:, column], combination), rtol=0, atol=1e-4, equal_nan=True)
+
+
+def test_sweep_replaces_a_broken_pool(prices, monkeypatch):
+    monkeypatch.setattr(market_cycle_sweep, 'ProcessPoolExecutor', lambda workers, mp_context=None: ThreadPoolExecutor(workers))
+    monkeypatch.setitem(market_cycle_sweep._PROCESS_POOLS, 2, BrokenPool())
+    combinations = MarketCycleSweep.grid(PARAMS, **RANGES)
+
+    values = MarketCycleSweep(workers=2).run(prices[:, 0], combinations)['values']
+
+    np.testing.assert_array_equal(values, MarketCycleSweep(workers=0).run(prices[:, 0], combinations)['values'])
+    assert isinstance(market_cycle_sweep._PROCESS_POOLS[2], ThreadPoolExecutor)
+    market_cycle_sweep._PROCESS_POOLS[2].shutdown()
@@ -0,0 +1,102 @@
+import time
+import pytest
+from order_book import OrderBook, _PriceLevels
+
+
+@pytest.fixture
+def book(db, trade_service):
+    return OrderBook(db, trade_service)
+
+
+def _drain(book):
+    # Fills run on the book's single thread, in submission order
+    book._executor.submit(lambda: None).result()
+
+
+def _place(book, side, order_type, price, qty=1):
+    order, status = book.place_order({'project': 'p', 'ticker': 'X', 'side': side, 'type': order_type, 'price': price, 'qty': qty})
+    assert status == 200
+    return order
+
+
+def _tick(book, price):
+    book.on_prices({'X': price})
+    _drain(book)
+
+
+def _statuses(db):
+    return {doc.id: doc.to_dict()['status'] for doc in db.collection('paper_orders').stream()}
+
+
+def test_price_levels_pop_the_crossed_levels_farthest_first():
+    falling = _PriceLevels(1)
+    for level, order_id in [(10, 'a'), (11, 'b'), (9, 'c'), (11, 'd')]:
+        falling.add(level, order_id)
+    # FIFO within a level
+    assert falling.pop_crossed(10) == ['b', 'd', 'a']
+    assert falling.pop_crossed(10) == []
+    assert len(falling) == 1
+
+    rising = _PriceLevels(-1)
+    for level, order_id in [(10, 'a'), (12, 'b'), (8, 'c')]:
+        rising.add(level, order_id)
+    rising.remove(12, 'b')
+    rising.remove(12, 'unknown')
+    assert rising.pop_crossed(11) == ['c', 'a']
+    assert len(rising) == 0
+
+
+def test_marketable_order_fills_at_a_fresh_last_price(db, book):
+    book.on_prices({'X': 9})
+    _drain(book)
+
+    order = _place(book, 'buy', 'limit', 10)
+    _drain(book)
+
+    assert _statuses(db)[order['id']] == 'filled'
+
+
+def test_marketable_order_waits_when_the_last_price_is_stale(db, trade_service):
+    book = OrderBook(db, trade_service, max_price_age=0.05)
+    book.on_prices({'X': 9})
+    _drain(book)
+    time.sleep(0.1)
+
+    order = _place(book, 'buy', 'limit', 10)
+    _drain(book)
+    assert _statuses(db)[order['id']] == 'open'
+
+    book.on_prices({'X': 9.5}).result()
+    assert _statuses(db)[order['id']] == 'filled'
+
+
+def test_each_order_type_triggers_on_its_side_of_the_price(db, book):
+    buy_limit = _place(book, 'buy', 'limit', 95)
+    buy_stop = _place(book, 'buy', 'stop', 105)
+    _tick(book, 100)
+    assert _statuses(db) == {buy_limit['id']: 'open', buy_stop['id']: 'open'}
+    _tick(book, 94)
+    _tick(book, 106)
+    assert _statuses(db) == {buy_limit['id']: 'filled', buy_stop['id']: 'filled'}
+
+    sell_limit = _place(book, 'sell', 'limit', 110)
+    sell_stop = _place(book, 'sell', 'stop', 90)
+    _tick(book, 100)
+    assert _statuses(db)[sell_limit['id']] == _statuses(db)[sell_stop['id']] == 'open'
+    _tick(book, 110)
+    _tick(book, 89)
+    assert _statuses(db)[sell_limit['id']] == _statuses(db)[sell_stop['id']] == 'filled'
+
+    # Filled at the crossing price, not at their level
+    fill_prices = {doc.id: doc.to_dict()['fill_price'] for doc in db.collection('paper_orders').stream()}
+    assert fill_prices == {buy_limit['id']: 94, buy_stop['id']: 106, sell_limit['id']: 110, sell_stop['id']: 89}
+    assert db.collection('paper_projects').document('p').get().to_dict()['cash'] == 10000 - 94 - 106 + 110 + 89
+    assert book.stats()['open_orders'] == 0
+
+
+def test_unaffordable_order_is_rejected(db, book):
+    order = _place(book, 'buy', 'limit', 100, qty=1000)
+    _tick(book, 100)
+
+    assert _statuses(db)[order['id']] == 'rejected'
+    assert book.stats() == {'open_orders': 0, 'tickers': 0, 'levels': 0}
@@ -0,0 +1,22 @@
+import pytest
+from project_service import ProjectService
+
+
+@pytest.fixture
+def service(db):
+    return ProjectService(db)
+
+
+def test_fund_project_adds_the_amount(service):
+    assert service.fund_project({'project': 'p', 'amount': 50}) == ({'cash': 10050}, 200)
+
+
+def test_fund_project_errors_are_client_errors(service, monkeypatch):
+    assert service.fund_project({'project': 'missing', 'amount': 50})[1] == 404
+    assert service.fund_project({'project': 'p', 'amount': '50'})[1] == 400
+
+    def aborted(fn, max_attempts=5):
+        raise ValueError(f"Failed to commit transaction in {max_attempts} attempts.")
+
+    monkeypatch.setattr(service.db, 'run_transaction', aborted)
+    assert service.fund_project({'project': 'p', 'amount': 50})[1] == 409
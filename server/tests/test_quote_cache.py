@@ -0,0 +1,46 @@
+import threading
+import time
+from quote_cache import QuoteCache
+
+
+def _slow_loader(started, release):
+    def loader(tickers):
+        started.set()
+        release.wait(5)
+        return {ticker: 2.0 for ticker in tickers} if isinstance(tickers, list) else 2.0
+    return loader
+
+
+def test_waiter_gives_up_after_its_timeout_with_the_expired_price():
+    cache = QuoteCache(ttl=0.01)
+    cache.put('X', 1.0)
+    time.sleep(0.05)
+    started, release = threading.Event(), threading.Event()
+    leader = threading.Thread(target=cache.get_many, args=(['X'], _slow_loader(started, release)))
+    leader.start()
+    started.wait(5)
+    try:
+        began = time.monotonic()
+        assert cache.get_many(['X', 'Y'], lambda tickers: {'Y': 3.0}, timeout=0.1) == {'X': 1.0, 'Y': 3.0}
+        assert cache.get('X', lambda ticker: 4.0, timeout=0.1) == 1.0
+        assert time.monotonic() - began < 1
+        assert cache.stats()['timeouts'] == 2
+    finally:
+        release.set()
+        leader.join()
+    assert cache.get('X', lambda ticker: 4.0) == 2.0
+
+
+def test_waiter_without_an_expired_price_gets_none():
+    cache = QuoteCache()
+    started, release = threading.Event(), threading.Event()
+    leader = threading.Thread(target=cache.get, args=('X', _slow_loader(started, release)))
+    leader.start()
+    started.wait(5)
+    try:
+        assert cache.get('X', lambda ticker: 4.0, timeout=0.05) is None
+        assert cache.get_many(['X'], lambda tickers: {}, timeout=0.05) == {'X': None}
+    finally:
+        release.set()
+        leader.join()
+    assert cache.get('X', lambda ticker: 4.0, timeout=0.05) == 2.0
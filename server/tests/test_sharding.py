@@ -0,0 +1,96 @@
+import math
+from memory_firestore import MemoryFirestore
+from sharding import HashRing, ShardCoordinator
+
+SHARDS = 16
+
+
+class _Clock:
+    def __init__(self, now=1000.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+def _coordinators(db, clock, *worker_ids):
+    coordinators = [ShardCoordinator(db, worker_id=worker_id, shards=SHARDS, clock=clock) for worker_id in worker_ids]
+    for coordinator in coordinators:
+        coordinator.heartbeat()
+    return coordinators
+
+
+def _sync(coordinator):
+    # What the heartbeat thread does every heartbeat_seconds
+    coordinator.heartbeat()
+    with coordinator._lock:
+        return coordinator._sync()
+
+
+def test_assign_balances_the_keys_over_the_members():
+    keys = [f"shard-{i}" for i in range(64)]
+    for members in (['a'], ['a', 'b', 'c'], ['a', 'b', 'c', 'd', 'e']):
+        owners = HashRing(members).assign(keys)
+        assert set(owners) == set(keys)
+        loads = [list(owners.values()).count(member) for member in members]
+        assert max(loads) <= math.ceil(len(keys) / len(members))
+        assert owners == HashRing(list(reversed(members))).assign(keys)
+
+
+def test_workers_never_hold_the_same_shard():
+    db, clock = MemoryFirestore(), _Clock()
+    first, second, third = _coordinators(db, clock, 'w1', 'w2', 'w3')
+
+    for _ in range(2):
+        for coordinator in (first, second, third):
+            _sync(coordinator)
+
+    held = [first.held, second.held, third.held]
+    assert all(held)
+    assert sum(len(shards) for shards in held) == SHARDS
+    assert set().union(*held) == set(range(SHARDS))
+
+
+def test_joining_worker_waits_for_the_release_of_its_shards():
+    db, clock = MemoryFirestore(), _Clock()
+    first, = _coordinators(db, clock, 'w1')
+    assert _sync(first) == set(range(SHARDS))
+
+    second, = _coordinators(db, clock, 'w2')
+    # Still leased by w1, which has not synced since w2 joined
+    assert _sync(second) == set()
+    _sync(first)
+    assert _sync(second) == set(range(SHARDS)) - first.held
+    assert first.held and second.held
+
+
+def test_shards_of_a_dead_worker_are_taken_over_once_its_leases_expire():
+    db, clock = MemoryFirestore(), _Clock()
+    first, second = _coordinators(db, clock, 'w1', 'w2')
+    _sync(first)
+    _sync(second)
+    orphaned = set(first.held)
+
+    # w1 dies: no more heartbeats. Its heartbeat expires before its leases
+    clock.now += 3 * first.heartbeat_seconds + 1
+    assert not orphaned & _sync(second)
+
+    clock.now += first.lease_seconds
+    assert _sync(second) == set(range(SHARDS))
+
+
+def test_shards_are_not_released_while_a_refresh_uses_them():
+    db, clock = MemoryFirestore(), _Clock()
+    first, = _coordinators(db, clock, 'w1')
+    tickers = [f"T{i}" for i in range(50)]
+
+    with first.assignment(tickers) as assigned:
+        assert assigned == tickers
+        second, = _coordinators(db, clock, 'w2')
+        # The heartbeat thread syncs during the refresh: w1 keeps every shard
+        assert _sync(first) == set(range(SHARDS))
+        assert _sync(second) == set()
+
+    moved = set(range(SHARDS)) - _sync(first)
+    assert moved
+    assert _sync(second) == moved
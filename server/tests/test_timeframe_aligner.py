@@ -0,0 +1,54 @@
+import numpy as np
+import pandas as pd
+from TimeframeAligner import TimeframeAligner
+
+
+def _base(start, periods):
+    index = pd.date_range(start, periods=periods, freq='min')
+    return pd.DataFrame({'Close': np.arange(periods, dtype=float), 'marketCycle': np.linspace(0, 100, periods)}, index=index)
+
+
+def _source(start, end, freq):
+    # Each bar's marketCycle is its start time in seconds, so a row tells which bar it sees
+    index = pd.date_range(start, end, freq=freq)
+    return pd.DataFrame({'marketCycle': (index - pd.Timestamp(0)) / pd.Timedelta(seconds=1)}, index=index)
+
+
+def _bar_starts(values):
+    return pd.Timestamp(0) + pd.to_timedelta(values, unit='s')
+
+
+def _sources(base, start='2024-05-25'):
+    end = base.index[-1]
+    return {'1h': _source(start, end, 'h'), '1D': _source(start, end, 'D'), '5D': _source(start, end, '5D')}
+
+
+def test_no_row_sees_a_bar_that_has_not_closed():
+    aligner = TimeframeAligner()
+    base = _base('2024-06-03 13:30', 3 * 24 * 60)
+
+    combined = aligner.align(base, _sources(base))
+
+    row_closes = base.index + aligner.base_interval
+    for timeframe, column in aligner.columns.items():
+        bar_starts = _bar_starts(combined[column].to_numpy())
+        bar_closes = bar_starts + aligner.intervals[timeframe]
+        assert (bar_closes <= row_closes).all()
+        # and it is the latest closed bar: the next one has not closed yet
+        assert (bar_closes + aligner.intervals[timeframe] > row_closes).all()
+
+
+def test_extend_matches_align_and_keeps_rows_before_the_last_closed_bar():
+    aligner = TimeframeAligner()
+    base = _base('2024-06-03 13:30', 2 * 24 * 60)
+    sources = _sources(base)
+    previous = aligner.align(base.iloc[:-30], {tf: s[s.index <= base.index[-31]] for tf, s in sources.items()})
+    # The last closed 5D bar closes on 2024-06-04, the rows before it are final and keep a marker
+    previous.loc[previous.index[:60], 'marketCycle_5d'] = -1.0
+
+    extended = aligner.extend(previous, base.iloc[-250:], sources)
+
+    expected = aligner.align(base, sources)
+    pd.testing.assert_frame_equal(extended.iloc[60:], expected.iloc[60:])
+    assert (extended['marketCycle_5d'].iloc[:60] == -1.0).all()
+    pd.testing.assert_index_equal(extended.index, expected.index)
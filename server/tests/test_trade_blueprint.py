@@ -0,0 +1,49 @@
+import time
+from flask import Flask
+from conftest import NoProvider
+from quote_cache import QuoteCache
+from trade_blueprint import TradeServices, create_trade_blueprint
+
+
+def _app(services):
+    app = Flask(__name__)
+    app.register_blueprint(create_trade_blueprint(services))
+    return app
+
+
+def test_apps_share_the_process_order_book(db):
+    quote_cache = QuoteCache()
+    services = TradeServices(db, quote_cache, provider=NoProvider())
+    for _ in range(3):
+        _app(services)
+
+    assert quote_cache._listeners == [services.order_book.on_prices]
+
+
+def test_services_only_start_when_asked(db, monkeypatch):
+    monkeypatch.setenv('REFRESH_SHARDS', '4')
+    monkeypatch.setenv('REFRESH_SCHEDULER', '1')
+    services = TradeServices(db, QuoteCache(), provider=NoProvider())
+    _app(services)
+
+    assert list(db.collection('refresh_workers').stream()) == []
+    assert services.scheduler._thread is None
+
+    services.start()
+    try:
+        assert [doc.id for doc in db.collection('refresh_workers').stream()] == [services.coordinator.worker_id]
+        assert services.scheduler._thread.is_alive()
+    finally:
+        services.stop()
+
+
+def test_jobs_enqueued_through_one_app_show_in_another(db):
+    services = TradeServices(db, QuoteCache(), provider=NoProvider())
+    first, second = _app(services).test_client(), _app(services).test_client()
+
+    assert first.get('/trade/tick').status_code == 202
+    deadline = time.monotonic() + 5
+    while second.get('/trade/jobs').get_json()['tick']['runs'] == 0 and time.monotonic() < deadline:
+        time.sleep(0.01)
+
+    assert second.get('/trade/jobs').get_json()['tick']['runs'] == 1
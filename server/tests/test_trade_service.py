@@ -0,0 +1,54 @@
+import pytest
+
+
+@pytest.mark.parametrize('filters', [{}, {'ticker': 'X'}, {'side': 'buy'}, {'start': '2024-01-01'}])
+def test_trade_logs_of_an_unknown_project_are_not_found(trade_service, filters):
+    assert trade_service.get_trade_logs('missing', **filters)[1] == 404
+    response, status = trade_service.get_trade_logs('p', **filters)
+    assert status == 200
+    assert response['pagination']['total'] == 0
+
+
+def _cash(db):
+    return db.collection('paper_projects').document('p').get().to_dict()['cash']
+
+
+def test_batch_reports_invalid_legs_and_executes_the_others(db, trade_service):
+    response, status = trade_service.batch_trade({'project': 'p', 'legs': [
+        {'side': 'buy', 'ticker': 'X', 'qty': -5, 'price': 10},
+        {'side': 'buy', 'ticker': 'X', 'qty': '5', 'price': 10},
+        {'side': 'buy', 'ticker': 'X', 'qty': 5, 'price': float('nan')},
+        {'side': 'hold', 'ticker': 'X', 'qty': 5, 'price': 10},
+        {'side': 'buy', 'ticker': 'X', 'qty': 5, 'price': 10}
+    ]})
+
+    assert status == 200
+    assert [result['status'] for result in response['results']] == [400, 400, 400, 400, 200]
+    assert (response['executed'], response['failed']) == (1, 4)
+    assert _cash(db) == 10000 - 50
+
+
+def test_atomic_batch_with_a_failed_leg_writes_nothing(db, trade_service):
+    response, status = trade_service.batch_trade({'project': 'p', 'atomic': True, 'legs': [
+        {'side': 'buy', 'ticker': 'X', 'qty': 5, 'price': 10},
+        {'side': 'sell', 'ticker': 'Y', 'qty': 1, 'price': 10}
+    ]})
+
+    assert status == 400
+    assert [result['status'] for result in response['results']] == [200, 400]
+    assert _cash(db) == 10000
+    assert list(db.collection('paper_trades').stream()) == []
+
+
+def test_batch_sell_uses_shares_bought_earlier_in_the_batch(db, trade_service):
+    response, status = trade_service.batch_trade({'project': 'p', 'legs': [
+        {'side': 'buy', 'ticker': 'x', 'qty': 10, 'price': 10},
+        {'side': 'sell', 'ticker': 'X', 'qty': 4, 'price': 15}
+    ]})
+
+    assert status == 200
+    assert response['executed'] == 2
+    assert response['results'][1]['qty'] == 6
+    assert response['results'][1]['profits'] == 20
+    assert _cash(db) == 10000 - 100 + 60
+    assert db.collection('trade_positions').document('p-X').get().to_dict()['qty'] == 6
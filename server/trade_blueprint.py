@@ -1,11 +1,101 @@
 # trade_blueprint.py
-from flask import Blueprint, request, jsonify
+import atexit
+import os
+from flask import Blueprint, Response, request, jsonify
 from trade_service import TradeService
 from DataCaching import DataCaching
+from BarStore import BarStore
+from refresh_scheduler import RefreshScheduler
+from sharding import ShardCoordinator
+from order_book import OrderBook
+from price_publisher import PricePublisher
+from market_data import provider_from_env
 
-def create_trade_blueprint(db):
+class TradeServices:
+    """The long-lived objects behind the trade routes, built once per process.
+
+    The quote cache feeds every price it fetches to the order book, so they
+    must not be rebuilt with each blueprint: blueprints of the same process
+    share these. Building them starts nothing, the server entry point calls
+    `start()` once to run the shard coordinator and the refresh scheduler.
+    """
+
+    def __init__(self, db, quote_cache=None, max_attempts=5, provider=None):
+        self.db = db
+        # Every price and bar of the process comes from one market data provider
+        self.provider = provider if provider is not None else provider_from_env()
+        self.trade_service = TradeService(db, quote_cache, max_attempts, self.provider)
+        # Local bar store shared by every DataCaching run of this process
+        self.bar_store = BarStore(os.environ.get('BAR_STORE_DIR'))
+        # One upstream price poll per interval, whatever the number of stream subscribers
+        self.publisher = PricePublisher(
+            self.trade_service.get_current_prices,
+            interval=float(os.environ.get('STREAM_INTERVAL', 5)),
+            max_subscribers=int(os.environ.get('STREAM_MAX_SUBSCRIBERS', 1000))
+        )
+        # Resting limit and stop orders, matched against every price the quote cache or the 1min refresh sees
+        self.order_book = OrderBook(db, self.trade_service, reload_seconds=float(os.environ.get('ORDER_RELOAD_SECONDS', 60)))
+        self.trade_service.quote_cache.add_listener(self.order_book.on_prices)
+        # REFRESH_SHARDS=N splits the watchlist refresh between every worker running with it
+        shards = int(os.environ.get('REFRESH_SHARDS', 0))
+        self.coordinator = ShardCoordinator(db, shards=shards) if shards else None
+        self.scheduler = RefreshScheduler(self.run_refresh)
+        self._started = False
+
+    def start(self):
+        """Joins the refresh workers with REFRESH_SHARDS and runs the scheduled refreshes with REFRESH_SCHEDULER=1."""
+        if self._started:
+            return
+        self._started = True
+        if self.coordinator is not None:
+            self.coordinator.start()
+        if os.environ.get('REFRESH_SCHEDULER') == '1':
+            self.scheduler.start()
+        atexit.register(self.stop)
+
+    def stop(self):
+        self.scheduler.stop()
+        if self.coordinator is not None:
+            self.coordinator.stop()
+
+    def refresh(self, tickers, timeframes, initialize, revalue):
+        if tickers:
+            cache = DataCaching(db=self.db, bar_store=self.bar_store, publisher=self.publisher, provider=self.provider)
+            cache.setTickers(tickers)
+            cache.refresh(timeframes, initialize)
+            if '1min' in timeframes:
+                closes = {}
+                for ticker in tickers:
+                    data = cache.get_data(ticker, '1min')
+                    if data is not None and not data.empty:
+                        closes[ticker] = float(data['Close'].iloc[-1])
+                fills = self.order_book.on_prices(closes)
+                if fills is not None:
+                    fills.result()
+        # Each 1min refresh is a price tick for the materialized portfolios
+        if revalue and '1min' in timeframes:
+            self.trade_service.revalue_portfolios()
+
+    def run_refresh(self, timeframes, initialize):
+        tickers = self.trade_service.getMainWatchlist()
+        if self.coordinator is None:
+            self.refresh(tickers, timeframes, initialize, revalue=True)
+            return
+        with self.coordinator.assignment(tickers) as assigned:
+            # Portfolios are revalued once, by the holder of shard 0
+            self.refresh(assigned, timeframes, initialize, revalue=0 in self.coordinator.held)
+
+
+def create_trade_blueprint(services):
     trade_bp = Blueprint('trade', __name__, url_prefix='/trade')
-    trade_service = TradeService(db)
+    db = services.db
+    provider = services.provider
+    trade_service = services.trade_service
+    bar_store = services.bar_store
+    publisher = services.publisher
+    order_book = services.order_book
+    coordinator = services.coordinator
+    scheduler = services.scheduler
 
     @trade_bp.route('/buy', methods=['POST'])
     def buy_trade():
@@ -19,24 +109,56 @@ def create_trade_blueprint(db):
         response, status = trade_service.sell_trade(data)
         return jsonify(response), status
 
+    @trade_bp.route('/batch', methods=['POST'])
+    def batch_trade():
+        data = request.get_json()
+        response, status = trade_service.batch_trade(data)
+        return jsonify(response), status
+
+    @trade_bp.route('/orders', methods=['POST'])
+    def place_order():
+        data = request.get_json()
+        response, status = order_book.place_order(data)
+        return jsonify(response), status
+
+    @trade_bp.route('/orders', methods=['GET'])
+    def get_orders():
+        response, status = order_book.get_orders(request.args.get('project'), request.args.get('status'))
+        return jsonify(response), status
+
+    @trade_bp.route('/orders/cancel', methods=['POST'])
+    def cancel_order():
+        data = request.get_json()
+        response, status = order_book.cancel_order(data)
+        return jsonify(response), status
+
     @trade_bp.route('/stats', methods=['GET'])
     def get_trade_stats():
         project_name = request.args.get('project')
-        response, status = trade_service.get_trade_stats(project_name)
+        fresh = request.args.get('fresh', '').lower() in ('1', 'true')
+        response, status = trade_service.get_trade_stats(project_name, fresh)
         return jsonify(response), status
 
     @trade_bp.route('/positions', methods=['GET'])
     def get_positions():
         project_name = request.args.get('project')
-        response, status = trade_service.get_positions(project_name)
+        fresh = request.args.get('fresh', '').lower() in ('1', 'true')
+        response, status = trade_service.get_positions(project_name, fresh)
         return jsonify(response), status
 
     @trade_bp.route('/logs', methods=['GET'])
     def get_trade_logs():
         project = request.args.get('project')
-        page = int(request.args.get('page', 1))
-        per_page = int(request.args.get('per_page', 50))
-        response, status = trade_service.get_trade_logs(project, page, per_page)
+        per_page = max(1, min(int(request.args.get('per_page', 50)), 500))
+        response, status = trade_service.get_trade_logs(
+            project,
+            per_page,
+            request.args.get('page_token'),
+            request.args.get('ticker'),
+            request.args.get('side'),
+            request.args.get('start'),
+            request.args.get('end')
+        )
         return jsonify(response), status
 
     @trade_bp.route('/watchlist', methods=['POST'])
@@ -51,23 +173,51 @@ def create_trade_blueprint(db):
         response, status = trade_service.get_prices(tickers)
         return jsonify(response), status
 
+    @trade_bp.route('/cache', methods=['GET'])
+    def get_quote_cache_stats():
+        response, status = trade_service.get_quote_cache_stats()
+        return jsonify(response), status
+
+    @trade_bp.route('/stream', methods=['GET'])
+    def stream():
+        tickers = [ticker.upper() for ticker in request.args.get('tickers', '').split(',') if ticker]
+        timeframes = [timeframe for timeframe in request.args.get('timeframes', '').split(',') if timeframe]
+        if not tickers:
+            return jsonify({'error': 'Missing "tickers" parameter'}), 400
+
+        subscription = publisher.subscribe(tickers, timeframes)
+        if subscription is None:
+            return jsonify({'error': 'Too many stream subscribers, please retry later'}), 503
+        headers = {'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+        return Response(publisher.events(subscription), mimetype='text/event-stream', headers=headers)
+
+    @trade_bp.route('/stream/stats', methods=['GET'])
+    def get_stream_stats():
+        return jsonify(publisher.stats()), 200
+
     @trade_bp.route('/init', methods=['GET'])
     def init_data():
-        cache = DataCaching(db=db)
-        cache.setTickers(trade_service.getMainWatchlist())
-        cache.init()
-        return jsonify({"status": "ok"}), 200
+        queued = scheduler.enqueue('init')
+        return jsonify({"status": "queued" if queued else "running", "job": scheduler.jobs['init'].status()}), 202
 
     @trade_bp.route('/tick', methods=['GET'])
     def tick_data():
-        cache = DataCaching(db=db)
-        cache.setTickers(trade_service.getMainWatchlist())
-        cache.update_data()
-        return jsonify({"status": "ok"}), 200
+        queued = scheduler.enqueue('tick')
+        return jsonify({"status": "queued" if queued else "running", "job": scheduler.jobs['tick'].status()}), 202
+
+    @trade_bp.route('/jobs', methods=['GET'])
+    def get_jobs():
+        return jsonify(scheduler.status()), 200
+
+    @trade_bp.route('/shards', methods=['GET'])
+    def get_shards():
+        if coordinator is None:
+            return jsonify({'error': 'Sharded refresh is disabled'}), 404
+        return jsonify(coordinator.status()), 200
 
     @trade_bp.route('/chart', methods=['GET'])
     def chart_data():
-        cache = DataCaching(db=db)
+        cache = DataCaching(db=db, bar_store=bar_store, provider=provider)
         cache.setTickers(trade_service.getMainWatchlist())
         cache.chart('NVDA', 'NVDA.png')
         return jsonify({"status": "ok"}), 200
@@ -1,22 +1,36 @@
 # trade_service.py
 from firebase_admin import firestore
-import yfinance as yf
+import base64
+import binascii
 import datetime
+import json
+import logging
 from DataCaching import DataCaching
+from price_resolver import PriceResolver
+from firestore_bulk import FirestoreBulkWriter, run_transaction
+import ledger
+import portfolio
+
+logger = logging.getLogger(__name__)
+
+# A commit holds at most 500 writes: cash and portfolio, one per position and one per trade
+MAX_BATCH_LEGS = 200
 
 class TradeService:
-    def __init__(self, db):
+    def __init__(self, db, quote_cache=None, max_attempts=5, provider=None):
         self.db = db
+        # Attempts of a trade transaction before giving up on contention
+        self.max_attempts = max_attempts
+        self.price_resolver = PriceResolver(quote_cache, provider=provider)
+        self.quote_cache = self.price_resolver.quote_cache
 
     def get_current_price(self, ticker):
-        """Fetches the current price for a given ticker symbol using yfinance."""
-        try:
-            stock = yf.Ticker(ticker)
-            current_price = stock.history(period='1d')['Close'][0]
-            return float(current_price)
-        except Exception as e:
-            print(f"Error fetching price for {ticker}: {e}")
-            return None
+        """Returns the current price for a ticker, served from the shared quote cache."""
+        return self.price_resolver.get(ticker)
+
+    def get_current_prices(self, tickers):
+        """Returns {ticker: price} for many tickers, resolved in one batch."""
+        return self.price_resolver.get_many(tickers)
 
     def buy_trade(self, data):
         qty = data.get('qty')
@@ -28,53 +42,33 @@ class TradeService:
             return {'error': 'Missing required parameters'}, 400
 
         project_ref = self.db.collection('paper_projects').document(project_name)
-        project_doc = project_ref.get()
-
-        if not project_doc.exists:
-            return {'error': 'Project not found'}, 404
+        position_ref = self.db.collection('trade_positions').document(f"{project_name}-{ticker}")
+        trade_ref = self.db.collection('paper_trades').document()
+        portfolio_ref = portfolio.portfolio_ref(self.db, project_name)
 
-        project_data = project_doc.to_dict()
-        if project_data['cash'] < qty * price:
-            return {'error': 'Insufficient funds'}, 400
+        def execute(transaction):
+            snapshots = self._get_in_transaction(transaction, [project_ref, position_ref, portfolio_ref])
+            project_data = snapshots[project_ref.path]
+            if project_data is None:
+                return {'error': 'Project not found'}, 404
 
-        project_data['cash'] -= qty * price
-        project_ref.update({'cash': project_data['cash']})
+            now = datetime.datetime.now()
+            try:
+                cash, position = ledger.apply_buy(project_data['cash'], snapshots[position_ref.path], project_name, ticker, qty, price, now)
+            except ledger.LedgerError as e:
+                return {'error': str(e)}, e.status
 
-        position_ref = self.db.collection('trade_positions').document(f"{project_name}-{ticker}")
-        position_doc = position_ref.get()
-        if position_doc.exists:
-            position_data = position_doc.to_dict()
-            current_qty = position_data.get('qty', 0)
-            current_cost = position_data.get('avg_cost', 0) * current_qty
-            new_qty = current_qty + qty
-            new_avg_cost = (current_cost + qty * price) / new_qty
-            position_ref.update({'qty': new_qty, 'avg_cost': new_avg_cost, 'last_buy_date': datetime.datetime.now()})
-        else:
-            position_ref.set({
-                'create_date': datetime.datetime.now(),
-                'project': project_name,
-                'ticker': ticker,
+            transaction.update(project_ref, {'cash': cash})
+            transaction.set(position_ref, position)
+            transaction.set(trade_ref, ledger.trade_record(project_name, 'buy', ticker, qty, price, now))
+            self._update_portfolio(transaction, portfolio_ref, snapshots[portfolio_ref.path], cash, {ticker: position}, 1, now)
+            return {
                 'qty': qty,
-                'avg_cost': price,
-                'last_buy_date': datetime.datetime.now(),
-                'last_sell_date': None  
-            })
-
-        trade_data = {
-            'create_date': datetime.datetime.now(),
-            'project': project_name,
-            'type': 'buy',
-            'ticker': ticker,
-            'qty': qty,
-            'price': price
-        }
-        self.db.collection('paper_trades').add(trade_data)
+                'value': qty * price,
+                'cash': cash
+            }, 200
 
-        return {
-            'qty': qty,
-            'value': qty * price,
-            'cash': project_data['cash']
-        }, 200
+        return self._run_transaction(execute)
 
     def sell_trade(self, data):
         qty = data.get('qty')
@@ -86,171 +80,399 @@ class TradeService:
             return {'error': 'Missing required parameters'}, 400
 
         project_ref = self.db.collection('paper_projects').document(project_name)
-        project_doc = project_ref.get()
-
-        if not project_doc.exists:
-            return {'error': 'Project not found'}, 404
-
         position_ref = self.db.collection('trade_positions').document(f"{project_name}-{ticker}")
-        position_doc = position_ref.get()
+        trade_ref = self.db.collection('paper_trades').document()
+        portfolio_ref = portfolio.portfolio_ref(self.db, project_name)
 
-        if not position_doc.exists:
-            return {'error': 'Ticker not in portfolio'}, 400
+        def execute(transaction):
+            snapshots = self._get_in_transaction(transaction, [project_ref, position_ref, portfolio_ref])
+            project_data = snapshots[project_ref.path]
+            if project_data is None:
+                return {'error': 'Project not found'}, 404
 
-        position_data = position_doc.to_dict()
+            now = datetime.datetime.now()
+            try:
+                cash, position, profit, gains_percent = ledger.apply_sell(project_data['cash'], snapshots[position_ref.path], qty, price, now)
+            except ledger.LedgerError as e:
+                return {'error': str(e)}, e.status
+
+            transaction.update(project_ref, {'cash': cash})
+            if position is None:
+                transaction.delete(position_ref)
+            else:
+                transaction.set(position_ref, position)
+            transaction.set(trade_ref, ledger.trade_record(project_name, 'sell', ticker, qty, price, now))
+            self._update_portfolio(transaction, portfolio_ref, snapshots[portfolio_ref.path], cash, {ticker: position}, 1, now)
+            return {
+                'qty': position['qty'] if position is not None else 0,
+                'value': qty * price,
+                'gains': gains_percent,
+                'profits': profit,
+                'cash': cash
+            }, 200
 
-        if position_data['qty'] < qty:
-            return {'error': 'Not enough shares to sell'}, 400
+        return self._run_transaction(execute)
 
-        project_data = project_doc.to_dict()
-        project_data['cash'] += qty * price
-        project_ref.update({'cash': project_data['cash']})
+    def batch_trade(self, data):
+        """Executes many buy/sell legs of a project against one snapshot, in a single commit.
 
-        remaining_qty = position_data['qty'] - qty
-        if remaining_qty == 0:
-            position_ref.delete()
-        else:
-            position_ref.update({'qty': remaining_qty, 'last_sell_date': datetime.datetime.now()})
-
-        trade_data = {
-            'create_date': datetime.datetime.now(),
-            'project': project_name,
-            'type': 'sell',
-            'ticker': ticker,
-            'qty': qty,
-            'price': price
-        }
-        self.db.collection('paper_trades').add(trade_data)
+        Legs are applied in order, so a sell can use shares bought earlier in the
+        batch. Failed legs are reported and skipped, or with `atomic` reject the
+        whole batch.
+        """
+        project_name = data.get('project')
+        legs = data.get('legs')
+        atomic = bool(data.get('atomic', False))
+
+        if not project_name or not isinstance(legs, list) or not legs:
+            return {'error': 'Missing "project" or "legs" parameter'}, 400
+        if len(legs) > MAX_BATCH_LEGS:
+            return {'error': f'A batch is limited to {MAX_BATCH_LEGS} legs'}, 400
+
+        orders = []
+        for leg in legs:
+            leg = leg if isinstance(leg, dict) else {}
+            ticker = leg.get('ticker')
+            orders.append({
+                'side': leg.get('side'),
+                'ticker': ticker.upper() if isinstance(ticker, str) else None,
+                'qty': leg.get('qty'),
+                'price': leg.get('price')
+            })
 
-        avg_cost = position_data['avg_cost']
-        profit = (price - avg_cost) * qty
-        gains_percent = ((price - avg_cost) / avg_cost) * 100 if avg_cost else 0
+        project_ref = self.db.collection('paper_projects').document(project_name)
+        position_refs = {
+            order['ticker']: self.db.collection('trade_positions').document(f"{project_name}-{order['ticker']}")
+            for order in orders if order['ticker']
+        }
+        portfolio_ref = portfolio.portfolio_ref(self.db, project_name)
 
-        return {
-            'qty': remaining_qty,
-            'value': qty * price,
-            'gains': gains_percent,
-            'profits': profit,
-            'cash': project_data['cash']
-        }, 200
+        def execute(transaction):
+            snapshots = self._get_in_transaction(transaction, [project_ref, portfolio_ref] + list(position_refs.values()))
+            project_data = snapshots[project_ref.path]
+            if project_data is None:
+                return {'error': 'Project not found'}, 404
 
-    def get_trade_stats(self, project_name):
-        if not project_name:
-            return {'error': 'Missing "project" parameter'}, 400
+            now = datetime.datetime.now()
+            cash = project_data['cash']
+            positions = {ticker: snapshots[ref.path] for ticker, ref in position_refs.items()}
+            touched = set()
+            trades = []
+            results = []
+
+            for i, order in enumerate(orders):
+                side, ticker, qty, price = order['side'], order['ticker'], order['qty'], order['price']
+                result = {'index': i, 'side': side, 'ticker': ticker}
+                if side not in ('buy', 'sell'):
+                    results.append({**result, 'status': 400, 'error': 'Invalid "side" parameter'})
+                    continue
+                if not all([qty, ticker, price]):
+                    results.append({**result, 'status': 400, 'error': 'Missing required parameters'})
+                    continue
+                if not ledger.positive(qty) or not ledger.positive(price):
+                    results.append({**result, 'status': 400, 'error': 'Invalid "qty" or "price" parameter'})
+                    continue
 
-        positions = []
-        invested_value = 0
-        open_value = 0
+                try:
+                    if side == 'buy':
+                        cash, positions[ticker] = ledger.apply_buy(cash, positions[ticker], project_name, ticker, qty, price, now)
+                        result.update({'qty': qty, 'value': qty * price})
+                    else:
+                        cash, positions[ticker], profit, gains_percent = ledger.apply_sell(cash, positions[ticker], qty, price, now)
+                        result.update({
+                            'qty': positions[ticker]['qty'] if positions[ticker] is not None else 0,
+                            'value': qty * price,
+                            'gains': gains_percent,
+                            'profits': profit
+                        })
+                except ledger.LedgerError as e:
+                    results.append({**result, 'status': e.status, 'error': str(e)})
+                    continue
 
-        try:
-            positions_ref = self.db.collection('trade_positions').where('project', '==', project_name)
-            positions_docs = positions_ref.stream()
+                touched.add(ticker)
+                trades.append(ledger.trade_record(project_name, side, ticker, qty, price, now))
+                results.append({**result, 'status': 200})
+
+            failed = sum(1 for result in results if result['status'] != 200)
+            if atomic and failed:
+                return {'error': 'Batch rejected', 'results': results}, 400
+
+            if trades:
+                transaction.update(project_ref, {'cash': cash})
+                for ticker in touched:
+                    if positions[ticker] is None:
+                        transaction.delete(position_refs[ticker])
+                    else:
+                        transaction.set(position_refs[ticker], positions[ticker])
+                for trade in trades:
+                    transaction.set(self.db.collection('paper_trades').document(), trade)
+                self._update_portfolio(transaction, portfolio_ref, snapshots[portfolio_ref.path], cash, {ticker: positions[ticker] for ticker in touched}, len(trades), now)
+            return {
+                'results': results,
+                'executed': len(trades),
+                'failed': failed,
+                'cash': cash
+            }, 200
 
-            for doc in positions_docs:
-                position_data = doc.to_dict()
-                ticker = position_data['ticker']
-                qty = position_data['qty']
-                avg_cost = position_data['avg_cost']
-                current_price = self.get_current_price(ticker)
+        return self._run_transaction(execute)
 
-                if current_price is None:
-                    continue
+    def fill_orders(self, project_name, fills):
+        """Executes triggered resting orders of a project, `fills` being (order, price) pairs, in a single commit.
 
-                gains = ((current_price - avg_cost) / avg_cost) * 100
-                positions.append({
-                    'ticker': ticker,
-                    'qty': qty,
-                    'avg_cost': avg_cost,
-                    'current_price': current_price,
-                    'gains': gains
-                })
-                invested_value += avg_cost * qty
-                open_value += current_price * qty
-
-            project_ref = self.db.collection('paper_projects').document(project_name)
-            project_doc = project_ref.get()
+        Each order is re-read in the transaction and only executed while still
+        open, so an order is never filled twice. Orders the ledger refuses, e.g.
+        for insufficient funds, are closed as rejected.
+        """
+        project_ref = self.db.collection('paper_projects').document(project_name)
+        order_refs = {order['id']: self.db.collection('paper_orders').document(order['id']) for order, _ in fills}
+        position_refs = {
+            order['ticker']: self.db.collection('trade_positions').document(f"{project_name}-{order['ticker']}")
+            for order, _ in fills
+        }
+        portfolio_ref = portfolio.portfolio_ref(self.db, project_name)
 
-            if not project_doc.exists:
+        def execute(transaction):
+            snapshots = self._get_in_transaction(transaction, [project_ref, portfolio_ref] + list(order_refs.values()) + list(position_refs.values()))
+            project_data = snapshots[project_ref.path]
+            if project_data is None:
                 return {'error': 'Project not found'}, 404
 
-            project_data = project_doc.to_dict()
-            initial_cash = project_data.get('initial_cash', project_data['cash'])
-
-            total_gains_percent = ((project_data['cash'] + open_value - initial_cash) / initial_cash) * 100 if initial_cash else 0
-            unrealized_gains_percent = ((open_value - invested_value) / invested_value) * 100 if invested_value else 0
+            now = datetime.datetime.now()
+            cash = project_data['cash']
+            positions = {ticker: snapshots[ref.path] for ticker, ref in position_refs.items()}
+            touched = set()
+            trades = []
+            results = []
+
+            for order, price in fills:
+                order_ref = order_refs[order['id']]
+                stored = snapshots[order_ref.path]
+                result = {'order_id': order['id'], 'side': order['side'], 'ticker': order['ticker']}
+                if stored is None or stored['status'] != 'open':
+                    results.append({**result, 'status': 'skipped'})
+                    continue
+                # Only filled once per commit, even if it was triggered twice
+                snapshots[order_ref.path] = {**stored, 'status': 'filled'}
+
+                side, ticker, qty = stored['side'], stored['ticker'], stored['qty']
+                try:
+                    if side == 'buy':
+                        cash, positions[ticker] = ledger.apply_buy(cash, positions[ticker], project_name, ticker, qty, price, now)
+                    else:
+                        cash, positions[ticker], _, _ = ledger.apply_sell(cash, positions[ticker], qty, price, now)
+                except ledger.LedgerError as e:
+                    transaction.update(order_ref, {'status': 'rejected', 'error': str(e), 'close_date': now})
+                    results.append({**result, 'status': 'rejected', 'error': str(e)})
+                    continue
 
+                transaction.update(order_ref, {'status': 'filled', 'fill_price': price, 'close_date': now})
+                touched.add(ticker)
+                trades.append({**ledger.trade_record(project_name, side, ticker, qty, price, now), 'order_id': order['id']})
+                results.append({**result, 'status': 'filled', 'qty': qty, 'price': price})
+
+            if trades:
+                transaction.update(project_ref, {'cash': cash})
+                for ticker in touched:
+                    if positions[ticker] is None:
+                        transaction.delete(position_refs[ticker])
+                    else:
+                        transaction.set(position_refs[ticker], positions[ticker])
+                for trade in trades:
+                    transaction.set(self.db.collection('paper_trades').document(), trade)
+                self._update_portfolio(transaction, portfolio_ref, snapshots[portfolio_ref.path], cash, {ticker: positions[ticker] for ticker in touched}, len(trades), now)
             return {
-                'positions': positions,
-                'cash': project_data['cash'],
-                'invested_value': invested_value,
-                'open_value': open_value,
-                'gains': total_gains_percent,
-                'unrealized_gains': unrealized_gains_percent
+                'results': results,
+                'executed': len(trades),
+                'cash': cash
             }, 200
 
-        except Exception as e:
-            return {'error': str(e)}, 500
+        return self._run_transaction(execute)
+
+    def _update_portfolio(self, transaction, portfolio_ref, portfolio_data, cash, positions, trades, now):
+        """Carries trades into the portfolio document; a missing one is built on its next read instead."""
+        if portfolio_data is not None:
+            transaction.set(portfolio_ref, portfolio.apply_trades(portfolio_data, cash, positions, trades, now))
 
-    def get_positions(self, project_name):
+    def _get_in_transaction(self, transaction, refs):
+        """Reads documents in one round trip inside a transaction, returns {path: dict or None}."""
+        documents = {ref.path: None for ref in refs}
+        for snapshot in self.db.get_all(refs, transaction=transaction):
+            if snapshot.exists:
+                documents[snapshot.reference.path] = snapshot.to_dict()
+        return documents
+
+    def _run_transaction(self, execute):
+        try:
+            return run_transaction(self.db, execute, self.max_attempts)
+        except ValueError as e:
+            logger.warning("Transaction aborted: %s", e)
+            return {'error': 'Too many concurrent orders on this project, please retry'}, 409
+
+    def get_trade_stats(self, project_name, fresh=False):
         if not project_name:
             return {'error': 'Missing "project" parameter'}, 400
 
         try:
-            positions = []
-            invested_value = 0
-            open_value = 0
+            portfolio_data = self._load_portfolio(project_name)
+            if portfolio_data is None:
+                return {'error': 'Project not found'}, 404
 
-            positions_ref = self.db.collection('trade_positions').where('project', '==', project_name)
-            positions_docs = positions_ref.stream()
+            valuation = portfolio.summary(portfolio_data, self._portfolio_prices(project_name, portfolio_data, fresh))
+            for position in valuation['positions']:
+                del position['profit']
+            return valuation, 200
 
-            for doc in positions_docs:
-                position_data = doc.to_dict()
-                ticker = position_data['ticker']
-                qty = position_data['qty']
-                avg_cost = position_data['avg_cost']
-                current_price = self.get_current_price(ticker)
+        except Exception as e:
+            return {'error': str(e)}, 500
 
-                if current_price is None:
-                    continue
+    def get_positions(self, project_name, fresh=False):
+        if not project_name:
+            return {'error': 'Missing "project" parameter'}, 400
 
-                gains = ((current_price - avg_cost) / avg_cost) * 100
-                profit = (current_price - avg_cost) * qty
-                positions.append({
-                    'ticker': ticker,
-                    'qty': qty,
-                    'avg_cost': avg_cost,
-                    'current_price': current_price,
-                    'gains': gains,
-                    'profit': profit
-                })
-                invested_value += avg_cost * qty
-                open_value += current_price * qty
+        try:
+            portfolio_data = self._load_portfolio(project_name)
+            if portfolio_data is None:
+                return {'error': 'Project not found'}, 404
 
+            valuation = portfolio.summary(portfolio_data, self._portfolio_prices(project_name, portfolio_data, fresh))
             return {
-                'positions': positions,
-                'invested_value': invested_value,
-                'open_value': open_value
+                'positions': valuation['positions'],
+                'invested_value': valuation['invested_value'],
+                'open_value': valuation['open_value'],
+                'valued_at': valuation['valued_at']
             }, 200
 
         except Exception as e:
             return {'error': str(e)}, 500
 
-    def get_trade_logs(self, project, page, per_page):
-        trades_ref = self.db.collection('paper_trades').where('project', '==', project)
-        total = len(list(trades_ref.stream()))
-        logs = trades_ref.offset((page - 1) * per_page).limit(per_page).stream()
-        
-        data = [log.to_dict() for log in logs]
-        page_count = (total + per_page - 1) // per_page  # Calculating page count
+    def revalue_portfolios(self):
+        """Revalues every portfolio at current prices, resolved in one batch for all their tickers."""
+        portfolios = [doc.to_dict() for doc in self.db.collection('paper_portfolios').stream()]
+        prices = self.get_current_prices(sorted({ticker for data in portfolios for ticker in data['positions']}))
+        now = datetime.datetime.now()
+        with FirestoreBulkWriter(self.db) as writer:
+            for data in portfolios:
+                writer.update(portfolio.portfolio_ref(self.db, data['project']), {
+                    'prices': {ticker: prices[ticker] for ticker in data['positions'] if ticker in prices},
+                    'valued_at': now
+                })
+        return len(portfolios)
+
+    def _load_portfolio(self, project_name):
+        """Returns the portfolio document, building it from the project and its positions when missing."""
+        portfolio_ref = portfolio.portfolio_ref(self.db, project_name)
+        portfolio_doc = portfolio_ref.get()
+        if portfolio_doc.exists:
+            return portfolio_doc.to_dict()
+
+        project_ref = self.db.collection('paper_projects').document(project_name)
+        positions_query = self.db.collection('trade_positions').where('project', '==', project_name)
+
+        def execute(transaction):
+            snapshots = self._get_in_transaction(transaction, [project_ref, portfolio_ref])
+            if snapshots[portfolio_ref.path] is not None:
+                return snapshots[portfolio_ref.path]
+            if snapshots[project_ref.path] is None:
+                return None
+            positions = [doc.to_dict() for doc in positions_query.stream(transaction=transaction)]
+            trade_count = self._count(self._trades_query(project_name), transaction)
+            portfolio_data = portfolio.build(project_name, snapshots[project_ref.path], positions, datetime.datetime.now(), trade_count)
+            transaction.set(portfolio_ref, portfolio_data)
+            return portfolio_data
+
+        return run_transaction(self.db, execute, self.max_attempts)
+
+    def _portfolio_prices(self, project_name, portfolio_data, fresh):
+        """Prices of the last valuation; `fresh`, or tickers it has no price for, are priced now and stored."""
+        prices = dict(portfolio_data.get('prices') or {})
+        missing = [ticker for ticker in portfolio_data['positions'] if fresh or ticker not in prices]
+        if not missing:
+            return prices
+
+        prices.update(self.get_current_prices(missing))
+        changes = {'prices': {ticker: prices[ticker] for ticker in portfolio_data['positions'] if ticker in prices}}
+        if fresh:
+            changes['valued_at'] = datetime.datetime.now()
+            portfolio_data['valued_at'] = changes['valued_at']
+        portfolio.portfolio_ref(self.db, project_name).update(changes)
+        return prices
+
+    def get_trade_logs(self, project, per_page=50, page_token=None, ticker=None, side=None, start=None, end=None):
+        """Returns a page of the project's trades, newest first, and the token of the next page.
+
+        Pages are read with a cursor on (create_date, document id) instead of an
+        offset, so every page costs the same whatever its depth.
+        """
+        if not project:
+            return {'error': 'Missing "project" parameter'}, 400
+        if side not in (None, 'buy', 'sell'):
+            return {'error': 'Invalid "side" parameter'}, 400
+
+        try:
+            cursor = self._decode_page_token(page_token) if page_token else None
+            start = datetime.datetime.fromisoformat(start) if start else None
+            end = datetime.datetime.fromisoformat(end) if end else None
+        except ValueError:
+            return {'error': 'Invalid "page_token", "start" or "end" parameter'}, 400
+
+        # Checked before querying, a filtered query of an unknown project would just come back empty
+        portfolio_data = self._load_portfolio(project)
+        if portfolio_data is None:
+            return {'error': 'Project not found'}, 404
+
+        trades_query = self._trades_query(project, ticker.upper() if ticker else None, side, start, end)
+        page_query = trades_query.order_by('create_date', direction='DESCENDING').order_by('__name__', direction='DESCENDING')
+        if cursor is not None:
+            page_query = page_query.start_after(cursor)
+        logs = list(page_query.limit(per_page + 1).stream())
+
+        next_page_token = None
+        if len(logs) > per_page:
+            logs = logs[:per_page]
+            next_page_token = self._encode_page_token(logs[-1])
+
+        # The unfiltered total is kept on the portfolio, filtered ones are counted by an aggregation
+        total = None
+        if not any([ticker, side, start, end]):
+            total = portfolio_data.get('trade_count')
+        if total is None:
+            total = self._count(trades_query)
 
         pagination = {
             'total': total,
-            'page_count': page_count,
-            'page': page,
-            'per_page': per_page
+            'page_count': (total + per_page - 1) // per_page,
+            'per_page': per_page,
+            'next_page_token': next_page_token
         }
 
-        return {'pagination': pagination, 'data': data}, 200
+        return {'pagination': pagination, 'data': [log.to_dict() for log in logs]}, 200
+
+    def _trades_query(self, project, ticker=None, side=None, start=None, end=None):
+        """Trades of a project; every filter combination has a composite index in firestore.indexes.json."""
+        query = self.db.collection('paper_trades').where('project', '==', project)
+        if ticker:
+            query = query.where('ticker', '==', ticker)
+        if side:
+            query = query.where('type', '==', side)
+        if start:
+            query = query.where('create_date', '>=', start)
+        if end:
+            query = query.where('create_date', '<', end)
+        return query
+
+    def _count(self, query, transaction=None):
+        return query.count().get(transaction=transaction)[0][0].value
+
+    def _encode_page_token(self, snapshot):
+        cursor = {'create_date': snapshot.get('create_date').isoformat(), 'id': snapshot.id}
+        return base64.urlsafe_b64encode(json.dumps(cursor).encode('utf-8')).decode('ascii')
+
+    def _decode_page_token(self, page_token):
+        try:
+            cursor = json.loads(base64.urlsafe_b64decode(page_token.encode('ascii')))
+            return {'create_date': datetime.datetime.fromisoformat(cursor['create_date']), '__name__': cursor['id']}
+        except (TypeError, KeyError, UnicodeError, binascii.Error, json.JSONDecodeError) as e:
+            raise ValueError(f"Invalid page token: {e}")
 
     def manage_watchlist(self, data):
         project = data.get('project')
@@ -292,9 +514,8 @@ class TradeService:
             "project": "main",
             "action": "list"
         })
-        print(response)
         if "watchlist" not in response:
-            print("!!! NO MAIN WATCHLIST FOUND !!!")
+            logger.warning("No main watchlist found: %s", response)
             return []
         return response["watchlist"]
 
@@ -303,10 +524,9 @@ class TradeService:
             return {'error': 'Missing "tickers" parameter'}, 400
         
         tickers_list = tickers.split(',')
-        prices = {}
-        for ticker in tickers_list:
-            price = self.get_current_price(ticker)
-            if price is not None:
-                prices[ticker] = price
-        
+        prices = self.get_current_prices(tickers_list)
+
         return prices, 200
+
+    def get_quote_cache_stats(self):
+        return self.quote_cache.stats(), 200